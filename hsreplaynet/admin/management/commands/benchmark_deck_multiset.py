@@ -0,0 +1,114 @@
+"""
+Compare the list-based deck containment operations Deck used to implement against
+the count-based multiset ones, over randomly generated but realistic deck pairs:
+full 30 card decks and partial decks revealed during a game.
+
+Decks start out as (dbf_id, count) rows, like Deck.card_view. The list-based
+operations expand them into card lists on every call, like card_dbf_id_list() did,
+while the multiset operations use counts built once per deck, like Deck.card_counts.
+"""
+import random
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+
+from hsreplaynet.utils.collections import multiset_issubset
+
+
+def random_deck(rng, card_pool):
+	deck = []
+	while len(deck) < 30:
+		card = rng.choice(card_pool)
+		if deck.count(card) < 2:
+			deck.append(card)
+	return deck
+
+
+def revealed_cards(rng, deck):
+	# Roughly what gets revealed of an opponent's deck in a game
+	return rng.sample(deck, rng.randint(5, 20))
+
+
+def expand(rows):
+	result = []
+	for dbf_id, count in rows:
+		for i in range(count):
+			result.append(dbf_id)
+	return result
+
+
+def list_issubset(sub, sup):
+	sub = expand(sub)
+	sup = expand(sup)
+	for dbf_id in sub:
+		try:
+			sup.remove(dbf_id)
+		except ValueError:
+			return False
+	return True
+
+
+def list_difference(a, b):
+	a = expand(a)
+	for dbf_id in expand(b):
+		if dbf_id in a:
+			a.remove(dbf_id)
+	return Counter(a)
+
+
+def list_packed(rows):
+	cardlist = expand(rows)
+	return [(id, cardlist.count(id)) for id in sorted(set(cardlist))]
+
+
+def counter_packed(counts):
+	return sorted(counts.items())
+
+
+def measure(fn, pairs, iterations):
+	durations = []
+	for _ in range(iterations):
+		start = time.perf_counter()
+		result = [fn(a, b) for a, b in pairs]
+		durations.append(time.perf_counter() - start)
+	return min(durations), result
+
+
+class Command(BaseCommand):
+	help = "Compare list-based and multiset deck containment operations."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--pairs", type=int, default=10000, help="Number of deck pairs")
+		parser.add_argument("--pool-size", type=int, default=250, help="Cards to pick decks from")
+		parser.add_argument("-n", "--iterations", type=int, default=5)
+		parser.add_argument("--seed", type=int, default=1)
+
+	def handle(self, *args, **options):
+		rng = random.Random(options["seed"])
+		card_pool = list(range(1, options["pool_size"] + 1))
+
+		list_pairs = []
+		for _ in range(options["pairs"]):
+			full = random_deck(rng, card_pool)
+			other = revealed_cards(
+				rng, full if rng.random() < 0.5 else random_deck(rng, card_pool)
+			)
+			list_pairs.append((list(Counter(other).items()), list(Counter(full).items())))
+		counter_pairs = [(Counter(dict(a)), Counter(dict(b))) for a, b in list_pairs]
+
+		benchmarks = (
+			("issubset", list_issubset, multiset_issubset),
+			("difference", list_difference, lambda a, b: a - b),
+			("packed list", lambda a, b: list_packed(b), lambda a, b: counter_packed(b)),
+		)
+		for name, list_fn, counter_fn in benchmarks:
+			list_duration, list_result = measure(list_fn, list_pairs, options["iterations"])
+			counter_duration, counter_result = measure(
+				counter_fn, counter_pairs, options["iterations"]
+			)
+			assert list_result == counter_result, "%s results differ" % (name)
+			self.stdout.write("%-12s list %8.2fms  multiset %8.2fms  (%.1fx)" % (
+				name, list_duration * 1000, counter_duration * 1000,
+				list_duration / counter_duration
+			))
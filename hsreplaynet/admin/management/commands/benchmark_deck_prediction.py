@@ -0,0 +1,96 @@
+"""
+Compare deck prediction latency of the server-side (Lua) inverse lookup table
+implementation against the client-side loop, using a scratch Redis database.
+
+Fuzzy predictions are forced by predicting partial decks that contain cards which
+were never observed, so each prediction has to relax the intersection a few times.
+"""
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from hearthstone.enums import CardClass, FormatType
+from redis import StrictRedis
+
+from hsreplaynet.utils.prediction import RedisInverseLookupTable
+
+
+def random_deck(rng, card_pool):
+	dbf_map = {}
+	while sum(dbf_map.values()) < 30:
+		card = rng.choice(card_pool)
+		if dbf_map.get(card, 0) < 2:
+			dbf_map[card] = dbf_map.get(card, 0) + 1
+	return dbf_map
+
+
+def partial_deck(rng, dbf_map, known_cards, unknown_cards):
+	cards = rng.sample(sorted(dbf_map), known_cards)
+	result = {card: 1 for card in cards}
+	for i in range(unknown_cards):
+		result[10 ** 6 + i] = 1
+	return result
+
+
+def measure(ilt, lookups):
+	durations = []
+	matches = 0
+	for dbf_map in lookups:
+		start = time.perf_counter()
+		if ilt.predict(dbf_map):
+			matches += 1
+		durations.append(time.perf_counter() - start)
+	return durations, matches
+
+
+class Command(BaseCommand):
+	help = "Compare client-side and server-side inverse lookup table deck prediction."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+		parser.add_argument("--decks", type=int, default=2000, help="Number of decks to observe")
+		parser.add_argument("--predictions", type=int, default=500)
+		parser.add_argument(
+			"--known-cards", type=int, default=8, help="Observed cards per lookup"
+		)
+		parser.add_argument(
+			"--unknown-cards", type=int, default=2, help="Unseen cards per lookup"
+		)
+		parser.add_argument("--seed", type=int, default=1)
+
+	def handle(self, *args, **options):
+		rng = random.Random(options["seed"])
+		redis = StrictRedis.from_url(options["redis_url"])
+		redis.flushdb()
+
+		card_pool = list(range(1, 301))
+		decks = [random_deck(rng, card_pool) for _ in range(options["decks"])]
+
+		common = dict(min_cards_for_prediction=3, max_fuzzy_cards_removed=6)
+		observer = RedisInverseLookupTable(redis, FormatType.FT_STANDARD, CardClass.DRUID)
+		for deck_id, dbf_map in enumerate(decks, start=1):
+			observer.observe(dbf_map, deck_id)
+
+		lookups = [
+			partial_deck(
+				rng, rng.choice(decks), options["known_cards"], options["unknown_cards"]
+			) for _ in range(options["predictions"])
+		]
+
+		for name, use_lua in (("client-side", False), ("server-side", True)):
+			ilt = RedisInverseLookupTable(
+				redis, FormatType.FT_STANDARD, CardClass.DRUID, use_lua=use_lua, **common
+			)
+			durations, matches = measure(ilt, lookups)
+			durations_ms = sorted(d * 1000 for d in durations)
+			self.stdout.write("%-12s mean %7.3fms  p50 %7.3fms  p95 %7.3fms  matches %i/%i" % (
+				name,
+				statistics.mean(durations_ms),
+				durations_ms[len(durations_ms) // 2],
+				durations_ms[int(len(durations_ms) * 0.95)],
+				matches,
+				len(lookups),
+			))
+
+		redis.flushdb()
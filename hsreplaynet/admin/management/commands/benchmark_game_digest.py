@@ -0,0 +1,70 @@
+"""
+Compare computing the GlobalGame digest in its own pass over the packet tree against
+computing it in the same pass that builds the entity tree.
+
+The two-pass mode mirrors what do_process_upload_event() used to do: export the entity
+tree, then walk all packets again with GameDigestExporter.
+"""
+import time
+
+from django.core.management.base import BaseCommand
+from hslog import LogParser
+from hslog.export import EntityTreeExporter
+
+from hsreplaynet.games.exporters import GameDigestExporter, GameDigestMixin
+
+
+class DigestingEntityTreeExporter(GameDigestMixin, EntityTreeExporter):
+	pass
+
+
+def two_pass(packet_tree):
+	EntityTreeExporter(packet_tree).export()
+	return GameDigestExporter(packet_tree).export().digest
+
+
+def single_pass(packet_tree):
+	return DigestingEntityTreeExporter(packet_tree).export().digest
+
+
+def parse(path):
+	p = LogParser()
+	p._game_state_processor = "GameState"
+	with open(path, "r") as f:
+		p.read(f)
+	return p.games
+
+
+def measure(fn, packet_trees, iterations):
+	durations = []
+	for _ in range(iterations):
+		start = time.perf_counter()
+		digests = [fn(packet_tree) for packet_tree in packet_trees]
+		durations.append(time.perf_counter() - start)
+	return min(durations), digests
+
+
+class Command(BaseCommand):
+	help = "Compare single and two pass GlobalGame digest computation."
+
+	def add_arguments(self, parser):
+		parser.add_argument("-n", "--iterations", type=int, default=10, help="Runs per mode")
+		parser.add_argument("log_paths", nargs="+", help="Paths to the power.log files to export")
+
+	def handle(self, *args, **options):
+		for path in options["log_paths"]:
+			packet_trees = parse(path)
+			num_packets = sum(len(list(tree.recursive_iter())) for tree in packet_trees)
+			self.stdout.write("%s (%i games, %i packets)" % (
+				path, len(packet_trees), num_packets
+			))
+
+			results = {}
+			for name, fn in (("two-pass", two_pass), ("single-pass", single_pass)):
+				duration, digests = measure(fn, packet_trees, options["iterations"])
+				results[name] = digests
+				self.stdout.write("  %-12s %8.2fms  %10.0f packets/s" % (
+					name, duration * 1000, num_packets / duration
+				))
+
+			assert results["two-pass"] == results["single-pass"], "Digests differ!"
@@ -0,0 +1,83 @@
+"""
+Compare peak memory and throughput of buffered vs. streaming Power.log parsing.
+
+The buffered path mirrors what parse_upload_event() used to do (decode the whole
+log into a StringIO), the streaming path feeds chunks through iter_decoded_lines().
+"""
+import os
+import time
+import tracemalloc
+from io import StringIO
+
+from django.core.management.base import BaseCommand
+from hslog import LogParser
+
+from hsreplaynet.uploads.utils import iter_decoded_lines
+
+
+def _new_parser():
+	p = LogParser()
+	p._game_state_processor = "GameState"
+	return p
+
+
+def parse_buffered(path, chunk_size):
+	with open(path, "rb") as f:
+		log_bytes = f.read()
+	powerlog = StringIO(log_bytes.decode("utf-8"))
+	p = _new_parser()
+	p.read(powerlog)
+	return p
+
+
+def parse_streaming(path, chunk_size):
+	def chunks(f):
+		while True:
+			data = f.read(chunk_size)
+			if not data:
+				break
+			yield data
+
+	p = _new_parser()
+	with open(path, "rb") as f:
+		for line in iter_decoded_lines(chunks(f)):
+			p.read_line(line)
+	return p
+
+
+def measure(fn, path, chunk_size, iterations):
+	durations = []
+	peak = 0
+	for _ in range(iterations):
+		tracemalloc.start()
+		start = time.perf_counter()
+		fn(path, chunk_size)
+		durations.append(time.perf_counter() - start)
+		peak = max(peak, tracemalloc.get_traced_memory()[1])
+		tracemalloc.stop()
+	return min(durations), peak
+
+
+class Command(BaseCommand):
+	help = "Compare buffered and streaming Power.log parsing."
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			"-n", "--iterations", type=int, default=3, help="Runs per parsing mode"
+		)
+		parser.add_argument(
+			"-c", "--chunk-size", type=int, default=64 * 1024, help="Streaming read size in bytes"
+		)
+		parser.add_argument("log_paths", nargs="+", help="Paths to the power.log files to parse")
+
+	def handle(self, *args, **options):
+		for path in options["log_paths"]:
+			size_mb = os.path.getsize(path) / (1024 * 1024)
+			self.stdout.write("%s (%.2f MB)" % (path, size_mb))
+			for name, fn in (("buffered", parse_buffered), ("streaming", parse_streaming)):
+				duration, peak = measure(
+					fn, path, options["chunk_size"], options["iterations"]
+				)
+				self.stdout.write("  %-10s %8.3fs  %8.2f MB/s  peak %8.2f MB" % (
+					name, duration, size_mb / duration, peak / (1024 * 1024)
+				))
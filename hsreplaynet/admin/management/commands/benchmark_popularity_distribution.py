@@ -0,0 +1,118 @@
+"""
+Compare reading popularity distributions by unioning every bucket of the requested
+window on each read against reading incrementally maintained summaries, using a
+scratch Redis database.
+
+The read pattern mirrors PlayedCardsDistributionView: 13 sliding 300 second windows,
+5 seconds apart and limited to the 20 most popular cards, over a distribution with
+max_items=5000 and 5 second buckets, with new observations arriving between requests.
+"""
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand
+from redis import StrictRedis
+
+from hsreplaynet.utils.redis import RedisPopularityDistribution
+
+
+def populate(distribution, rng, cards, plays_per_second, seconds):
+	now = datetime.utcnow()
+	for i in range(seconds, 0, -1):
+		plays = [rng.choice(cards) for _ in range(plays_per_second)]
+		distribution.increment_many(plays, as_of=now - timedelta(seconds=i))
+
+
+def windows(base_ts):
+	for i in range(0, 61, 5):
+		end_ts = base_ts + timedelta(seconds=i)
+		yield end_ts - timedelta(seconds=300), end_ts
+
+
+def union_read(distribution, start_ts, end_ts, limit):
+	# What distribution() used to do for windows that include the current bucket
+	redis = distribution.redis
+	start_token = distribution._to_start_token(start_ts)
+	end_token = distribution._to_end_token(end_ts)
+	summary_key = "BENCHMARK:%s:%s" % (start_token, end_token)
+	buckets = [
+		distribution._bucket_key(s, e)
+		for s, e in distribution._generate_bucket_tokens_between(start_token, end_token)
+	]
+	redis.zunionstore(summary_key, buckets)
+	redis.expire(summary_key, distribution.ttl)
+	raw_data = redis.zrevrange(summary_key, 0, -1 if not limit else limit, withscores=True)
+	return {k.decode("utf8"): int(v) for k, v in raw_data}
+
+
+def summary_read(distribution, start_ts, end_ts, limit):
+	return distribution.distribution(start_ts=start_ts, end_ts=end_ts, limit=limit)
+
+
+def measure(distribution, read, rng, cards, requests, plays_per_second, limit):
+	durations = []
+	for _ in range(requests):
+		plays = [rng.choice(cards) for _ in range(plays_per_second)]
+		distribution.increment_many(plays)
+
+		now = datetime.utcnow()
+		base_ts = now - timedelta(seconds=60, microseconds=now.microsecond)
+		base_ts -= timedelta(seconds=base_ts.second % distribution.bucket_size)
+
+		start = time.perf_counter()
+		for start_ts, end_ts in windows(base_ts):
+			read(distribution, start_ts, end_ts, limit)
+		durations.append(time.perf_counter() - start)
+	return durations
+
+
+class Command(BaseCommand):
+	help = "Compare union and summary based popularity distribution reads."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--redis-url", default="redis://localhost:6379/15")
+		parser.add_argument(
+			"--cards", type=int, default=2000, help="Number of distinct cards"
+		)
+		parser.add_argument(
+			"--plays-per-second", type=int, default=50, help="Observations per second of history"
+		)
+		parser.add_argument(
+			"--requests", type=int, default=50, help="Number of view requests"
+		)
+		parser.add_argument("--limit", type=int, default=20, help="Cards per distribution")
+		parser.add_argument("--seed", type=int, default=1)
+
+	def handle(self, *args, **options):
+		rng = random.Random(options["seed"])
+		redis = StrictRedis.from_url(options["redis_url"])
+		redis.flushdb()
+
+		distribution = RedisPopularityDistribution(
+			redis, name="BENCHMARK", namespace="POPULARITY", ttl=600, max_items=5000,
+			bucket_size=5
+		)
+		cards = list(range(1, options["cards"] + 1))
+		populate(distribution, rng, cards, options["plays_per_second"], 600)
+
+		now = datetime.utcnow()
+		for start_ts, end_ts in windows(now - timedelta(seconds=60)):
+			assert union_read(distribution, start_ts, end_ts, None) == \
+				summary_read(distribution, start_ts, end_ts, None), "Distributions differ!"
+
+		for name, read in (("union", union_read), ("summary", summary_read)):
+			durations = measure(
+				distribution, read, rng, cards,
+				options["requests"], options["plays_per_second"], options["limit"]
+			)
+			durations_ms = sorted(d * 1000 for d in durations)
+			self.stdout.write("%-8s per request: mean %8.3fms  p50 %8.3fms  p95 %8.3fms" % (
+				name,
+				statistics.mean(durations_ms),
+				durations_ms[len(durations_ms) // 2],
+				durations_ms[int(len(durations_ms) * 0.95)],
+			))
+
+		redis.flushdb()
@@ -0,0 +1,106 @@
+"""
+Benchmark the CPU time fetch_query_results() spends per cache hit.
+
+Compares serializing the results and compressing them in GZipMiddleware on every
+request (as before) with serving the stored, pre-compressed body, with and without a
+matching If-None-Match header.
+"""
+import json
+import statistics
+import time
+from datetime import datetime
+from unittest.mock import patch
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from django.middleware.gzip import GZipMiddleware
+from django.test import RequestFactory
+
+from hsreplaynet.analytics import processing, views
+
+
+class BenchmarkQuery:
+	"""A parameterized query whose results are always available."""
+
+	query_name = "list_decks_by_win_rate"
+	cache_key = "list_decks_by_win_rate:BENCHMARK"
+	result_available = True
+	result_as_of = datetime(2018, 1, 1)
+	response_payload_type = "application/json"
+	is_personalized = False
+	has_premium_values = False
+	supplied_filters_dict = {"GameType": "RANKED_STANDARD"}
+	supplied_non_filters_dict = {}
+
+	def __init__(self, decks):
+		# Shaped like the list_decks_by_win_rate results
+		self.response_payload = {"series": {"data": {"ALL": [{
+			"deck_id": "%024i" % (i),
+			"deck_list": json.dumps([[i * 10 + card, 2] for card in range(15)]),
+			"archetype_id": i % 200,
+			"total_games": 1000 + i,
+			"win_rate": 50 + (i % 1000) / 100,
+			"avg_game_length_seconds": 400 + i % 300,
+			"avg_num_player_turns": 8 + i % 5,
+		} for i in range(decks)]}}, "as_of": "2018-01-01T00:00:00"}
+
+	@property
+	def response_payload_data(self):
+		return json.dumps(self.response_payload)
+
+
+def fetch_uncompressed(request, name):
+	# The response fetch_query_results() used to build on every cache hit
+	query = views._get_query_and_params(request, name)
+	return HttpResponse(
+		content=query.response_payload_data, content_type=query.response_payload_type
+	)
+
+
+class Command(BaseCommand):
+	help = "Measure the CPU time spent serving cached analytics query results."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--decks", type=int, default=2000, help="Rows in the results")
+		parser.add_argument("--requests", type=int, default=200)
+
+	def handle(self, *args, **options):
+		query = BenchmarkQuery(options["decks"])
+		rf = RequestFactory()
+
+		with patch.object(processing, "caches", {"redshift": LocMemCache("bench", {})}), \
+			patch.object(views, "_get_query_and_params", return_value=query), \
+			patch.object(views, "trigger_if_stale", return_value=False), \
+			patch.object(views, "count_query_read"), \
+			patch.object(views, "influx"):
+			etag = views._get_query_result_etag(
+				processing.compress_query_result(query), gzipped=True
+			)
+			cases = [
+				("serialize + gzip", fetch_uncompressed, {}),
+				("pre-compressed", views.fetch_query_results, {}),
+				("If-None-Match", views.fetch_query_results, {"HTTP_IF_NONE_MATCH": etag}),
+			]
+
+			self.stdout.write("%18s %8s %12s %12s" % ("", "status", "bytes", "CPU ms/req"))
+			for label, view, headers in cases:
+				middleware = GZipMiddleware(lambda request: view(request, query.query_name))
+				cpu_times = []
+				for _ in range(options["requests"]):
+					request = rf.get(
+						"/analytics/query/%s/" % (query.query_name),
+						HTTP_ACCEPT_ENCODING="gzip, deflate", **headers
+					)
+					request.user = AnonymousUser()
+					start = time.process_time()
+					response = middleware(request)
+					cpu_times.append(time.process_time() - start)
+
+				self.stdout.write("%18s %8i %12i %12.3f" % (
+					label,
+					response.status_code,
+					len(response.content),
+					statistics.mean(cpu_times) * 1000
+				))
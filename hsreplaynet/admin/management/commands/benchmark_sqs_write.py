@@ -0,0 +1,77 @@
+"""
+Benchmark write_messages_to_queue() against a local SQS stand-in.
+
+The stand-in accepts every batch after a fixed delay, approximating the round trip to
+SQS, so the results show how throughput scales with the number of batches in flight.
+"""
+import statistics
+import threading
+import time
+from unittest.mock import patch
+
+from django.core.management.base import BaseCommand
+
+from hsreplaynet.utils.aws import sqs
+
+
+class SQSStandIn:
+	"""Accepts every message batch after `latency` seconds."""
+
+	def __init__(self, latency):
+		self.latency = latency
+		self.lock = threading.Lock()
+		self.create_queue_calls = 0
+		self.messages = 0
+
+	def create_queue(self, QueueName):
+		self.create_queue_calls += 1
+		return {"QueueUrl": "https://queue.local/%s" % (QueueName)}
+
+	def send_message_batch(self, QueueUrl, Entries):
+		time.sleep(self.latency)
+		with self.lock:
+			self.messages += len(Entries)
+		return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+
+class Command(BaseCommand):
+	help = "Measure SQS message write throughput against a local stand-in."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--messages", type=int, default=5000)
+		parser.add_argument(
+			"--latency-ms", type=float, default=20, help="Round trip per batch"
+		)
+		parser.add_argument(
+			"--in-flight", type=int, nargs="+",
+			default=[1, 4, sqs.SQS_MAX_IN_FLIGHT_BATCHES, 16],
+			help="Batches in flight to compare"
+		)
+		parser.add_argument("--iterations", type=int, default=3)
+
+	def handle(self, *args, **options):
+		# Shaped like the query permutations cache warming queues
+		messages = [{
+			"query_name": "LIST_DECKS_BY_WIN_RATE",
+			"supplied_parameters": {"GameType": "RANKED_STANDARD", "Region": str(i)},
+		} for i in range(options["messages"])]
+
+		self.stdout.write("%10s %14s %12s %14s" % (
+			"in flight", "messages/s", "mean ms", "create_queue"
+		))
+		for max_in_flight in options["in_flight"]:
+			stand_in = SQSStandIn(options["latency_ms"] / 1000)
+			durations = []
+			with patch.object(sqs, "SQS", stand_in), patch.object(sqs, "_queue_urls", {}):
+				for _ in range(options["iterations"]):
+					start = time.perf_counter()
+					sqs.write_messages_to_queue(
+						"BENCHMARK_QUEUE", messages, max_in_flight=max_in_flight
+					)
+					durations.append(time.perf_counter() - start)
+
+			assert stand_in.messages == len(messages) * options["iterations"]
+			mean = statistics.mean(durations)
+			self.stdout.write("%10i %14.0f %12.1f %14i" % (
+				max_in_flight, len(messages) / mean, mean * 1000, stand_in.create_queue_calls
+			))
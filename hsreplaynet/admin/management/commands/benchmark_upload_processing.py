@@ -0,0 +1,366 @@
+"""
+Benchmark do_process_upload_event() against a corpus of uploads.
+
+Each upload is a directory in the hsreplay-test-data layout (a `descriptor.json` next
+to a `power.log`). Every iteration runs inside a transaction that is rolled back, so
+the corpus can be replayed any number of times without leaving anything behind.
+
+S3 is replaced by a temporary FileSystemStorage, Redis by fakeredis (or a scratch
+server given with --redis-url) and Firehose by a stand-in that accepts all records.
+"""
+import json
+import os
+import resource
+import shutil
+import statistics
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+from io import BytesIO
+from unittest.mock import patch
+
+from django.core.files.storage import FileSystemStorage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils.timezone import now
+
+from hearthsim.identity.accounts.models import AuthToken
+from hearthsim.identity.api.models import APIKey
+from hsreplaynet.games import processing
+from hsreplaynet.games.serializers import UploadEventSerializer
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus, _generate_upload_key
+
+
+# Functions of hsreplaynet.games.processing that are timed, by stage. Time spent in
+# nested stages (eg. the digest within find_or_create_global_game) is only
+# attributed to the innermost one.
+STAGES = {
+	"parse": ("parse_upload_event", ),
+	"validate": ("validate_parser", ),
+	"digest": ("generate_globalgame_digest", ),
+	"global_game": ("find_or_create_global_game", ),
+	"global_players": ("update_global_players", ),
+	"replay": ("find_or_create_replay", ),
+	"live_stats": (
+		"capture_played_card_stats",
+		"update_player_class_distribution",
+		"update_replay_feed",
+		"update_game_counter",
+	),
+}
+OTHER_STAGE = "other"
+FLUSH_STAGE = "flush"
+
+
+class Rollback(Exception):
+	pass
+
+
+class StageProfiler:
+	"""
+	Collects exclusive wall time and query counts per stage.
+	"""
+
+	def __init__(self):
+		self.durations = defaultdict(float)
+		self.queries = defaultdict(int)
+		self._stack = [OTHER_STAGE]
+		self._child_time = [0.0]
+
+	@contextmanager
+	def stage(self, name):
+		self._stack.append(name)
+		self._child_time.append(0.0)
+		start = time.perf_counter()
+		try:
+			yield
+		finally:
+			elapsed = time.perf_counter() - start
+			self._stack.pop()
+			child_time = self._child_time.pop()
+			self.durations[name] += elapsed - child_time
+			self._child_time[-1] += elapsed
+
+	def wrap(self, name, func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			with self.stage(name):
+				return func(*args, **kwargs)
+		return wrapper
+
+	def count_query(self, execute, sql, params, many, context):
+		self.queries[self._stack[-1]] += 1
+		return execute(sql, params, many, context)
+
+	def finish(self, total):
+		self.durations[OTHER_STAGE] += total - sum(self._child_time)
+
+
+class FirehoseStandIn:
+	"""
+	Accepts every record, standing in for both the boto3 client and
+	hsredshift's flush_exporter_to_firehose().
+	"""
+
+	def __init__(self):
+		self.records = 0
+
+	def __call__(self, exporter, records_to_flush=None):
+		self.records += 1
+		return {}
+
+	def put_record(self, DeliveryStreamName, Record):
+		self.records += 1
+		return {"RecordId": str(self.records)}
+
+	def put_record_batch(self, DeliveryStreamName, Records):
+		self.records += len(Records)
+		return {
+			"FailedPutCount": 0,
+			"RequestResponses": [{"RecordId": str(i)} for i in range(len(Records))],
+		}
+
+
+def find_uploads(paths):
+	for path in paths:
+		if os.path.exists(os.path.join(path, "power.log")):
+			yield path
+		elif os.path.isdir(path):
+			for name in sorted(os.listdir(path)):
+				if os.path.exists(os.path.join(path, name, "power.log")):
+					yield os.path.join(path, name)
+		else:
+			raise CommandError("%r is not an upload directory" % (path))
+
+
+def peak_rss_mb():
+	# ru_maxrss is reported in kilobytes on Linux
+	return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+	help = "Replay a corpus of uploads through do_process_upload_event() and time it."
+
+	def add_arguments(self, parser):
+		parser.add_argument("uploads", nargs="+", help="Upload directories, or their parents")
+		parser.add_argument("--iterations", type=int, default=3)
+		parser.add_argument(
+			"--redis-url", help="Scratch Redis server to use instead of fakeredis. "
+			"It will be flushed!"
+		)
+		parser.add_argument(
+			"--budget", help="JSON file with the maximum mean milliseconds per stage "
+			"(\"stages\"), per upload (\"total_ms\"), the maximum mean queries per upload "
+			"(\"queries\") and the maximum peak RSS (\"peak_rss_mb\")"
+		)
+		parser.add_argument("--write-budget", help="Write the results as a budget file")
+		parser.add_argument(
+			"--headroom", type=float, default=0.25,
+			help="Fraction added on top of the results when writing a budget"
+		)
+		parser.add_argument("--output", help="Write the full report as JSON")
+
+	def handle(self, *args, **options):
+		uploads = list(find_uploads(options["uploads"]))
+		if not uploads:
+			raise CommandError("No uploads found")
+
+		samples = []
+		with self.stand_ins(options["redis_url"]) as (redis, storage):
+			for iteration in range(options["iterations"]):
+				for path in uploads:
+					redis.flushdb()
+					samples.append(self.run_upload(path, storage))
+				self.stdout.write("Iteration %i/%i done" % (iteration + 1, options["iterations"]))
+
+		report = self.summarize(samples)
+		self.print_report(report)
+
+		if options["output"]:
+			with open(options["output"], "w") as f:
+				json.dump(report, f, indent="\t", sort_keys=True)
+
+		if options["write_budget"]:
+			self.write_budget(report, options["write_budget"], options["headroom"])
+
+		if options["budget"]:
+			with open(options["budget"]) as f:
+				budget = json.load(f)
+			exceeded = self.check_budget(report, budget)
+			if exceeded:
+				raise CommandError("Regression budget exceeded:\n  " + "\n  ".join(exceeded))
+			self.stdout.write("Within regression budget")
+
+	@contextmanager
+	def stand_ins(self, redis_url):
+		if redis_url:
+			from redis import StrictRedis
+			redis = StrictRedis.from_url(redis_url)
+		else:
+			try:
+				import fakeredis
+			except ImportError:
+				raise CommandError("fakeredis is not installed, use --redis-url instead.")
+			redis = fakeredis.FakeStrictRedis()
+
+		firehose = FirehoseStandIn()
+		media_root = tempfile.mkdtemp(prefix="hsreplaynet-benchmark-")
+		storage = FileSystemStorage(location=media_root)
+
+		with ExitStack() as stack:
+			stack.callback(shutil.rmtree, media_root, ignore_errors=True)
+			stack.enter_context(
+				patch("django.core.files.storage.default_storage._wrapped", storage)
+			)
+			stack.enter_context(
+				patch("django_redis.client.DefaultClient.get_client", lambda *a, **kw: redis)
+			)
+			stack.enter_context(
+				patch.object(processing, "flush_exporter_to_firehose", firehose)
+			)
+			for module in ("decks.models", "uploads.models", "utils.aws.streams"):
+				stack.enter_context(patch("hsreplaynet.%s.FIREHOSE" % (module), firehose))
+			yield redis, storage
+
+	def create_upload_event(self, path, storage):
+		with open(os.path.join(path, "descriptor.json")) as f:
+			descriptor_json = f.read()
+		descriptor = json.loads(descriptor_json)
+		headers = {k.lower(): v for k, v in descriptor["event"]["headers"].items()}
+
+		api_key = APIKey.objects.get_or_create(api_key=headers["x-api-key"], defaults={
+			"full_name": "Benchmark Client",
+			"email": "benchmark@example.org",
+			"website": "https://example.org",
+		})[0]
+		auth_token = AuthToken.objects.get_or_create(
+			key=headers["authorization"].split()[1],
+			creation_apikey=api_key
+		)[0]
+		if not auth_token.user:
+			auth_token.create_fake_user(save=True)
+
+		upload_event = UploadEvent(
+			shortid=descriptor["shortid"],
+			token_uuid=auth_token.key,
+			descriptor_data=descriptor_json,
+			user_agent=headers.get("user-agent", "")[:100],
+			upload_ip="127.0.0.1",
+			status=UploadEventStatus.PROCESSING,
+		)
+		serializer = UploadEventSerializer(upload_event, data=descriptor["upload_metadata"])
+		if not serializer.is_valid():
+			raise CommandError("%s: invalid metadata: %r" % (path, serializer.errors))
+
+		with open(os.path.join(path, "power.log"), "rb") as f:
+			key = _generate_upload_key(now(), upload_event.shortid)
+			upload_event.file = storage.save(key, BytesIO(f.read()))
+		serializer.save()
+		return upload_event
+
+	def run_upload(self, path, storage):
+		profiler = StageProfiler()
+		sample = {"path": path}
+
+		with ExitStack() as stack:
+			for name, functions in STAGES.items():
+				for function in functions:
+					stack.enter_context(patch.object(
+						processing, function, profiler.wrap(name, getattr(processing, function))
+					))
+
+			try:
+				with ExitStack() as atomic:
+					for alias in connections:
+						atomic.enter_context(transaction.atomic(using=alias))
+						atomic.enter_context(
+							connections[alias].execute_wrapper(profiler.count_query)
+						)
+
+					upload_event = self.create_upload_event(path, storage)
+					sample["setup_queries"] = profiler.queries.pop(OTHER_STAGE, 0)
+
+					start = time.perf_counter()
+					replay, do_flush_exporter = processing.do_process_upload_event(upload_event)
+					with profiler.stage(FLUSH_STAGE):
+						do_flush_exporter()
+					profiler.finish(time.perf_counter() - start)
+
+					# Leave nothing behind, so the next iteration starts from scratch
+					raise Rollback()
+			except Rollback:
+				pass
+
+		sample["durations_ms"] = {k: v * 1000 for k, v in profiler.durations.items()}
+		sample["total_ms"] = sum(sample["durations_ms"].values())
+		sample["queries"] = dict(profiler.queries)
+		sample["total_queries"] = sum(profiler.queries.values())
+		sample["peak_rss_mb"] = peak_rss_mb()
+		return sample
+
+	def summarize(self, samples):
+		stages = list(STAGES) + [FLUSH_STAGE, OTHER_STAGE]
+
+		def summary(values):
+			values = sorted(values)
+			return {
+				"mean": statistics.mean(values),
+				"p50": values[len(values) // 2],
+				"max": values[-1],
+			}
+
+		return {
+			"uploads": len(samples),
+			"stages": {
+				stage: dict(
+					summary([s["durations_ms"].get(stage, 0) for s in samples]),
+					queries=statistics.mean([s["queries"].get(stage, 0) for s in samples]),
+				) for stage in stages
+			},
+			"total_ms": summary([s["total_ms"] for s in samples]),
+			"queries": summary([s["total_queries"] for s in samples]),
+			"peak_rss_mb": peak_rss_mb(),
+			"samples": samples,
+		}
+
+	def print_report(self, report):
+		self.stdout.write("%i uploads processed" % (report["uploads"]))
+		self.stdout.write("%-16s %10s %10s %10s %9s" % ("stage", "mean", "p50", "max", "queries"))
+		rows = list(report["stages"].items()) + [("total", dict(
+			report["total_ms"], queries=report["queries"]["mean"]
+		))]
+		for stage, values in rows:
+			self.stdout.write("%-16s %8.2fms %8.2fms %8.2fms %9.1f" % (
+				stage, values["mean"], values["p50"], values["max"], values["queries"]
+			))
+		self.stdout.write("Peak RSS: %.1f MB" % (report["peak_rss_mb"]))
+
+	def check_budget(self, report, budget):
+		exceeded = []
+
+		def check(name, value, limit):
+			if limit is not None and value > limit:
+				exceeded.append("%s: %.2f > %.2f" % (name, value, limit))
+
+		for stage, limit in budget.get("stages", {}).items():
+			if stage not in report["stages"]:
+				raise CommandError("Unknown stage in budget: %r" % (stage))
+			check("%s (ms)" % (stage), report["stages"][stage]["mean"], limit)
+		check("total (ms)", report["total_ms"]["mean"], budget.get("total_ms"))
+		check("queries", report["queries"]["mean"], budget.get("queries"))
+		check("peak RSS (MB)", report["peak_rss_mb"], budget.get("peak_rss_mb"))
+		return exceeded
+
+	def write_budget(self, report, path, headroom):
+		factor = 1 + headroom
+		budget = {
+			"stages": {k: v["mean"] * factor for k, v in report["stages"].items()},
+			"total_ms": report["total_ms"]["mean"] * factor,
+			"queries": report["queries"]["mean"] * factor,
+			"peak_rss_mb": report["peak_rss_mb"] * factor,
+		}
+		with open(path, "w") as f:
+			json.dump(budget, f, indent="\t", sort_keys=True)
+		self.stdout.write("Wrote budget to %s" % (path))
@@ -15,6 +15,10 @@ class Command(BaseCommand):
 		parser.add_argument("--min-observations", default=10, type=int)
 		parser.add_argument("--min-pilots", default=1, type=int)
 		parser.add_argument("--experimental-threshold", default=.01, type=float)
+		parser.add_argument(
+			"--no-wait", action="store_true",
+			help="Create the snapshot when the clustering data query finishes"
+		)
 
 	def handle(self, *args, **options):
 		logger = logging.getLogger()
@@ -33,7 +37,7 @@ class Command(BaseCommand):
 		min_pilots = options["min_pilots"]
 		experimental_threshold = options["experimental_threshold"]
 
-		ClusterSetSnapshot.objects.snapshot(
+		result = ClusterSetSnapshot.objects.snapshot(
 			FormatType.FT_STANDARD,
 			num_clusters=num_clusters,
 			merge_threshold=merge_threshold,
@@ -42,4 +46,7 @@ class Command(BaseCommand):
 			min_observations=min_observations,
 			min_pilots=min_pilots,
 			experimental_threshold=experimental_threshold,
+			block=not options["no_wait"],
 		)
+		if options["no_wait"] and not isinstance(result, ClusterSetSnapshot):
+			logger.info("Clustering data requested, the snapshot will follow.")
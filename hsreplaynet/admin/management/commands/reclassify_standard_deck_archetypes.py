@@ -2,7 +2,7 @@ import json
 import math
 from datetime import date, datetime, timedelta
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from hearthstone.enums import CardClass, FormatType
 from hsarchetypes import classify_deck
 from sqlalchemy import Date, Integer, String
@@ -10,6 +10,7 @@ from sqlalchemy.sql import bindparam, text
 
 from hsreplaynet.decks.models import Archetype, ClusterSnapshot, Deck
 from hsreplaynet.utils.aws import redshift
+from hsreplaynet.utils.aws.streams import FirehoseWriteError
 
 
 REDSHIFT_QUERY = text("""
@@ -172,8 +173,15 @@ class Command(BaseCommand):
 
 		if not is_dry_run:
 			self.stdout.write("Writing results to decks...")
-			for archetype_id, decks in archetypes_to_update.items():
-				Deck.objects.bulk_update_to_archetype(decks, archetype_id)
+			try:
+				with Deck.objects.archetype_firehose_writer() as writer:
+					for archetype_id, decks in archetypes_to_update.items():
+						Deck.objects.bulk_update_to_archetype(decks, archetype_id, writer=writer)
+			except FirehoseWriteError as e:
+				raise CommandError(
+					"%s. Run sync_deck_archetypes_to_redshift to sync the decks already "
+					"updated." % (e)
+				)
 			self.stdout.write("Reclassification complete")
 		else:
 			self.stdout.write("Dry run complete")
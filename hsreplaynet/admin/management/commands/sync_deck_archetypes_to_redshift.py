@@ -1,7 +1,8 @@
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from hearthstone.enums import FormatType
 
 from hsreplaynet.decks.models import Archetype, Deck
+from hsreplaynet.utils.aws.streams import FirehoseWriteError
 
 
 class Command(BaseCommand):
@@ -18,9 +19,13 @@ class Command(BaseCommand):
 			total_decks = len(qs)
 			print("About to Sync %i Decks" % total_decks)
 			counter = 0
-			for deck in qs:
-				counter += 1
-				if deck.archetype_id != deck_archetype_map[deck.digest]:
-					deck.sync_archetype_to_firehose()
-				if counter % 1000 == 0:
-					print("Counter: %i" % counter)
+			try:
+				with Deck.objects.archetype_firehose_writer() as writer:
+					for deck in qs:
+						counter += 1
+						if deck.archetype_id != deck_archetype_map[deck.digest]:
+							deck.sync_archetype_to_firehose(writer=writer)
+						if counter % 1000 == 0:
+							print("Counter: %i" % counter)
+			except FirehoseWriteError as e:
+				raise CommandError("%s. Run the sync again once Firehose recovers." % (e))
@@ -10,7 +10,7 @@ from hearthsim.identity.accounts.models import User
 from hsreplaynet.admin.mailchimp import (
 	AbandonedCartTag, HearthstoneDeckTrackerUserTag, HSReplayNetUserTag, PremiumSubscriberTag
 )
-from hsreplaynet.utils.influx import influx_metric
+from hsreplaynet.utils.influx import enable_influx_buffering, influx_flush, influx_metric
 from hsreplaynet.utils.mailchimp import (
 	find_best_email_for_user, get_mailchimp_client, get_mailchimp_subscription_status
 )
@@ -154,6 +154,14 @@ class Command(BaseCommand):
 						)
 
 	def handle(self, *args, **options):
+		# Every MailChimp request is counted, so batch those writes
+		enable_influx_buffering()
+		try:
+			self._update_tags(options)
+		finally:
+			influx_flush()
+
+	def _update_tags(self, options):
 		self.total_users = User.objects.prefetch_related("emailaddress_set").annotate(
 			count=Count("emailaddress")
 		).filter(count__gt=0, is_active=True).count()
@@ -1,14 +1,19 @@
 import copy
+import hashlib
 import json
 import time
-from collections import defaultdict
+from collections import defaultdict, namedtuple
 from datetime import date, datetime, timedelta
+from gzip import GzipFile
+from io import BytesIO
 from random import seed, shuffle
 
 from django.conf import settings
+from django.core.cache import caches
 from django.db import models
 from django.dispatch.dispatcher import receiver
 from django.utils import timezone
+from django.utils.module_loading import import_string
 from hearthstone.enums import BnetGameType, FormatType
 from redis_lock import Lock as RedisLock
 from redis_semaphore import Semaphore
@@ -16,13 +21,15 @@ from sqlalchemy.sql import and_
 
 from hearthsim.identity.accounts.models import BlizzardAccount
 from hsreplaynet.analytics.utils import (
-	attempt_request_triggered_query_execution, execute_query, trigger_if_stale
+	QUERY_RUNTIMES_KEY, attempt_request_triggered_query_execution, execute_query,
+	get_query_reads, get_queued_queries, record_query_runtime, trigger_if_stale
 )
 from hsreplaynet.decks.models import Deck
 from hsreplaynet.utils import log
 from hsreplaynet.utils.aws import redshift
 from hsreplaynet.utils.aws.sqs import write_messages_to_queue
 from hsreplaynet.utils.influx import influx_metric
+from hsreplaynet.utils.instrumentation import error_handler
 
 
 def _to_lambda_payload(parameterized_query):
@@ -50,6 +57,14 @@ def _do_execute_query(parameterized_query, wlm_queue=None):
 
 
 def _do_execute_query_work(parameterized_query, wlm_queue=None):
+	try:
+		_refresh_if_stale(parameterized_query, wlm_queue)
+	finally:
+		# Cache warming may queue the query again from now on
+		get_queued_queries().discard(parameterized_query.cache_key)
+
+
+def _refresh_if_stale(parameterized_query, wlm_queue=None):
 	if not parameterized_query.result_is_stale:
 		log.info("Up-to-date cached data exists. Exiting without running query.")
 	else:
@@ -84,6 +99,79 @@ def _do_execute_query_work(parameterized_query, wlm_queue=None):
 				**parameterized_query.supplied_filters_dict
 			)
 
+		record_query_runtime(parameterized_query, duration_seconds)
+
+
+COMPRESSED_QUERY_RESULT_KEY = "compressed_query_result:%s"
+# The same CompressedQueryResult without its gzip_data, for conditional requests
+COMPRESSED_QUERY_RESULT_VALIDATORS_KEY = "compressed_query_result_validators:%s"
+
+
+CompressedQueryResult = namedtuple(
+	"CompressedQueryResult", ("as_of", "etag", "content_type", "gzip_data")
+)
+
+
+def compress_query_result(parameterized_query):
+	"""
+	Gzip the query's current results and store them with a strong ETag derived from
+	their contents, so fetch_query_results can serve them as they are.
+	Returns the CompressedQueryResult, or None if there are no results.
+
+	Personalized results are skipped (and None returned): there is one for every user,
+	and storing each of them twice would double their footprint in the cache.
+	"""
+	if parameterized_query.is_personalized or not parameterized_query.result_available:
+		return None
+
+	data = parameterized_query.response_payload_data
+	if isinstance(data, str):
+		data = data.encode("utf-8")
+
+	buf = BytesIO()
+	with GzipFile(mode="wb", compresslevel=9, fileobj=buf, mtime=0) as f:
+		f.write(data)
+
+	result = CompressedQueryResult(
+		as_of=parameterized_query.result_as_of,
+		etag='"%s"' % (hashlib.sha256(data).hexdigest()),
+		content_type=parameterized_query.response_payload_type,
+		gzip_data=buf.getvalue(),
+	)
+	caches["redshift"].set_many({
+		COMPRESSED_QUERY_RESULT_KEY % (parameterized_query.cache_key): result,
+		COMPRESSED_QUERY_RESULT_VALIDATORS_KEY % (parameterized_query.cache_key): (
+			result._replace(gzip_data=None)
+		),
+	}, timeout=settings.ANALYTICS_COMPRESSED_RESULT_TTL)
+	return result
+
+
+def get_compressed_query_result(parameterized_query):
+	"""
+	Return the CompressedQueryResult for the query's current results, compressing
+	them first if that hasn't happened since they were last refreshed.
+	"""
+	result = caches["redshift"].get(
+		COMPRESSED_QUERY_RESULT_KEY % (parameterized_query.cache_key)
+	)
+	if result is None or result.as_of != parameterized_query.result_as_of:
+		result = compress_query_result(parameterized_query)
+	return result
+
+
+def get_compressed_query_result_validators(parameterized_query):
+	"""
+	Like get_compressed_query_result(), but without loading the compressed body:
+	gzip_data is None. Enough to answer conditional requests.
+	"""
+	result = caches["redshift"].get(
+		COMPRESSED_QUERY_RESULT_VALIDATORS_KEY % (parameterized_query.cache_key)
+	)
+	if result is None or result.as_of != parameterized_query.result_as_of:
+		result = compress_query_result(parameterized_query)
+	return result
+
 
 def evict_locks_cache(params):
 	redis_client = redshift.get_redshift_cache_redis_client()
@@ -144,11 +232,7 @@ def fill_global_query_queue(eligible_queries=None, filter_fresh_queries=True):
 	queue_name = settings.REDSHIFT_ANALYTICS_QUERY_QUEUE_NAME
 	messages = get_queries_for_cache_warming(eligible_queries)
 	log.info("Generated %i global query permutations for cache warming." % len(messages))
-	if filter_fresh_queries:
-		messages = filter_freshly_cached_queries(messages)
-		msg = "%i permutations remain after filtering fresh queries" % len(messages)
-		log.info(msg)
-	write_messages_to_queue(queue_name, messages)
+	schedule_cache_warming(queue_name, messages, skip_fresh=filter_fresh_queries)
 
 
 def run_local_warm_queries(eligible_queries=None):
@@ -240,10 +324,7 @@ def fill_personalized_query_queue(contexts, eligible_queries=None):
 		eligible_queries
 	)
 	log.info("Generated %i personalized permutations for cache warming." % len(messages))
-	stale_queries = filter_freshly_cached_queries(messages)
-	msg = "%i personalized perms remain after filtering fresh queries" % len(stale_queries)
-	log.info(msg)
-	write_messages_to_queue(queue_name, stale_queries)
+	schedule_cache_warming(queue_name, messages)
 
 
 def _permutation_matches_game_types(perm, game_types):
@@ -313,6 +394,95 @@ def filter_freshly_cached_queries(messages):
 	return result
 
 
+class CacheWarmingScheduler:
+	"""
+	Orders query permutations for cache warming so that the scarce Redshift slots go
+	to the queries that are read the most, are the most out of date and are the
+	cheapest to run first.
+
+	Permutations with fresh results, duplicates and permutations already queued (or
+	running) are skipped.
+	"""
+
+	def __init__(self, redis=None, catalogue=None):
+		self.redis = redis or redshift.get_redshift_cache_redis_client()
+		self.catalogue = catalogue or redshift.get_redshift_catalogue()
+		self.reads = get_query_reads(self.redis)
+		self.queued = get_queued_queries(self.redis)
+
+	def prioritize(self, messages, skip_fresh=True):
+		"""
+		Return (cache_key, message) pairs for the permutations worth warming,
+		highest priority first.
+		"""
+		now = datetime.utcnow()
+		reads = self.reads.distribution()
+		runtimes = {
+			k.decode("utf-8"): float(v) for k, v in self.redis.hgetall(QUERY_RUNTIMES_KEY).items()
+		}
+		skipped = set(self.queued.members())
+
+		scored = []
+		for msg in messages:
+			query = self.catalogue.get_query(msg["query_name"])
+			parameterized_query = query.build_full_params(msg["supplied_parameters"])
+			cache_key = parameterized_query.cache_key
+			if cache_key in skipped:
+				continue
+			skipped.add(cache_key)
+
+			available = parameterized_query.result_available
+			if available and skip_fresh and not parameterized_query.result_is_stale:
+				continue
+
+			max_staleness = settings.CACHE_WARMING_MAX_STALENESS_SECONDS
+			as_of = parameterized_query.result_as_of if available else None
+			if as_of is not None:
+				staleness = min(max((now - as_of).total_seconds(), 1), max_staleness)
+			else:
+				staleness = max_staleness
+
+			runtime = runtimes.get(
+				cache_key,
+				runtimes.get(msg["query_name"], settings.CACHE_WARMING_DEFAULT_RUNTIME_SECONDS)
+			)
+
+			# Never read permutations still get warmed, after everything that is read
+			score = (1 + reads.get(cache_key, 0)) * staleness / max(runtime, 1)
+			scored.append((score, cache_key, msg))
+
+		scored.sort(key=lambda t: t[0], reverse=True)
+		return [(cache_key, msg) for _, cache_key, msg in scored]
+
+	def schedule(self, queue_name, messages, skip_fresh=True):
+		"""
+		Queue the permutations worth warming in priority order, and return the queued
+		messages.
+		"""
+		prioritized = self.prioritize(messages, skip_fresh=skip_fresh)
+		if not prioritized:
+			return []
+
+		messages = [msg for _, msg in prioritized]
+		write_messages_to_queue(queue_name, messages)
+		self.queued.add(*[cache_key for cache_key, _ in prioritized])
+		return messages
+
+
+def schedule_cache_warming(queue_name, messages, skip_fresh=True):
+	if not settings.ENV_AWS:
+		# We can only reach the cache from inside AWS, so we can neither prioritize
+		# nor filter outside of it. Up-to-date queries will still get skipped at query
+		# execution time.
+		write_messages_to_queue(queue_name, messages)
+		return
+
+	scheduled = CacheWarmingScheduler().schedule(queue_name, messages, skip_fresh=skip_fresh)
+	log.info("%i of %i permutations queued for cache warming" % (
+		len(scheduled), len(messages)
+	))
+
+
 def get_queries_for_cache_warming(eligible_queries=None):
 	queries = []
 	for query in redshift.get_redshift_catalogue().cache_warm_eligible_queries:
@@ -338,13 +508,113 @@ def get_concurrent_redshift_query_queue_semaphore(queue_name):
 	return concurrent_redshift_query_semaphore
 
 
-def get_cluster_set_data(
-	game_format=FormatType.FT_STANDARD,
-	lookback=7,
-	min_observations=100,
-	min_pilots=10,
-	block=True
-):
+class PendingQuery:
+	"""
+	A handle on the results of a parameterized query which may still be running.
+
+	Work that needs the results is handed over with then(), and dispatched by
+	finish_async_redshift_query once they arrive, so nothing has to wait for them.
+	"""
+
+	def __init__(self, parameterized_query, executor=None, redis=None):
+		self.parameterized_query = parameterized_query
+		self.executor = executor or execute_query
+		self.redis = redis or redshift.get_redshift_cache_redis_client()
+
+	@property
+	def ready(self):
+		return (
+			self.parameterized_query.result_available and not
+			self.parameterized_query.result_is_stale
+		)
+
+	@property
+	def response_payload(self):
+		return self.parameterized_query.response_payload if self.ready else None
+
+	def then(self, callback, **kwargs):
+		"""
+		Call `callback` (a dotted path to a function) with the response payload and
+		`kwargs` once the results are available. The callback is dispatched right away
+		if they already are, otherwise once the query finishes. Either way it runs in a
+		do_run_pending_query_callback Lambda on AWS, so `kwargs` must be JSON serializable.
+		"""
+		if self.ready:
+			dispatch_pending_query_callback(self.parameterized_query, callback, kwargs)
+			return
+
+		key = _get_pending_query_callbacks_key(self.parameterized_query.cache_key)
+		pipeline = self.redis.pipeline()
+		pipeline.rpush(key, json.dumps({"callback": callback, "kwargs": kwargs}))
+		pipeline.expire(key, PENDING_QUERY_CALLBACK_TTL)
+		pipeline.execute()
+
+		if self.ready:
+			# The results arrived while we were registering the callback
+			complete_pending_query(self.parameterized_query, redis=self.redis)
+		else:
+			self.executor(self.parameterized_query)
+
+
+PENDING_QUERY_CALLBACK_TTL = 24 * 3600
+
+
+def _get_pending_query_callbacks_key(cache_key):
+	return "pending_query_callbacks:%s" % cache_key
+
+
+def complete_pending_query(parameterized_query, redis=None):
+	"""
+	Dispatch the callbacks waiting on the query's results. Every callback is dispatched
+	at most once, even if the query is completed from several processes at the same
+	time. Callbacks that fail to dispatch are reported and queued again, for the next
+	time the query completes.
+	"""
+	redis = redis or redshift.get_redshift_cache_redis_client()
+	key = _get_pending_query_callbacks_key(parameterized_query.cache_key)
+
+	pipeline = redis.pipeline()
+	pipeline.lrange(key, 0, -1)
+	pipeline.delete(key)
+	callbacks, _ = pipeline.execute()
+
+	for callback in callbacks:
+		try:
+			dispatch_pending_query_callback(
+				parameterized_query, **json.loads(callback.decode("utf-8"))
+			)
+		except Exception as e:
+			error_handler(e)
+			pipeline = redis.pipeline()
+			pipeline.rpush(key, callback)
+			pipeline.expire(key, PENDING_QUERY_CALLBACK_TTL)
+			pipeline.execute()
+
+
+def dispatch_pending_query_callback(parameterized_query, callback, kwargs):
+	if settings.ENV_AWS and settings.PROCESS_REDSHIFT_QUERIES_VIA_LAMBDA:
+		# Callbacks such as clustering can run for minutes, so each gets its own Lambda
+		from hsreplaynet.utils.aws.clients import LAMBDA
+
+		LAMBDA.invoke(
+			FunctionName="do_run_pending_query_callback",
+			InvocationType="Event",
+			Payload=json.dumps({
+				"query_name": parameterized_query.query_name,
+				"supplied_parameters": parameterized_query.supplied_parameters,
+				"callback": callback,
+				"kwargs": kwargs,
+			}),
+		)
+	else:
+		run_pending_query_callback(parameterized_query, callback, kwargs)
+
+
+def run_pending_query_callback(parameterized_query, callback, kwargs):
+	import_string(callback)(parameterized_query.response_payload, **kwargs)
+
+
+def _get_cluster_set_data_query(game_format, lookback, min_observations, min_pilots):
 	from hsreplaynet.utils.aws.redshift import get_redshift_query
 
 	gt = "RANKED_STANDARD" if game_format == FormatType.FT_STANDARD else "RANKED_WILD"
@@ -362,6 +632,46 @@ def get_cluster_set_data(
 	parameterized_query.final_bind_params["min_date"] = today - timedelta(days=lookback)
 	parameterized_query.final_bind_params["max_date"] = today
 
+	return parameterized_query
+
+
+def _execute_cluster_set_data_query(parameterized_query):
+	# The lookback is only set in the query's final_bind_params, which a queued refresh
+	# would lose by rebuilding the query from its supplied parameters. Submit this very
+	# query right away instead, as get_cluster_set_data() does.
+	execute_query(parameterized_query, run_local=True)
+
+
+def get_cluster_set_data_async(
+	game_format=FormatType.FT_STANDARD,
+	lookback=7,
+	min_observations=100,
+	min_pilots=10,
+	executor=None
+):
+	"""
+	Return a PendingQuery for the clustering data, without waiting for it.
+	The query is only executed once something is waiting on it with then().
+	"""
+	parameterized_query = _get_cluster_set_data_query(
+		game_format, lookback, min_observations, min_pilots
+	)
+	return PendingQuery(
+		parameterized_query, executor=executor or _execute_cluster_set_data_query
+	)
+
+
+def get_cluster_set_data(
+	game_format=FormatType.FT_STANDARD,
+	lookback=7,
+	min_observations=100,
+	min_pilots=10,
+	block=True
+):
+	parameterized_query = _get_cluster_set_data_query(
+		game_format, lookback, min_observations, min_pilots
+	)
+
 	def result_available():
 		return (
 			parameterized_query.result_available and not
@@ -412,6 +722,11 @@ RANK_MAP = [
 	"TWENTY"
 ]
 
+META_PREVIEW_CACHE_KEY = "meta_preview"
+META_PREVIEW_REFRESH_REQUESTED_KEY = "meta_preview:refresh_requested"
+META_PREVIEW_STALE_KEY = "meta_preview:stale"
+META_PREVIEW_REBUILT_KEY = "meta_preview:rebuilt"
+
 
 def refresh_meta_preview():
 	from hsreplaynet.utils.aws.redshift import get_redshift_query
@@ -430,16 +745,76 @@ def refresh_meta_preview():
 			))
 			trigger_if_stale(parameterized_query)
 
+	# Pick up the results that finished after the last rebuild
+	update_meta_preview()
 
-def get_meta_preview(num_items=10):
-	from hsreplaynet.utils.aws.clients import LAMBDA
-	from hsreplaynet.utils.aws.redshift import get_redshift_query
 
-	LAMBDA.invoke(
-		FunctionName="do_refresh_meta_preview",
-		InvocationType="Event"
+def is_meta_preview_query(parameterized_query):
+	params = parameterized_query.supplied_parameters
+	return (
+		parameterized_query.query_name == "archetype_popularity_distribution_stats" and
+		params.get("GameType") == "RANKED_STANDARD" and
+		params.get("TimeRange") == "LAST_1_DAY"
 	)
 
+
+def get_meta_preview():
+	"""
+	Return the stored meta preview, as built by update_meta_preview(), or build it
+	if there is none yet.
+
+	Asks for its queries to be refreshed at most every META_PREVIEW_REFRESH_INTERVAL
+	seconds, across all processes.
+	"""
+	from hsreplaynet.utils.aws.clients import LAMBDA
+
+	cache = caches["redshift"]
+	refresh_interval = settings.META_PREVIEW_REFRESH_INTERVAL
+	if cache.add(META_PREVIEW_REFRESH_REQUESTED_KEY, True, timeout=refresh_interval):
+		LAMBDA.invoke(
+			FunctionName="do_refresh_meta_preview",
+			InvocationType="Event"
+		)
+
+	preview = cache.get(META_PREVIEW_CACHE_KEY)
+	if preview is None:
+		preview = build_meta_preview()
+		cache.add(META_PREVIEW_CACHE_KEY, preview, timeout=None)
+
+	return preview
+
+
+def mark_meta_preview_stale():
+	"""Have the next update_meta_preview() rebuild the preview."""
+	caches["redshift"].set(META_PREVIEW_STALE_KEY, True, timeout=None)
+
+
+def update_meta_preview(num_items=10):
+	"""
+	Rebuild the stored meta preview if it is missing or was marked stale, at most
+	once every META_PREVIEW_REBUILD_INTERVAL seconds across all processes. Results
+	finishing in between are picked up by the next call after that.
+
+	Returns the new preview, or None if it wasn't rebuilt.
+	"""
+	cache = caches["redshift"]
+	if not cache.get(META_PREVIEW_STALE_KEY) and cache.get(META_PREVIEW_CACHE_KEY):
+		return None
+
+	rebuild_interval = settings.META_PREVIEW_REBUILD_INTERVAL
+	if not cache.add(META_PREVIEW_REBUILT_KEY, True, timeout=rebuild_interval):
+		return None
+
+	# Cleared before building, so that results finishing meanwhile mark it stale again
+	cache.delete(META_PREVIEW_STALE_KEY)
+	results = build_meta_preview(num_items)
+	cache.set(META_PREVIEW_CACHE_KEY, results, timeout=None)
+	return results
+
+
+def build_meta_preview(num_items=10):
+	from hsreplaynet.utils.aws.redshift import get_redshift_query
+
 	query = get_redshift_query("archetype_popularity_distribution_stats")
 
 	unique_archetypes = set()
@@ -1,9 +1,62 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from django.conf import settings
 
 from hsredshift.analytics.scheduling import QueryRefreshPriority
 from hsreplaynet.utils import influx, log
+from hsreplaynet.utils.aws.redshift import get_redshift_cache_redis_client
+from hsreplaynet.utils.redis import RedisExpiringSet, RedisPopularityDistribution
+
+
+QUERY_RUNTIMES_KEY = "CACHE_WARMING:QUERY_RUNTIMES"
+
+_query_reads = None
+
+
+def get_query_reads(redis=None):
+	"""How often the results of each parameterized query were read, by cache key."""
+	return RedisPopularityDistribution(
+		redis or get_redshift_cache_redis_client(),
+		name="QUERY_READS",
+		namespace="CACHE_WARMING",
+		ttl=int(timedelta(days=7).total_seconds()),
+		max_items=settings.CACHE_WARMING_MAX_TRACKED_QUERIES,
+		bucket_size=int(timedelta(hours=1).total_seconds()),
+	)
+
+
+def count_query_read(parameterized_query):
+	"""
+	Count a read of the query's results towards its cache warming priority.
+	Only reads served to users should be counted, not the ones made internally.
+	"""
+	global _query_reads
+
+	try:
+		if _query_reads is None:
+			_query_reads = get_query_reads()
+		_query_reads.increment(parameterized_query.cache_key)
+	except Exception as e:
+		# The counts only order cache warming, never fail a request over them
+		log.warning("Failed to count read of %s: %s" % (parameterized_query.cache_key, e))
+
+
+def get_queued_queries(redis=None):
+	"""Cache keys of the parameterized queries queued for cache warming or running."""
+	return RedisExpiringSet(
+		redis or get_redshift_cache_redis_client(),
+		name="CACHE_WARMING_QUEUED_QUERIES",
+		ttl=settings.CACHE_WARMING_QUEUED_QUERY_TTL,
+	)
+
+
+def record_query_runtime(parameterized_query, duration_seconds, redis=None):
+	# Also keep the latest runtime per query, for permutations that never ran before
+	redis = redis or get_redshift_cache_redis_client()
+	redis.hmset(QUERY_RUNTIMES_KEY, {
+		parameterized_query.cache_key: duration_seconds,
+		parameterized_query.query_name: duration_seconds,
+	})
 
 
 def trigger_if_stale(parameterized_query, run_local=False, priority=None):
@@ -1,3 +1,4 @@
+import gzip
 import json
 from calendar import timegm
 from collections import defaultdict
@@ -7,6 +8,7 @@ from urllib.parse import urlparse
 from django.conf import settings
 from django.contrib.admin.views.decorators import staff_member_required
 from django.http import Http404, HttpResponse, HttpResponseForbidden, JsonResponse
+from django.middleware.gzip import re_accepts_gzip
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.cache import get_conditional_response, patch_vary_headers
@@ -21,19 +23,18 @@ from hsredshift.analytics.filters import Region
 from hsredshift.analytics.library.base import InvalidOrMissingQueryParameterError
 from hsredshift.analytics.scheduling import QueryRefreshPriority
 from hsreplaynet.analytics.processing import get_meta_preview, get_mulligan_preview
-from hsreplaynet.analytics.utils import trigger_if_stale
+from hsreplaynet.analytics.utils import count_query_read, trigger_if_stale
 from hsreplaynet.decks.models import Archetype, ClusterSetSnapshot, ClusterSnapshot, Deck
 from hsreplaynet.features.decorators import view_requires_feature_access
 from hsreplaynet.utils import influx, log
 from hsreplaynet.utils.aws.redshift import get_redshift_query
 
 from .processing import (
-	attempt_request_triggered_query_execution, evict_locks_cache,
-	get_concurrent_redshift_query_queue_semaphore
+	attempt_request_triggered_query_execution, evict_locks_cache, get_compressed_query_result,
+	get_compressed_query_result_validators, get_concurrent_redshift_query_queue_semaphore
 )
 
 
-META_PREVIEW_CACHE = defaultdict()
 MULLIGAN_PREVIEW_CACHE = defaultdict()
 
 
@@ -203,12 +204,41 @@ def fetch_query_results(request, name):
 			last_modified = timegm(last_modified.utctimetuple())
 
 		response = None
+		etag = None
 
 		is_cache_hit = parameterized_query.result_available
 		if is_cache_hit:
-			trigger_if_stale(parameterized_query)
+			count_query_read(parameterized_query)
+			triggered_refresh = trigger_if_stale(parameterized_query)
+			# Personalized results exist once per user, so they aren't stored compressed
+			use_compressed_result = not parameterized_query.is_personalized
+			if use_compressed_result:
+				validators = get_compressed_query_result_validators(parameterized_query)
+				gzipped = _accepts_gzip(request)
+				etag = _get_query_result_etag(validators, gzipped)
+
 			# Try to return a minimal response
-			response = get_conditional_response(request, last_modified=last_modified)
+			response = get_conditional_response(
+				request, etag=etag, last_modified=last_modified
+			)
+			if not response and request.method == "GET":
+				if use_compressed_result:
+					# Serve the stored results as they are, without re-encoding them
+					compressed_result = get_compressed_query_result(parameterized_query)
+					etag = _get_query_result_etag(compressed_result, gzipped)
+					response = _get_compressed_query_response(compressed_result, gzipped)
+				else:
+					response = HttpResponse(
+						content=parameterized_query.response_payload_data,
+						content_type=parameterized_query.response_payload_type
+					)
+				_log_query_fetch(
+					parameterized_query,
+					user=request.user,
+					cache_is_populated=True,
+					is_cache_hit=True,
+					triggered_refresh=triggered_refresh
+				)
 
 		if not response:
 			if request.method == "HEAD":
@@ -217,9 +247,12 @@ def fetch_query_results(request, name):
 				# Resort to a full response
 				response = _fetch_query_results(parameterized_query, user=request.user)
 
-		# Add Last-Modified header
+		# Add Last-Modified and ETag headers
 		if response.status_code in (200, 204, 304):
 			response["Last-Modified"] = http_date(last_modified)
+			if etag:
+				response["ETag"] = etag
+				patch_vary_headers(response, ["Accept-Encoding"])
 
 		# Add Cache-Control headers
 		if parameterized_query.is_personalized or parameterized_query.has_premium_values:
@@ -261,6 +294,7 @@ def _fetch_query_results(parameterized_query, run_local=False, user=None, priori
 	triggered_refresh = False
 
 	if is_cache_hit:
+		count_query_read(parameterized_query)
 		triggered_refresh = trigger_if_stale(parameterized_query, run_local, priority)
 
 		response = HttpResponse(
@@ -289,9 +323,50 @@ def _fetch_query_results(parameterized_query, run_local=False, user=None, priori
 		result = {"msg": "Query is processing. Check back later."}
 		response = JsonResponse(result, status=202)
 
+	_log_query_fetch(
+		parameterized_query,
+		user=user,
+		cache_is_populated=cache_is_populated,
+		is_cache_hit=is_cache_hit,
+		triggered_refresh=triggered_refresh
+	)
+
+	return response
+
+
+def _accepts_gzip(request):
+	return bool(re_accepts_gzip.search(request.META.get("HTTP_ACCEPT_ENCODING", "")))
+
+
+def _get_query_result_etag(compressed_result, gzipped):
+	# Strong ETags have to tell the gzipped and the plain representation apart
+	if gzipped:
+		return compressed_result.etag[:-1] + "-gzip\""
+	return compressed_result.etag
+
+
+def _get_compressed_query_response(compressed_result, gzipped):
+	if gzipped:
+		response = HttpResponse(
+			content=compressed_result.gzip_data,
+			content_type=compressed_result.content_type
+		)
+		response["Content-Encoding"] = "gzip"
+	else:
+		response = HttpResponse(
+			content=gzip.decompress(compressed_result.gzip_data),
+			content_type=compressed_result.content_type
+		)
+	response["Content-Length"] = str(len(response.content))
+	return response
+
+
+def _log_query_fetch(
+	parameterized_query, user, cache_is_populated, is_cache_hit, triggered_refresh
+):
 	log.info("Query: %s Cache Populated: %s Cache Hit: %s Is Stale: %s" % (
-		cache_is_populated,
 		parameterized_query.cache_key,
+		cache_is_populated,
 		is_cache_hit,
 		triggered_refresh
 	))
@@ -314,8 +389,6 @@ def _fetch_query_results(parameterized_query, run_local=False, user=None, priori
 		**parameterized_query.supplied_filters_dict
 	)
 
-	return response
-
 
 def live_clustering_data(request, game_format):
 	snapshot = ClusterSetSnapshot.objects.filter(
@@ -471,15 +544,8 @@ class SingleClusterUpdateView(View):
 
 
 def meta_preview(request):
-	current_ts = datetime.utcnow().timestamp()
-
-	if META_PREVIEW_CACHE.get("as_of", 0) + 300 < current_ts:
-		data = get_meta_preview()
-		META_PREVIEW_CACHE["as_of"] = current_ts
-		META_PREVIEW_CACHE["payload"] = data
-
 	return JsonResponse(
-		META_PREVIEW_CACHE.get("payload", []),
+		get_meta_preview(),
 		safe=False,
 		json_dumps_params=dict(indent=4)
 	)
@@ -4,7 +4,8 @@ import requests
 from django.core.cache import caches
 
 from hsreplaynet.utils.redis import (
-	CappedDataFeed, RedisCounter, RedisPopularityDistribution, RedisProxy, RedisSet
+	CappedDataFeed, RedisCounter, RedisExpiringSet,
+	RedisPopularityDistribution, RedisProxy, RedisSet
 )
 
 
@@ -38,14 +39,10 @@ class PopularityWinrateDistribution:
 			self.wins.increment(key, as_of=as_of)
 
 	def distribution(self, start_ts, end_ts):
-		games = self.observations.distribution(
-			start_ts=start_ts,
-			end_ts=end_ts,
-		)
-		wins = self.wins.distribution(
-			start_ts=start_ts,
-			end_ts=end_ts,
-		)
+		return read_distributions([(self, start_ts, end_ts)])[0]
+
+	@staticmethod
+	def _combine(games, wins):
 		result = {}
 		for key, val in games.items():
 			result[key] = {
@@ -55,6 +52,32 @@ class PopularityWinrateDistribution:
 		return result
 
 
+def read_distributions(queries, limit=None):
+	"""
+	Return the distributions for a list of (distribution, start_ts, end_ts) queries,
+	reading all of them in a single Redis round trip.
+
+	Each distribution may be a RedisPopularityDistribution or a
+	PopularityWinrateDistribution, and yields what its distribution() method would.
+	"""
+	popularity_queries = []
+	for distribution, start_ts, end_ts in queries:
+		if isinstance(distribution, PopularityWinrateDistribution):
+			popularity_queries.append((distribution.observations, start_ts, end_ts))
+			popularity_queries.append((distribution.wins, start_ts, end_ts))
+		else:
+			popularity_queries.append((distribution, start_ts, end_ts))
+
+	results = iter(RedisPopularityDistribution.read_many(popularity_queries, limit=limit))
+	ret = []
+	for distribution, _, _ in queries:
+		if isinstance(distribution, PopularityWinrateDistribution):
+			ret.append(distribution._combine(next(results), next(results)))
+		else:
+			ret.append(next(results))
+	return ret
+
+
 def get_player_class_distribution(game_type, redis_client=None, ttl=3200, use_lua=None):
 	if redis_client:
 		redis = redis_client
@@ -87,13 +110,13 @@ def get_live_stats_redis():
 	return caches["live_stats"].client.get_client()
 
 
-def get_replay_feed(comparator=None):
+def get_replay_feed(dedupe_fields=None):
 	return CappedDataFeed(
 		redis=get_live_stats_redis(),
 		name="REPLAY_FEED",
 		max_items=1000,
 		period=60,
-		comparator=comparator,
+		dedupe_fields=dedupe_fields,
 		fast_backfill=True
 	)
 
@@ -116,6 +139,37 @@ def get_daily_contributor_set():
 	)
 
 
+def get_live_streamer_registry():
+	"""Twitch user ids of the streamers who recently uploaded a game with a VOD."""
+	return RedisExpiringSet(
+		redis=get_live_stats_redis(),
+		name="LIVE_TWITCH_STREAMERS",
+		ttl=int(timedelta(hours=2).total_seconds())
+	)
+
+
+TWITCH_STREAM_DETAILS_TTL = int(timedelta(minutes=10).total_seconds())
+
+
+def get_twitch_stream_details_key(twitch_user_id):
+	# Key of the live_stats cache entry describing what a streamer is currently playing
+	return "twitch_%s" % (twitch_user_id)
+
+
+def set_twitch_stream_details(twitch_user_id, details, timeout=TWITCH_STREAM_DETAILS_TTL):
+	"""Cache what a streamer is currently playing and register them as live.
+
+	Every writer of the stream details must go through here, as StreamingNowView only
+	looks at the streamers in the registry.
+	"""
+	caches["live_stats"].set(
+		get_twitch_stream_details_key(twitch_user_id),
+		dict(details, twitch_user_id=twitch_user_id),
+		timeout=timeout
+	)
+	get_live_streamer_registry().add(twitch_user_id)
+
+
 def get_twitch_proxy(ttl=60):
 	def fetch(usernames):
 		headers = {
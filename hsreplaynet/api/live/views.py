@@ -9,9 +9,10 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 
 from .distributions import (
-	get_daily_contributor_set, get_daily_game_counter,
-	get_live_stats_redis, get_played_cards_distribution,
-	get_player_class_distribution, get_replay_feed, get_twitch_proxy
+	TWITCH_STREAM_DETAILS_TTL, get_daily_contributor_set, get_daily_game_counter,
+	get_live_stats_redis, get_live_streamer_registry,
+	get_played_cards_distribution, get_player_class_distribution, get_replay_feed,
+	get_twitch_proxy, get_twitch_stream_details_key, read_distributions
 )
 
 
@@ -91,18 +92,18 @@ class PlayerClassDistributionView(APIView):
 		end_ts = start_ts + timedelta(seconds=window)
 
 		if _PLAYER_CLASS_CACHE[game_type_name].get("as_of", None) != most_recent_tick_ts:
-			result = []
+			queries = []
 			while end_ts <= most_recent_tick_ts:
-				data = player_class_popularity.distribution(
-					start_ts=start_ts,
-					end_ts=end_ts
-				)
+				queries.append((player_class_popularity, start_ts, end_ts))
+				start_ts = start_ts + timedelta(seconds=tick)
+				end_ts = start_ts + timedelta(seconds=window)
+
+			result = []
+			for (_, _, end_ts), data in zip(queries, read_distributions(queries)):
 				result.append({
 					"ts": int(end_ts.timestamp()),
 					"data": data
 				})
-				start_ts = start_ts + timedelta(seconds=tick)
-				end_ts = start_ts + timedelta(seconds=window)
 
 			_PLAYER_CLASS_CACHE[game_type_name]["as_of"] = most_recent_tick_ts
 			_PLAYER_CLASS_CACHE[game_type_name]["payload"] = result
@@ -125,26 +126,32 @@ class PlayedCardsDistributionView(APIView):
 		base_ts = base_ts - timedelta(seconds=(base_ts.second % bucket_size))
 		return base_ts
 
-	def _get_result(self, game_type_name: str, base_ts, limit: int):
-		played_cards_popularity = get_played_cards_distribution(game_type_name)
-		ret = []
-		for i in range(0, 61, 5):
-			end_ts = base_ts + timedelta(seconds=i)
-			start_ts = end_ts - timedelta(seconds=300)
-			data = played_cards_popularity.distribution(
-				start_ts=start_ts, end_ts=end_ts, limit=limit
-			)
-			ret.append({
-				"ts": int(end_ts.timestamp()),
-				"data": data,
-			})
+	def _get_results(self, game_type_names, base_ts, limit: int) -> dict:
+		queries = []
+		for game_type_name in game_type_names:
+			played_cards_popularity = get_played_cards_distribution(game_type_name)
+			for i in range(0, 61, 5):
+				end_ts = base_ts + timedelta(seconds=i)
+				start_ts = end_ts - timedelta(seconds=300)
+				queries.append((played_cards_popularity, start_ts, end_ts))
+
+		# Read the distributions for all game types and windows in one go
+		ret = {game_type_name: [] for game_type_name in game_type_names}
+		distributions = iter(read_distributions(queries, limit=limit))
+		for game_type_name in game_type_names:
+			for i in range(0, 61, 5):
+				end_ts = base_ts + timedelta(seconds=i)
+				ret[game_type_name].append({
+					"ts": int(end_ts.timestamp()),
+					"data": next(distributions),
+				})
 
 		return ret
 
 	def _get_data_for_gametype(self, limit: int, game_type_name: str, base_ts) -> dict:
 		_validate_game_type(game_type_name)
 
-		result = self._get_result(game_type_name, base_ts, limit)
+		result = self._get_results([game_type_name], base_ts, limit)[game_type_name]
 		_PLAYED_CARDS_CACHE[game_type_name]["as_of"] = base_ts
 		_PLAYED_CARDS_CACHE[game_type_name]["payload"] = result
 
@@ -152,11 +159,9 @@ class PlayedCardsDistributionView(APIView):
 
 	def _get_data_for_all(self, limit: int, base_ts) -> dict:
 		if _PLAYED_CARDS_CACHE["ALL"].get("as_of") != base_ts:
-			payload = {}
-			for game_type in self.eligible_game_types:
-				payload[game_type.name] = self._get_result(
-					game_type.name, base_ts, limit
-				)
+			payload = self._get_results(
+				[game_type.name for game_type in self.eligible_game_types], base_ts, limit
+			)
 
 			_PLAYED_CARDS_CACHE["ALL"]["as_of"] = base_ts
 			_PLAYED_CARDS_CACHE["ALL"]["payload"] = payload
@@ -192,21 +197,40 @@ class StreamingNowView(APIView):
 		if cached:
 			return cached
 
-		# Need direct client access for keys list
-		client = cache.client.get_client()
-		ret = []
-
-		for k in client.keys(":*:twitch_*"):
-			details = cache.get(k.decode()[3:])
-
+		# Only look at the streamers known to be live, rather than scanning the keyspace
+		registry = get_live_streamer_registry()
+		details_keys = {
+			twitch_user_id: get_twitch_stream_details_key(twitch_user_id)
+			for twitch_user_id in registry.members()
+		}
+		all_details = cache.get_many(details_keys.values())
+
+		# Streamers who went a whole details TTL without being registered again have
+		# stopped streaming. Newer members may just not have their details cached yet.
+		registry.discard(*[
+			twitch_user_id
+			for twitch_user_id in registry.members(min_age=TWITCH_STREAM_DETAILS_TTL)
+			if get_twitch_stream_details_key(twitch_user_id) not in all_details
+		])
+
+		streams = []
+		for details in all_details.values():
 			if not details or not details.get("deck") or not details.get("hero"):
 				# Skip the obvious garbage
 				continue
+			streams.append(details)
+
+		socialaccounts = SocialAccount.objects.filter(
+			uid__in=[str(details["twitch_user_id"]) for details in streams],
+			provider="twitch"
+		).select_related("user")
+		socialaccounts_by_uid = {account.uid: account for account in socialaccounts}
+		ret = []
 
+		for details in streams:
 			twitch_user_id = details.pop("twitch_user_id")
-			try:
-				socialaccount = SocialAccount.objects.get(uid=twitch_user_id, provider="twitch")
-			except SocialAccount.DoesNotExist:
+			socialaccount = socialaccounts_by_uid.get(str(twitch_user_id))
+			if socialaccount is None:
 				# Maybe it was deleted since or something
 				continue
 
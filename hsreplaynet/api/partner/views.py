@@ -7,7 +7,7 @@ from rest_framework import status, views
 from rest_framework.generics import ListAPIView
 from rest_framework.response import Response
 
-from hsreplaynet.analytics.utils import trigger_if_stale
+from hsreplaynet.analytics.utils import count_query_read, trigger_if_stale
 from hsreplaynet.api.partner.serializers import (
 	ArchetypeSerializer, CardSerializer, ClassSerializer
 )
@@ -35,6 +35,7 @@ class PartnerStatsListView(ListAPIView):
 	def _get_query_data(self, query_name, params=None) -> Tuple[Dict, Dict]:
 		query = get_redshift_query(query_name)
 		parameterized_query = query.build_full_params(params or dict())
+		count_query_read(parameterized_query)
 		try:
 			trigger_if_stale(parameterized_query)
 		except OSError as err:
@@ -7,7 +7,7 @@ from rest_framework.response import Response
 
 from hearthsim.identity.accounts.models import BlizzardAccount
 from hsredshift.analytics import filters
-from hsreplaynet.analytics.utils import trigger_if_stale
+from hsreplaynet.analytics.utils import count_query_read, trigger_if_stale
 from hsreplaynet.api.partner.utils import QueryDataNotAvailableException
 from hsreplaynet.api.permissions import UserHasFeature
 from hsreplaynet.api.serializers.leaderboard import LeaderboardSerializer
@@ -122,6 +122,7 @@ class BaseLeaderboardView(ListAPIView):
 
 		if not self.redshift_query_data:
 			parameterized_query = self.get_parameterized_query()
+			count_query_read(parameterized_query)
 			try:
 				trigger_if_stale(parameterized_query)
 			except OSError as err:
@@ -177,17 +177,6 @@ class VodIndexView(APIView):
 	"""Query for archetype matchups with available Twitch VODs."""
 	permission_classes = (UserHasFeature("twitch-vods"), )
 
-	_signature_weights = {}
-
-	def get_signature_weights(self, player_class):
-		signature_weights = self._signature_weights.get(player_class, None)
-		if not signature_weights:
-			signature_weights = ClusterSnapshot.objects.get_signature_weights(
-				FormatType.FT_STANDARD, player_class
-			)
-			self._signature_weights[player_class] = signature_weights
-		return signature_weights
-
 	def get(self, request, **kwargs):
 		current_ts = datetime.utcnow().timestamp()
 
@@ -199,7 +188,9 @@ class VodIndexView(APIView):
 			for archetype in Archetype.objects.live().all():
 				if archetype.player_class is CardClass.INVALID:
 					continue
-				signature_weights = self.get_signature_weights(archetype.player_class)
+				signature_weights = ClusterSnapshot.objects.get_signature_weights(
+					FormatType.FT_STANDARD, archetype.player_class
+				)
 				vods = TwitchVod.archetype_index.query(archetype.id)
 				for vod in vods:
 					opponent_archetype = vod.opposing_player_archetype_id
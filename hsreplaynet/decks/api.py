@@ -402,7 +402,8 @@ class MyDecksAPIView(APIView):
 		data_by_deck = {}
 		deck_ids = set(row["deck_list_id"] for row in data)
 		decks_played = {
-			deck.id: deck for deck in Deck.objects.filter(id__in=deck_ids, size=30)
+			deck.id: deck
+			for deck in Deck.objects.filter(id__in=deck_ids, size=30).prefetch_cards()
 		}
 
 		for row in data:
@@ -4,10 +4,12 @@ import json
 import os
 import string
 import time
+import uuid
 from typing import Set
 
 from django.conf import settings
 from django.contrib.postgres.fields import ArrayField, JSONField
+from django.core.cache import caches
 from django.db import connection, models, transaction
 from django.dispatch.dispatcher import receiver
 from django.urls import reverse
@@ -23,14 +25,12 @@ from hsarchetypes import classify_deck
 from hsarchetypes.clustering import ClassClusters, Cluster, ClusterSet, create_cluster_set
 from shortuuid.main import int_to_string, string_to_int
 
-from hsreplaynet.utils import card_db, log
+from hsreplaynet.utils import card_db, hero_player_classes, log
 from hsreplaynet.utils.aws import s3_object_exists
 from hsreplaynet.utils.aws.clients import FIREHOSE, LAMBDA, S3
 from hsreplaynet.utils.aws.redshift import get_redshift_query
-from hsreplaynet.utils.aws.streams import (
-	next_record_batch_of_size, publish_batch_to_firehose,
-	publish_from_iterable_at_fixed_speed, to_data_blobs
-)
+from hsreplaynet.utils.aws.streams import BufferedFirehoseWriter, next_record_batch_of_size
+from hsreplaynet.utils.collections import multiset_issubset
 from hsreplaynet.utils.db import dictfetchall
 from hsreplaynet.utils.influx import influx_metric, influx_timer
 
@@ -38,7 +38,33 @@ from hsreplaynet.utils.influx import influx_metric, influx_timer
 ALPHABET = string.ascii_letters + string.digits
 
 
-class DeckManager(models.Manager):
+DeckInclude = collections.namedtuple(
+	"DeckInclude", ("id", "dbf_id", "card_id", "card_class", "card_set", "count")
+)
+
+
+class DeckQuerySet(models.QuerySet):
+	def prefetch_cards(self):
+		"""
+		Load the includes of all decks in two queries, so that their card accessors
+		(card_dbf_id_list(), deck_class, etc.) do not need any further queries.
+		"""
+		return self.prefetch_related(models.Prefetch(
+			"includes",
+			queryset=Include.objects.for_card_view(),
+			to_attr="_prefetched_card_view",
+		))
+
+
+def _archetype_firehose_record(deck_id, archetype_id, timestamp):
+	return "{deck_id}|{archetype_id}|{as_of}\n".format(
+		deck_id=str(deck_id),
+		archetype_id=str(archetype_id or ""),
+		as_of=timestamp.isoformat(sep=" "),
+	)
+
+
+class DeckManager(models.Manager.from_queryset(DeckQuerySet)):
 	def get_or_create_from_id_list(
 		self,
 		id_list,
@@ -123,13 +149,33 @@ class DeckManager(models.Manager):
 		return deck_class
 
 	def _convert_hero_id_to_player_class(self, hero_id):
+		if not hero_id:
+			return enums.CardClass.INVALID
+
+		player_class = hero_player_classes().get(hero_id)
+		if player_class is not None:
+			return player_class
+
+		# Not a hero in the card database, fall back to the Card table
 		if isinstance(hero_id, int):
 			return Card.objects.get(dbf_id=hero_id).card_class
-		elif hero_id:
-			return Card.objects.get(card_id=hero_id).card_class
-		return enums.CardClass.INVALID
+		return Card.objects.get(card_id=hero_id).card_class
 
-	def bulk_update_to_archetype(self, deck_ids, archetype):
+	def archetype_firehose_writer(self):
+		"""
+		Return a writer that buffers archetype changes for the archetype Firehose
+		stream, for syncing many of them at once.
+		"""
+		return BufferedFirehoseWriter(settings.ARCHETYPE_FIREHOSE_STREAM_NAME)
+
+	def bulk_update_to_archetype(self, deck_ids, archetype, writer=None):
+		"""
+		Set the archetype of all the given decks and sync the change to Firehose,
+		through `writer` if given (the caller is then responsible for flushing it).
+
+		If the writer drops records, FirehoseWriteError is raised before any of the
+		decks are updated.
+		"""
 		if isinstance(archetype, Archetype):
 			archetype_id = archetype.id
 		else:
@@ -137,22 +183,13 @@ class DeckManager(models.Manager):
 
 		timestamp = now().replace(tzinfo=None)
 
-		records = []
+		owns_writer = writer is None
+		if owns_writer:
+			writer = self.archetype_firehose_writer()
 		for deck_id in deck_ids:
-			records.append("{deck_id}|{archetype_id}|{as_of}\n".format(
-				deck_id=str(deck_id),
-				archetype_id=str(archetype_id or ""),
-				as_of=timestamp.isoformat(sep=" "),
-			))
-
-		bulk_records = to_data_blobs(records)
-		if len(bulk_records):
-			publish_from_iterable_at_fixed_speed(
-				iter(bulk_records),
-				self._publish_archetypes_to_firehose,
-				max_records_per_second=5000,
-				publish_batch_size=500
-			)
+			writer.put(_archetype_firehose_record(deck_id, archetype_id, timestamp))
+		if owns_writer:
+			writer.flush()
 
 		iterable = iter(deck_ids)
 		batch = next_record_batch_of_size(iterable, 500)
@@ -160,9 +197,6 @@ class DeckManager(models.Manager):
 			Deck.objects.filter(id__in=batch).update(archetype_id=archetype_id)
 			batch = next_record_batch_of_size(iterable, 500)
 
-	def _publish_archetypes_to_firehose(self, batch):
-		publish_batch_to_firehose(settings.ARCHETYPE_FIREHOSE_STREAM_NAME, batch)
-
 	def get_digest_from_shortid(self, shortid):
 		try:
 			id = string_to_int(shortid, ALPHABET)
@@ -258,7 +292,7 @@ class Deck(models.Model):
 	def __len__(self):
 		size = self.size
 		if self.size is None:
-			size = sum(i.count for i in self.includes.all())
+			size = sum(include.count for include in self.card_view)
 		return size
 
 	def __contains__(self, item):
@@ -273,28 +307,21 @@ class Deck(models.Model):
 	def issubset(self, deck: "Deck") -> bool:
 		"""Test whether every card in self is in deck."""
 		if isinstance(deck, self.__class__):
-			sub = self.card_dbf_id_list()
-			super = deck.card_dbf_id_list()
-			for dbf_id in sub:
-				try:
-					super.remove(dbf_id)
-				except ValueError:
-					return False
-			return True
+			return multiset_issubset(self.card_counts, deck.card_counts)
 
 		raise NotImplementedError
 
 	def issuperset(self, deck: "Deck") -> bool:
 		"""Test whether every card in deck is in self."""
 		if isinstance(deck, self.__class__):
-			sub = deck.card_dbf_id_list()
-			super = self.card_dbf_id_list()
-			for dbf_id in sub:
-				try:
-					super.remove(dbf_id)
-				except ValueError:
-					return False
-			return True
+			return multiset_issubset(deck.card_counts, self.card_counts)
+
+		raise NotImplementedError
+
+	def difference(self, deck: "Deck") -> collections.Counter:
+		"""Return the dbf ids and counts of the cards in self that are not in deck."""
+		if isinstance(deck, self.__class__):
+			return self.card_counts - deck.card_counts
 
 		raise NotImplementedError
 
@@ -310,12 +337,34 @@ class Deck(models.Model):
 			return None
 		return Card.objects.get(card_id=self.hero).dbf_id
 
+	@cached_property
+	def card_view(self):
+		"""
+		The deck's includes along with the card fields the card accessors need,
+		sorted by mana cost and then by name.
+
+		Loaded with a single query the first time any accessor needs it, or prefetched
+		for many decks at once with Deck.objects.prefetch_cards().
+		"""
+		includes = getattr(self, "_prefetched_card_view", None)
+		if includes is None:
+			includes = Include.objects.for_card_view().filter(deck=self)
+
+		return [DeckInclude(
+			include.id,
+			include.card.dbf_id,
+			include.card.card_id,
+			include.card.card_class,
+			include.card.card_set,
+			include.count,
+		) for include in includes]
+
 	@cached_property
 	def deck_class(self):
 		has_seen_neutral = False
 		primary_card_class = None
-		for val in self.includes.values("card__card_class"):
-			card_class = val["card__card_class"]
+		for include in self.card_view:
+			card_class = include.card_class
 			if card_class == enums.CardClass.NEUTRAL:
 				has_seen_neutral = True
 			if card_class not in (enums.CardClass.INVALID, enums.CardClass.NEUTRAL):
@@ -329,11 +378,17 @@ class Deck(models.Model):
 		else:
 			return enums.CardClass.INVALID
 
+	@cached_property
+	def card_counts(self) -> collections.Counter:
+		"""The deck as a multiset of card dbf ids."""
+		counts = collections.Counter()
+		for include in self.card_view:
+			counts[include.dbf_id] += include.count
+		return counts
+
 	@cached_property
 	def card_dbf_id_packed_list(self):
-		cardlist = self.card_dbf_id_list()
-		sorted_list = sorted(set(cardlist))
-		return [(id, cardlist.count(id)) for id in sorted_list]
+		return sorted(self.card_counts.items())
 
 	@cached_property
 	def deckstring(self):
@@ -344,8 +399,8 @@ class Deck(models.Model):
 
 	@cached_property
 	def format(self):
-		for val in self.includes.values("card__card_set"):
-			card_set = val["card__card_set"]
+		for include in self.card_view:
+			card_set = include.card_set
 			is_classic = card_set in (enums.CardSet.EXPERT1, enums.CardSet.CORE)
 			if not is_classic and not card_set.is_standard:
 				return enums.FormatType.FT_WILD
@@ -403,13 +458,17 @@ class Deck(models.Model):
 
 		return True
 
-	def sync_archetype_to_firehose(self):
+	def sync_archetype_to_firehose(self, writer=None):
+		"""
+		Replicate the deck's archetype into Redshift, either right away or by adding
+		it to a `writer` from Deck.objects.archetype_firehose_writer().
+		"""
 		timestamp = now().replace(tzinfo=None)
-		record = "{deck_id}|{archetype_id}|{as_of}\n".format(
-			deck_id=str(self.id),
-			archetype_id=str(self.archetype_id or ""),
-			as_of=timestamp.isoformat(sep=" "),
-		)
+		record = _archetype_firehose_record(self.id, self.archetype_id, timestamp)
+
+		if writer is not None:
+			writer.put(record)
+			return
 
 		result = FIREHOSE.put_record(
 			DeliveryStreamName=settings.ARCHETYPE_FIREHOSE_STREAM_NAME,
@@ -423,28 +482,21 @@ class Deck(models.Model):
 	def card_dbf_id_list(self):
 		result = []
 
-		includes = self.includes \
-			.values_list("card__dbf_id", "count") \
-			.order_by("card__cost", "card__name")
-		for id, count in includes:
-			for i in range(count):
-				result.append(id)
+		for include in self.card_view:
+			for i in range(include.count):
+				result.append(include.dbf_id)
 
 		return result
 
 	def dbf_map(self, transformer=int):
-		includes = self.includes.values_list("card__dbf_id", "count")
-		return {transformer(id): count for id, count in includes}
+		return {transformer(include.dbf_id): include.count for include in self.card_view}
 
 	def card_id_list(self):
 		result = []
 
-		includes = self.includes \
-			.values_list("card__card_id", "count") \
-			.order_by("card__cost", "card__name")
-		for id, count in includes:
-			for i in range(count):
-				result.append(id)
+		for include in self.card_view:
+			for i in range(include.count):
+				result.append(include.card_id)
 
 		return result
 
@@ -459,8 +511,8 @@ class Deck(models.Model):
 	def as_dbf_json(self, serialized=True):
 		"""Serialize the deck list for storage in Redshift"""
 		result = []
-		for include in self.includes.all():
-			result.append([include.card.dbf_id, include.count])
+		for include in sorted(self.card_view, key=lambda include: include.id):
+			result.append([include.dbf_id, include.count])
 
 		if serialized:
 			# separators=(",", ":") creates compact JSON encoding
@@ -545,6 +597,15 @@ def update_deck_archetype(sender, instance, **kwargs):
 			instance.sync_archetype_to_firehose()
 
 
+class IncludeManager(models.Manager):
+	def for_card_view(self):
+		fields = (
+			"id", "count", "deck_id", "card__dbf_id", "card__card_id",
+			"card__card_class", "card__card_set",
+		)
+		return self.select_related("card").only(*fields).order_by("card__cost", "card__name")
+
+
 class Include(models.Model):
 	id = models.BigAutoField(primary_key=True)
 	deck = models.ForeignKey(Deck, on_delete=models.CASCADE, related_name="includes")
@@ -553,6 +614,8 @@ class Include(models.Model):
 	)
 	count = models.IntegerField(default=1)
 
+	objects = IncludeManager()
+
 	class Meta:
 		db_table = "cards_include"
 		unique_together = ("deck", "card")
@@ -729,9 +792,40 @@ class ClusterSetManager(models.Manager):
 		min_observations=100,
 		min_pilots=10,
 		experimental_threshold=.01,
-		dry_run=False
+		dry_run=False,
+		block=True
 	):
-		from hsreplaynet.analytics.processing import get_cluster_set_data
+		"""
+		Cluster the latest decks into a new snapshot.
+
+		With block=False, this returns a PendingQuery for the clustering data instead of
+		waiting for it, and the snapshot is created once the query has finished.
+		"""
+		from hsreplaynet.analytics.processing import (
+			get_cluster_set_data, get_cluster_set_data_async
+		)
+
+		snapshot_options = dict(
+			num_clusters=num_clusters,
+			merge_threshold=merge_threshold,
+			inherit_threshold=inherit_threshold,
+			experimental_threshold=experimental_threshold,
+			dry_run=dry_run,
+		)
+
+		if not block:
+			pending_query = get_cluster_set_data_async(
+				game_format=game_format,
+				lookback=lookback,
+				min_observations=min_observations,
+				min_pilots=min_pilots
+			)
+			pending_query.then(
+				"hsreplaynet.decks.models.create_cluster_set_snapshot",
+				game_format=int(game_format),
+				**snapshot_options
+			)
+			return pending_query
 
 		data = get_cluster_set_data(
 			game_format=game_format,
@@ -740,6 +834,18 @@ class ClusterSetManager(models.Manager):
 			min_pilots=min_pilots
 		)
 
+		return self.create_snapshot(data, game_format, **snapshot_options)
+
+	def create_snapshot(
+		self,
+		data,
+		game_format=enums.FormatType.FT_STANDARD,
+		num_clusters=20,
+		merge_threshold=0.85,
+		inherit_threshold=0.85,
+		experimental_threshold=.01,
+		dry_run=False
+	):
 		log.info("\nClustering Raw Data Volume:")
 		total_data_points = 0
 		total_observations = 0
@@ -1028,6 +1134,14 @@ class ClassClusterSnapshot(models.Model, ClassClusters):
 		return self.cluster_set.cluster_set_key_prefix + self.player_class.name
 
 
+# Process-wide cache of live signature weights, keyed by (game_format, player_class).
+# Entries are tagged with the signature version they were loaded under and are reloaded
+# once ClusterManager.invalidate_signature_weights() publishes a new version.
+_SIGNATURE_WEIGHTS_CACHE = {}
+_SIGNATURE_WEIGHTS_VERSION = {}
+SIGNATURE_WEIGHTS_VERSION_CACHE_KEY = "archetype_signature_weights_version"
+
+
 class ClusterManager(models.Manager):
 	LIVE_SIGNATURES_QUERY = """
 		SELECT
@@ -1044,7 +1158,45 @@ class ClusterManager(models.Manager):
 		AND c.external_id != -1;
 	"""
 
-	def get_signature_weights(self, game_format, player_class):
+	def get_signature_weights(self, game_format, player_class, use_cache=True):
+		if not use_cache:
+			return self._fetch_signature_weights(game_format, player_class)
+
+		version = self._get_signature_weights_version()
+		key = (int(game_format), int(player_class))
+		cached = _SIGNATURE_WEIGHTS_CACHE.get(key)
+		if not cached or cached["version"] != version:
+			cached = {
+				"version": version,
+				"weights": self._fetch_signature_weights(game_format, player_class),
+			}
+			_SIGNATURE_WEIGHTS_CACHE[key] = cached
+
+		return cached["weights"]
+
+	def invalidate_signature_weights(self):
+		"""
+		Publish a new signature version, forcing every process to reload its cached
+		signature weights the next time it checks the version.
+		"""
+		version = str(uuid.uuid4())
+		caches["default"].set(SIGNATURE_WEIGHTS_VERSION_CACHE_KEY, version, timeout=None)
+		_SIGNATURE_WEIGHTS_VERSION["version"] = version
+		_SIGNATURE_WEIGHTS_VERSION["checked_at"] = time.time()
+		_SIGNATURE_WEIGHTS_CACHE.clear()
+
+	def _get_signature_weights_version(self):
+		# The shared version is only polled every few seconds so that warm lookups
+		# don't need a network round trip.
+		current_ts = time.time()
+		interval = settings.ARCHETYPE_SIGNATURE_WEIGHTS_VERSION_CHECK_SECONDS
+		if _SIGNATURE_WEIGHTS_VERSION.get("checked_at", 0) + interval < current_ts:
+			version = caches["default"].get(SIGNATURE_WEIGHTS_VERSION_CACHE_KEY)
+			_SIGNATURE_WEIGHTS_VERSION["version"] = version
+			_SIGNATURE_WEIGHTS_VERSION["checked_at"] = current_ts
+		return _SIGNATURE_WEIGHTS_VERSION["version"]
+
+	def _fetch_signature_weights(self, game_format, player_class):
 		with connection.cursor() as cursor:
 			cursor.execute(
 				self.LIVE_SIGNATURES_QUERY % (int(game_format), int(player_class))
@@ -1208,6 +1360,14 @@ class ClusterSnapshot(models.Model, Cluster):
 		return result
 
 
+@receiver(models.signals.post_save, sender=ClusterSnapshot)
+def invalidate_live_signature_weights(sender, instance, **kwargs):
+	# Edits to live clusters (signatures, external ids, required cards) have to reach
+	# the signature weights every process caches.
+	if instance.class_cluster.cluster_set.live_in_production:
+		transaction.on_commit(ClusterSnapshot.objects.invalidate_signature_weights)
+
+
 class ClusterSetSnapshot(models.Model, ClusterSet):
 	id = models.AutoField(primary_key=True)
 	objects = ClusterSetManager()
@@ -1266,6 +1426,7 @@ class ClusterSetSnapshot(models.Model, ClusterSet):
 				self.synchronize_required_cards()
 				if overwrite_archetypes:
 					self.synchronize_deck_archetype_assignments()
+				transaction.on_commit(ClusterSnapshot.objects.invalidate_signature_weights)
 		else:
 			msg = "Cannot promote to live=True because the neural network is not ready"
 			raise RuntimeError(msg)
@@ -1291,9 +1452,10 @@ class ClusterSetSnapshot(models.Model, ClusterSet):
 						digest = Deck.objects.get_digest_from_shortid(data_point["shortid"])
 						for_update[cluster.external_id].append(digest)
 
-		for external_id, digests in for_update.items():
-			deck_ids = Deck.objects.filter(digest__in=digests).values_list("id", flat=True)
-			Deck.objects.bulk_update_to_archetype(deck_ids, external_id)
+		with Deck.objects.archetype_firehose_writer() as writer:
+			for external_id, digests in for_update.items():
+				deck_ids = Deck.objects.filter(digest__in=digests).values_list("id", flat=True)
+				Deck.objects.bulk_update_to_archetype(deck_ids, external_id, writer=writer)
 
 	def train_neural_network(
 		self,
@@ -1383,6 +1545,13 @@ class ClusterSetSnapshot(models.Model, ClusterSet):
 				)
 
 
+def create_cluster_set_snapshot(data, game_format, **kwargs):
+	"""Callback for ClusterSetManager.snapshot(block=False), once the data is available."""
+	return ClusterSetSnapshot.objects.create_snapshot(
+		data, enums.FormatType(game_format), **kwargs
+	)
+
+
 class ArchetypeSuggestion(models.Model):
 	id = models.BigAutoField(primary_key=True)
 	suggested_name = models.ForeignKey(
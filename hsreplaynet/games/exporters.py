@@ -4,10 +4,10 @@ from hearthstone.enums import GameTag, Zone
 from hslog.export import EntityTreeExporter
 
 
-class GameDigestExporter(EntityTreeExporter):
-	"""An exporter that computes a digest for a packet tree based only on Power.log features
+class GameDigestMixin:
+	"""Computes a digest for a packet tree based only on Power.log features
 
-	This exporter examines game events to create a globally unique fingerprint for a game
+	This mixin examines game events to create a globally unique fingerprint for a game
 	without needing to read memory. The fingerprint is created as the SHA-1 hash of the
 	following items:
 		- The eight-byte representation of player 1's account hi
@@ -19,23 +19,21 @@ class GameDigestExporter(EntityTreeExporter):
 		- The four-byte representation of each value in player 1's damage sequence
 		- The four-byte representation of each value in player 2's damage sequence
 
-	Generate the digest by requesting the "digest" property of this exporter after calling
-	"export."
+	It can be mixed into any EntityTreeExporter (such as the one publishing the game to
+	Redshift) so that the digest is computed in the same pass over the packets. Only the
+	controller of each entity is tracked, not a copy of all of its tags.
 
-	:param packet_tree: The packet tree to export
+	Generate the digest by requesting the "digest" property of the exporter after calling
+	"export."
 	"""
 
-	def __init__(self, packet_tree):
-		"""Constructor.
-
-		:param packet_tree: The packet tree produced by the hslog parser
-		"""
-
-		super().__init__(packet_tree)
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
 
 		self.player_1 = None
 		self.player_2 = None
-		self.entities = dict()
+		self.controllers = dict()
+		self.digest_error = None
 
 	def _get_player_by_controller(self, controller):
 		if controller == 1:
@@ -69,7 +67,7 @@ class GameDigestExporter(EntityTreeExporter):
 
 	def _update_controller(self, entity, previous_controller_id, new_controller_id):
 		if previous_controller_id != new_controller_id:
-			self.entities[entity][GameTag.CONTROLLER] = new_controller_id
+			self.controllers[entity] = new_controller_id
 
 			previous_player = self._get_player_by_controller(previous_controller_id)
 
@@ -85,19 +83,35 @@ class GameDigestExporter(EntityTreeExporter):
 				if new_player:
 					new_player["deck"].add(entity)
 
+	@staticmethod
+	def _get_tag(packet, tag):
+		ret = None
+		for key, value in packet.tags:
+			if key == tag:
+				ret = value
+		return ret
+
+	def _get_controller(self, entity):
+		if entity not in self.controllers:
+			# Don't interrupt the export this is mixed into; the digest is only
+			# needed for some games, so only fail once it's actually requested.
+			if not self.digest_error:
+				self.digest_error = "Entity %r is unknown" % (entity)
+			return None
+		return self.controllers[entity]
+
 	def handle_create_game(self, packet):
-		super().handle_create_game(packet)
+		ret = super().handle_create_game(packet)
 
-		tags = dict(packet.tags)
-		entity_id = tags.get(GameTag.ENTITY_ID)
-		self.entities[entity_id] = tags
+		entity_id = self._get_tag(packet, GameTag.ENTITY_ID)
+		self.controllers[entity_id] = self._get_tag(packet, GameTag.CONTROLLER)
+		return ret
 
 	def handle_player(self, packet):
-		super().handle_player(packet)
+		ret = super().handle_player(packet)
 
-		tags = dict(packet.tags)
-		entity_id = tags.get(GameTag.ENTITY_ID)
-		hero_entity = tags.get(GameTag.HERO_ENTITY)
+		entity_id = self._get_tag(packet, GameTag.ENTITY_ID)
+		hero_entity = self._get_tag(packet, GameTag.HERO_ENTITY)
 
 		# Initialize the player data structures.
 
@@ -116,40 +130,52 @@ class GameDigestExporter(EntityTreeExporter):
 			elif packet.player_id == 2:
 				self.player_2 = player_dict
 
-			self.entities[entity_id] = tags
+			self.controllers[entity_id] = self._get_tag(packet, GameTag.CONTROLLER)
+		return ret
 
 	def handle_full_entity(self, packet):
-		super().handle_full_entity(packet)
+		ret = super().handle_full_entity(packet)
 
-		tags = dict(packet.tags)
+		controller = None
+		entity_id = None
+		zone = None
+		for tag, value in packet.tags:
+			if tag == GameTag.CONTROLLER:
+				controller = value
+			elif tag == GameTag.ENTITY_ID:
+				entity_id = value
+			elif tag == GameTag.ZONE:
+				zone = value
 
-		controller = tags.get(GameTag.CONTROLLER)
-		entity_id = tags.get(GameTag.ENTITY_ID)
-
-		self.entities[entity_id] = tags
+		self.controllers[entity_id] = controller
 
 		# Fill up each player's deck (in terms of card entity ids) from the list of initial
 		# full entity packets.
 
-		if controller and entity_id and tags.get(GameTag.ZONE) == Zone.DECK:
+		if controller and entity_id and zone == Zone.DECK:
 			player = self._get_player_by_controller(controller)
 			if player:
 				player["deck"].add(entity_id)
+		return ret
 
 	def handle_show_entity(self, packet):
-		super().handle_show_entity(packet)
+		ret = super().handle_show_entity(packet)
 
-		tags = dict(packet.tags)
+		controller_id = None
+		zone = None
+		for tag, value in packet.tags:
+			if tag == GameTag.CONTROLLER:
+				controller_id = value
+			elif tag == GameTag.ZONE:
+				zone = value
 
-		previous_controller_id = self.entities[packet.entity].get(GameTag.CONTROLLER)
-		controller_id = tags.get(GameTag.CONTROLLER)
+		previous_controller_id = self._get_controller(packet.entity)
 
 		# Some older replays don't include the controller tag on the show entity packet...
 		# but we might already have it on the entity, so let's look for it there.
 
 		if not controller_id:
-			if packet.entity in self.entities:
-				controller_id = previous_controller_id
+			controller_id = previous_controller_id
 
 		if controller_id:
 
@@ -160,22 +186,22 @@ class GameDigestExporter(EntityTreeExporter):
 			# Then update the zone. Draws for the friendly player are represented in
 			# Power.log as SHOW_ENTITY packets with changes to the ZONE tag.
 
-			if GameTag.ZONE in tags:
-				self._update_zone(controller_id, packet.entity, tags[GameTag.ZONE])
+			if zone is not None:
+				self._update_zone(controller_id, packet.entity, zone)
+		return ret
 
 	def handle_tag_change(self, packet):
-		super().handle_tag_change(packet)
-
-		previous_controller_id = self.entities[packet.entity].get(GameTag.CONTROLLER) \
-			if packet.entity in self.entities else None
+		ret = super().handle_tag_change(packet)
 
 		if self.player_1 and self.player_2:
 			if packet.tag == GameTag.CONTROLLER:
+				previous_controller_id = self.controllers.get(packet.entity)
+				if previous_controller_id != packet.value:
+					previous_controller_id = self._get_controller(packet.entity)
 				self._update_controller(packet.entity, previous_controller_id, packet.value)
 
 			elif packet.tag == GameTag.ZONE:
-				entity = self.entities[packet.entity]
-				controller_id = entity.get(GameTag.CONTROLLER)
+				controller_id = self._get_controller(packet.entity)
 				self._update_zone(controller_id, packet.entity, packet.value)
 
 			# Damage changes are applied to the player's hero card, so map the target entity
@@ -193,9 +219,12 @@ class GameDigestExporter(EntityTreeExporter):
 					self.player_1["hero_entity"] = packet.value
 				elif packet.entity == self.player_2["entity_id"]:
 					self.player_2["hero_entity"] = packet.value
+		return ret
 
 	@property
 	def digest(self):
+		if self.digest_error:
+			raise RuntimeError("Can't compute digest: %s" % (self.digest_error))
 		if self.player_1 and self.player_2:
 			hash_digest = hashlib.sha1()
 
@@ -224,3 +253,10 @@ class GameDigestExporter(EntityTreeExporter):
 			return hash_digest.hexdigest()
 		else:
 			raise RuntimeError("Can't compute digest without player packets")
+
+
+class GameDigestExporter(GameDigestMixin, EntityTreeExporter):
+	"""An entity tree exporter that also computes the game digest.
+
+	:param packet_tree: The packet tree to export
+	"""
@@ -31,10 +31,11 @@ from hsredshift.etl.exporters import RedshiftPublishingExporter
 from hsredshift.etl.firehose import flush_exporter_to_firehose
 from hsreplaynet.api.live.distributions import (
 	get_daily_contributor_set, get_daily_game_counter, get_live_stats_redis,
-	get_played_cards_distribution, get_player_class_distribution, get_replay_feed
+	get_live_streamer_registry, get_played_cards_distribution,
+	get_player_class_distribution, get_replay_feed
 )
 from hsreplaynet.decks.models import Deck
-from hsreplaynet.games.exporters import GameDigestExporter
+from hsreplaynet.games.exporters import GameDigestExporter, GameDigestMixin
 from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus
 from hsreplaynet.uploads.utils import user_agent_product
 from hsreplaynet.utils import guess_ladder_season, log
@@ -156,7 +157,7 @@ def generate_globalgame_digest(packet_tree):
 	return digest_exporter.digest
 
 
-def find_or_create_global_game(entity_tree, meta, parser):
+def find_or_create_global_game(entity_tree, meta, parser, exporter=None):
 	ladder_season = meta.get("ladder_season")
 	if not ladder_season:
 		ladder_season = guess_ladder_season(meta["end_time"])
@@ -187,7 +188,11 @@ def find_or_create_global_game(entity_tree, meta, parser):
 	if eligible_for_unification(entity_tree, meta):
 		# If the globalgame is eligible for unification, generate a digest
 		# and get_or_create the object
-		digest = generate_globalgame_digest(parser.games[0])
+		if isinstance(exporter, GameDigestMixin):
+			# Computed while exporting the entity tree
+			digest = exporter.digest
+		else:
+			digest = generate_globalgame_digest(parser.games[0])
 		log.debug("GlobalGame digest is %r" % (digest))
 		global_game, created = GlobalGame.objects.get_or_create(digest=digest, defaults=defaults)
 	else:
@@ -412,19 +417,40 @@ def parse_upload_event(upload_event, meta):
 		difference = (orig_match_start - match_start).seconds
 		influx_metric("tainted_replay", {"count": 1, "difference": difference})
 
+	parser = LogParser()
+	parser._game_state_processor = "GameState"
+	parser._current_date = match_start
+
+	if getattr(settings, "UPLOAD_LOG_STREAMING_PARSE_ENABLED", True):
+		_read_log_streaming(parser, upload_event)
+	else:
+		_read_log_buffered(parser, upload_event)
+
+	return parser
+
+
+def _read_log_buffered(parser, upload_event):
 	log_bytes = upload_event.log_bytes()
 	if not log_bytes:
 		raise ValidationError("The uploaded log file is empty.")
 
 	powerlog = StringIO(log_bytes.decode("utf-8"))
-	upload_event.file.close()
+	upload_event.close_log_file()
 
-	parser = LogParser()
-	parser._game_state_processor = "GameState"
-	parser._current_date = match_start
 	parser.read(powerlog)
 
-	return parser
+
+def _read_log_streaming(parser, upload_event):
+	num_lines = 0
+	try:
+		for line in upload_event.log_lines():
+			parser.read_line(line)
+			num_lines += 1
+	finally:
+		upload_event.close_log_file()
+
+	if not num_lines:
+		raise ValidationError("The uploaded log file is empty.")
 
 
 def fetch_active_stream_prefix():
@@ -433,6 +459,12 @@ def fetch_active_stream_prefix():
 	return prefix
 
 
+class DigestingRedshiftPublishingExporter(GameDigestMixin, RedshiftPublishingExporter):
+	"""
+	Exports the game for Redshift and computes its GlobalGame digest in a single pass.
+	"""
+
+
 def validate_parser(parser, meta):
 	# Validate upload
 	if len(parser.games) != 1:
@@ -440,7 +472,7 @@ def validate_parser(parser, meta):
 	packet_tree = parser.games[0]
 	with influx_timer("replay_exporter_duration"):
 		try:
-			exporter = RedshiftPublishingExporter(
+			exporter = DigestingRedshiftPublishingExporter(
 				packet_tree,
 				stream_prefix=fetch_active_stream_prefix()
 			).export()
@@ -1046,11 +1078,8 @@ def update_replay_feed(replay):
 			"id": replay.shortid
 		}
 
-		def comparator(d1, d2):
-			keys = [key for key in data.keys() if key != "id"]
-			return all([key in d1 and key in d2 and str(d1[key]) == str(d2[key]) for key in keys])
-
-		success = get_replay_feed(comparator).push(data)
+		dedupe_fields = [key for key in data.keys() if key != "id"]
+		success = get_replay_feed(dedupe_fields).push(data)
 		influx_metric("update_replay_feed", {"count": 1}, success=success)
 
 	except Exception as e:
@@ -1067,6 +1096,21 @@ def update_game_counter(replay):
 		error_handler(e)
 
 
+def update_live_streamers(replay):
+	"""Register the uploader's Twitch accounts as live after a game streamed to a VOD."""
+	try:
+		if replay.user is None:
+			return
+
+		twitch_user_ids = replay.user.socialaccount_set.filter(
+			provider="twitch"
+		).values_list("uid", flat=True)
+		if twitch_user_ids:
+			get_live_streamer_registry().add(*twitch_user_ids)
+	except Exception as e:
+		error_handler(e)
+
+
 def update_last_replay_upload(upload_event):
 	"""Update the last replay upload timestamp for the uploading user if user is known."""
 
@@ -1110,8 +1154,7 @@ def capture_played_card_stats(global_game, played_cards, is_friendly_player):
 			game_type_name = BnetGameType(global_game.game_type).name
 			redis = get_live_stats_redis()
 			dist = get_played_cards_distribution(game_type_name, redis_client=redis)
-			for dbf_id in played_cards:
-				dist.increment(dbf_id)
+			dist.increment_many(played_cards)
 	except Exception as e:
 		error_handler(e)
 
@@ -1256,7 +1299,9 @@ def do_process_upload_event(upload_event):
 	update_game_meta(parser, meta)
 
 	# Create/Update the global game object and its players
-	global_game, global_game_created = find_or_create_global_game(entity_tree, meta, parser)
+	global_game, global_game_created = find_or_create_global_game(
+		entity_tree, meta, parser, exporter
+	)
 	players = update_global_players(global_game, entity_tree, meta, upload_event, exporter)
 
 	# Create/Update the replay object itself
@@ -1284,6 +1329,7 @@ def do_process_upload_event(upload_event):
 
 	if has_twitch_vod_url(meta):
 		record_twitch_vod(replay, meta)
+		update_live_streamers(replay)
 
 	# Defer flushing the exporter until after the UploadEvent is set to SUCCESS
 	# So that the player can start watching their replay sooner
@@ -9,7 +9,10 @@ from raven.contrib.django.raven_compat.models import client as sentry
 from redis_semaphore import NotAvailable
 
 from hsreplaynet.analytics.processing import (
-	_do_execute_query, get_concurrent_redshift_query_queue_semaphore, refresh_meta_preview
+	_do_execute_query, complete_pending_query, compress_query_result,
+	get_concurrent_redshift_query_queue_semaphore, is_meta_preview_query,
+	mark_meta_preview_stale, refresh_meta_preview,
+	run_pending_query_callback, update_meta_preview
 )
 from hsreplaynet.settings import REDSHIFT_PREEMPTIVELY_REFRESH_QUERIES
 from hsreplaynet.utils import instrumentation
@@ -126,6 +129,17 @@ def finish_async_redshift_query(event, context):
 			**parameterized_query.supplied_filters_dict
 		)
 
+		# Hand the results to whatever is waiting on them first, so that the steps below
+		# can't leave anything waiting if they fail
+		complete_pending_query(parameterized_query)
+
+		# Compress the results up front, rather than in the first request for them
+		compress_query_result(parameterized_query)
+
+		if is_meta_preview_query(parameterized_query):
+			mark_meta_preview_stale()
+			update_meta_preview()
+
 
 @instrumentation.lambda_handler(
 	cpu_seconds=300,
@@ -279,3 +293,18 @@ def do_execute_redshift_query(query_name, supplied_params, queue_name):
 )
 def do_refresh_meta_preview(event, context):
 	refresh_meta_preview()
+
+
+@instrumentation.lambda_handler(
+	cpu_seconds=900,
+	requires_vpc_access=True,
+	memory=3008,
+)
+def do_run_pending_query_callback(event, context):
+	"""A handler running a callback that was waiting on the results of a query
+
+	Failures propagate, so that Lambda retries the invocation.
+	"""
+	query = get_redshift_query(event["query_name"])
+	parameterized_query = query.build_full_params(event["supplied_parameters"])
+	run_pending_query_callback(parameterized_query, event["callback"], event["kwargs"])
@@ -3,7 +3,6 @@ import logging
 import time
 from datetime import datetime
 from io import BytesIO
-from threading import Thread
 from zlib import decompress
 
 from django.conf import settings
@@ -20,7 +19,7 @@ from hsreplaynet.uploads.models import (
 from hsreplaynet.utils import instrumentation
 from hsreplaynet.utils.aws.clients import LAMBDA, S3
 from hsreplaynet.utils.influx import influx_metric
-from hsreplaynet.utils.synchronization import CountDownLatch
+from hsreplaynet.utils.synchronization import dispatch_bounded
 
 
 @instrumentation.lambda_handler(
@@ -35,8 +34,9 @@ def process_replay_upload_stream_handler(event, context):
 	A handler that supports reading from a stream with batch size > 1.
 
 	If this handler is invoked with N records in the event, then it will invoke the
-	single record processing lambda N times in parallel and exit once they have
-	all returned.
+	single record processing lambda N times, at most UPLOAD_STREAM_MAX_CONCURRENCY at
+	a time, and exit once they have all returned or timed out. The shortids of the
+	records that succeeded, failed or timed out are returned.
 
 	In combination with the number of shards in the stream, this allows for tuning the
 	parallelism of processing a stream more dynamically. The parallelism of the stream
@@ -56,34 +56,67 @@ def process_replay_upload_stream_handler(event, context):
 	"""
 	logger = logging.getLogger("hsreplaynet.lambdas.process_replay_upload_stream_handler")
 	records = event["Records"]
-	num_records = len(records)
-	logger.debug("Kinesis batch handler invoked with %s records", num_records)
+	logger.debug("Kinesis batch handler invoked with %s records", len(records))
 
-	countdown_latch = CountDownLatch(num_records)
+	# Stop waiting on child invocations shortly before this one would time out
+	deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - 5
 
-	def lambda_invoker(payload, shortid):
-		try:
-			logger.debug("About to invoke single lambda for %s", shortid)
-			LAMBDA.invoke(
-				FunctionName="process_single_replay_upload_stream_handler",
-				InvocationType="RequestResponse",  # Triggers synchronous invocation
-				Payload=payload,
-			)
-		finally:
-			logger.debug("Lambda completed for %s Decrementing latch.", shortid)
-			countdown_latch.count_down()
+	report = dispatch_upload_records(
+		records,
+		invoke_single_replay_upload_processing,
+		max_workers=settings.UPLOAD_STREAM_MAX_CONCURRENCY,
+		timeout=settings.UPLOAD_STREAM_RECORD_TIMEOUT_SECONDS,
+		deadline=deadline,
+	)
+
+	return {
+		"succeeded": report.succeeded,
+		"failed": list(report.failed),
+		"timed_out": report.timed_out,
+	}
+
+
+def invoke_single_replay_upload_processing(payload):
+	response = LAMBDA.invoke(
+		FunctionName="process_single_replay_upload_stream_handler",
+		InvocationType="RequestResponse",  # Triggers synchronous invocation
+		Payload=payload,
+	)
+	if response.get("FunctionError"):
+		raise RuntimeError("%s error: %s" % (
+			response["FunctionError"], response["Payload"].read().decode("utf-8")
+		))
+
+
+def dispatch_upload_records(records, invoker, max_workers, timeout=None, deadline=None):
+	"""
+	Call invoker(payload) for each Kinesis record, as a single record event payload,
+	on a bounded pool of threads (see dispatch_bounded()). Failed and timed out
+	records are logged and reported, but are not retried.
+	"""
+	logger = logging.getLogger("hsreplaynet.lambdas.process_replay_upload_stream_handler")
 
+	items = []
 	for record in records:
 		shortid = record["kinesis"]["partitionKey"]
-		payload = json.dumps({"Records": [record]})
-		logger.debug("Invoking Lambda for %s", shortid)
-		lambda_invocation = Thread(target=lambda_invoker, args=(payload, shortid))
-		lambda_invocation.start()
+		items.append((shortid, json.dumps({"Records": [record]})))
 
-	logger.debug("All child invocations have been started")
-	# We will exit once all child invocations have returned.
-	countdown_latch.await_()
-	logger.debug("All child invocations have completed")
+	report = dispatch_bounded(items, invoker, max_workers, timeout=timeout, deadline=deadline)
+	logger.debug("All child invocations have completed or timed out")
+
+	for shortid, e in report.failed.items():
+		logger.error("Processing %s failed: %r", shortid, e)
+	for shortid in report.timed_out:
+		logger.error("Processing %s timed out", shortid)
+
+	influx_metric("upload_stream_batch", {
+		"records": len(items),
+		"succeeded": len(report.succeeded),
+		"failed": len(report.failed),
+		"timed_out": len(report.timed_out),
+	})
+
+	return report
 
 
 @instrumentation.lambda_handler(
@@ -164,17 +197,10 @@ def _validate_upload_encoding(obj):
 
 	from botocore.vendored.requests.packages.urllib3.exceptions import ReadTimeoutError
 
-	def _get_file():
-		try:
-			return obj.file.open(mode="rb")
-		except ReadTimeoutError:
-			time.sleep(1)
-			return obj.file.open(mode="rb")
-
 	try:
-		with _get_file() as log_file:
-			while log_file.read(4096):
-				pass
+		# Keep the bytes we validated around for processing, rather than fetching
+		# the log from S3 a second time
+		obj.spool_log_file()
 	except (OSError, ReadTimeoutError) as e:
 		raise ValidationError("Could not read uploaded log: {0}".format(e))
 
@@ -230,81 +256,85 @@ def process_raw_upload(raw_upload, reprocess=False, log_group_name="", log_strea
 	obj.status = UploadEventStatus.VALIDATING
 
 	try:
-		if not obj.user_agent:
-			raise ValidationError("Missing User-Agent header")
-		header = headers.get("authorization", "")
-		token = auth_token_from_header(header)
-		if not token:
-			msg = "Malformed or Invalid Authorization Header: %r" % (header)
-			logger.error(msg)
-			raise ValidationError(msg)
-		obj.token_uuid = token.key
-
-		if token.test_data:
-			obj.test_data = True
-
-		api_key = headers.get("x-api-key", "")
-		if not api_key:
-			raise ValidationError("Missing X-Api-Key header. Please contact us for an API key.")
-		obj.api_key_id = LegacyAPIKey.objects.get(api_key=api_key).id
-
-		_validate_upload_encoding(obj)
-
-	except (ValidationError, LegacyAPIKey.DoesNotExist) as e:
-		logger.error("Exception: %r", e)
-		obj.status = UploadEventStatus.VALIDATION_ERROR
-		obj.error = e
-		obj.save()
-		logger.info("All state successfully saved to UploadEvent with id: %r", obj.id)
-
-		# If we get here, now everything is in the DB.
-		# Clear out the raw upload so it doesn't clog up the pipeline.
-		raw_upload.delete()
-		logger.info("Deleting objects from S3 succeeded.")
-		logger.info("Validation Error will be raised and we will not proceed to processing")
-		raise
-	else:
-		if "test_data" in upload_metadata:
-			obj.test_data = True
-
-		# Only old clients released during beta do not include a user agent
-		is_unsupported_client = obj.user_agent.startswith(settings.UPLOAD_USER_AGENT_BLACKLIST)
-
-		if is_unsupported_client:
-			logger.info("No UA provided. Marking as unsupported (client too old).")
-			influx_metric("upload_from_unsupported_client", {
-				"count": 1,
-				"shortid": raw_upload.shortid,
-			})
-			obj.status = UploadEventStatus.UNSUPPORTED_CLIENT
-
-		obj.save()
-		logger.debug("Saved: UploadEvent.id = %r", obj.id)
-
-		# If we get here, now everything is in the DB.
-		raw_upload.delete()
-		logger.debug("Deleting objects from S3 succeeded")
-
-		if is_unsupported_client:
-			# Wait until after we have deleted the raw_upload to exit
-			# But do not start processing if it's an unsupported client
-			logger.info("Exiting Without Processing - Unsupported Client")
-			return
-
-	serializer = UploadEventSerializer(obj, data=upload_metadata)
-	if serializer.is_valid():
-		logger.debug("UploadEvent passed serializer validation")
-		obj.status = UploadEventStatus.PROCESSING
-		serializer.save()
-
-		logger.debug("Starting GameReplay processing for UploadEvent")
-		obj.process()
-	else:
-		obj.error = serializer.errors
-		logger.info("UploadEvent failed validation with errors: %r", obj.error)
-
-		obj.status = UploadEventStatus.VALIDATION_ERROR
-		obj.save()
+		try:
+			if not obj.user_agent:
+				raise ValidationError("Missing User-Agent header")
+			header = headers.get("authorization", "")
+			token = auth_token_from_header(header)
+			if not token:
+				msg = "Malformed or Invalid Authorization Header: %r" % (header)
+				logger.error(msg)
+				raise ValidationError(msg)
+			obj.token_uuid = token.key
+
+			if token.test_data:
+				obj.test_data = True
+
+			api_key = headers.get("x-api-key", "")
+			if not api_key:
+				raise ValidationError("Missing X-Api-Key header. Please contact us for an API key.")
+			obj.api_key_id = LegacyAPIKey.objects.get(api_key=api_key).id
+
+			_validate_upload_encoding(obj)
+
+		except (ValidationError, LegacyAPIKey.DoesNotExist) as e:
+			logger.error("Exception: %r", e)
+			obj.status = UploadEventStatus.VALIDATION_ERROR
+			obj.error = e
+			obj.save()
+			logger.info("All state successfully saved to UploadEvent with id: %r", obj.id)
+
+			# If we get here, now everything is in the DB.
+			# Clear out the raw upload so it doesn't clog up the pipeline.
+			raw_upload.delete()
+			logger.info("Deleting objects from S3 succeeded.")
+			logger.info("Validation Error will be raised and we will not proceed to processing")
+			raise
+		else:
+			if "test_data" in upload_metadata:
+				obj.test_data = True
+
+			# Only old clients released during beta do not include a user agent
+			is_unsupported_client = obj.user_agent.startswith(settings.UPLOAD_USER_AGENT_BLACKLIST)
+
+			if is_unsupported_client:
+				logger.info("No UA provided. Marking as unsupported (client too old).")
+				influx_metric("upload_from_unsupported_client", {
+					"count": 1,
+					"shortid": raw_upload.shortid,
+				})
+				obj.status = UploadEventStatus.UNSUPPORTED_CLIENT
+
+			obj.save()
+			logger.debug("Saved: UploadEvent.id = %r", obj.id)
+
+			# If we get here, now everything is in the DB.
+			raw_upload.delete()
+			logger.debug("Deleting objects from S3 succeeded")
+
+			if is_unsupported_client:
+				# Wait until after we have deleted the raw_upload to exit
+				# But do not start processing if it's an unsupported client
+				logger.info("Exiting Without Processing - Unsupported Client")
+				return
+
+		serializer = UploadEventSerializer(obj, data=upload_metadata)
+		if serializer.is_valid():
+			logger.debug("UploadEvent passed serializer validation")
+			obj.status = UploadEventStatus.PROCESSING
+			serializer.save()
+
+			logger.debug("Starting GameReplay processing for UploadEvent")
+			obj.process()
+		else:
+			obj.error = serializer.errors
+			logger.info("UploadEvent failed validation with errors: %r", obj.error)
+
+			obj.status = UploadEventStatus.VALIDATION_ERROR
+			obj.save()
+	finally:
+		# The log spooled during validation is only needed until processing is done
+		obj.close_log_file()
 
 	logger.debug("Done")
 
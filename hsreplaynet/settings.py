@@ -363,6 +363,13 @@ HSREPLAY_CAMPAIGN = "utm_source=hsreplay.net&utm_medium=referral&utm_campaign=do
 HDT_DOWNLOAD_URL = "https://hsdecktracker.net/download/?%s" % (HSREPLAY_CAMPAIGN)
 HSTRACKER_DOWNLOAD_URL = "https://hsdecktracker.net/hstracker/download/?%s" % (HSREPLAY_CAMPAIGN)
 INFLUX_ENABLED = True
+# In Lambda handlers, metrics are buffered in memory and written by a background thread,
+# either once INFLUX_BATCH_SIZE points are pending or when the oldest one is older than
+# INFLUX_BATCH_MAX_AGE_SECONDS, and flushed at the end of each invocation. Web workers
+# always write synchronously.
+INFLUX_BUFFERED_WRITES_ENABLED = True
+INFLUX_BATCH_SIZE = 100
+INFLUX_BATCH_MAX_AGE_SECONDS = 5
 UPLOAD_USER_AGENT_BLACKLIST = ()
 COLLECTION_UPLOAD_USER_AGENT_BLACKLIST = ()
 
@@ -372,6 +379,19 @@ S3_COLLECTIONS_BUCKET = "hsreplaynet-collections"
 
 KINESIS_UPLOAD_PROCESSING_STREAM_NAME = "replay-upload-processing-stream"
 
+# When enabled, uploaded logs are decoded and fed to the parser in chunks of
+# UPLOAD_LOG_READ_CHUNK_SIZE bytes instead of being decoded into memory all at once
+UPLOAD_LOG_STREAMING_PARSE_ENABLED = True
+UPLOAD_LOG_READ_CHUNK_SIZE = 64 * 1024
+# Validated logs are kept for processing in a temporary file that stays in memory up to
+# this many bytes and is spooled to disk beyond that
+UPLOAD_LOG_SPOOL_MAX_MEMORY_SIZE = 8 * 1024 * 1024
+
+# How many single record processing Lambdas a Kinesis upload batch invokes at once
+UPLOAD_STREAM_MAX_CONCURRENCY = 50
+# Seconds after which a single record processing Lambda is reported as timed out
+UPLOAD_STREAM_RECORD_TIMEOUT_SECONDS = 170
+
 # The target maximum seconds it should take for kinesis to process a backlog of raw uploads
 # This value is used to periodically dynamically resize the stream capacity
 KINESIS_STREAM_PROCESSING_THROUGHPUT_SLA_SECONDS = 600
@@ -410,9 +430,21 @@ ARCHETYPE_TECH_CARD_WEIGHT = .5
 
 ARCHETYPE_FIREHOSE_STREAM_NAME = "deck-archetype-log-stream"
 
+# How often processes check whether their cached signature weights are still current
+ARCHETYPE_SIGNATURE_WEIGHTS_VERSION_CHECK_SECONDS = 60
+
 REDSHIFT_LOADING_ENABLED = True
 REDSHIFT_QUERY_UNLOAD_BUCKET = "hsreplaynet-analytics-results"
 
+# Redshift engines are shared per process and per credential set. Connections are
+# pinged before being reused and recycled after REDSHIFT_ENGINE_POOL_RECYCLE_SECONDS.
+# Set REDSHIFT_ENGINE_POOL_SIZE to 0 to open a fresh connection every time instead.
+# Lambdas don't pool, as every warm container would otherwise hold idle connections
+# against the cluster's connection limit until they are recycled.
+REDSHIFT_ENGINE_POOL_SIZE = 0 if ENV_LAMBDA else 2
+REDSHIFT_ENGINE_POOL_MAX_OVERFLOW = 3
+REDSHIFT_ENGINE_POOL_RECYCLE_SECONDS = 15 * 60
+
 # This controls whether we preemptively refresh queries before they go stale from the
 # refresh_stale_redshift_queries lambda
 REDSHIFT_PREEMPTIVELY_REFRESH_QUERIES = True
@@ -457,6 +489,16 @@ REDSHIFT_QUERY_QUEUES = {
 }
 REDSHIFT_ANALYTICS_QUERY_QUEUE_NAME = "redshift_analytics_query_queue"
 REDSHIFT_PERSONALIZED_QUERY_QUEUE_NAME = "redshift_personalized_query_queue"
+
+# Cache warming queues stale queries in order of how often they're read, how stale they
+# are and how long they take to run. Queued queries are not queued again until they ran
+# or CACHE_WARMING_QUEUED_QUERY_TTL seconds have passed.
+CACHE_WARMING_MAX_TRACKED_QUERIES = 20000
+CACHE_WARMING_QUEUED_QUERY_TTL = 2 * 3600
+# Assumed for results that don't exist yet, and the most staleness counts for
+CACHE_WARMING_MAX_STALENESS_SECONDS = 7 * 24 * 3600
+# Assumed for queries that never ran before
+CACHE_WARMING_DEFAULT_RUNTIME_SECONDS = 30
 # Set this to True if reprocessing after a long processing pause to maintain
 # an accurate distribution of games
 REDSHIFT_USE_MATCH_START_AS_GAME_DATE = False
@@ -466,6 +508,14 @@ REDSHIFT_USE_MATCH_START_AS_GAME_DATE = False
 #  1 Hour = 3600
 MINIMUM_QUERY_REFRESH_INTERVAL = 1200
 
+# The homepage meta preview asks for its queries to be refreshed at most this often
+META_PREVIEW_REFRESH_INTERVAL = 300
+# ... and is rebuilt from their results at most this often
+META_PREVIEW_REBUILD_INTERVAL = 60
+
+# Analytics query results are also kept gzipped, to be served without recompressing them
+ANALYTICS_COMPRESSED_RESULT_TTL = 7 * 24 * 3600
+
 ARCHETYPE_QUERIES_FOR_IMMEDIATE_REFRESH = [
 	"head_to_head_archetype_matchups",
 	"archetype_popularity_distribution_stats",
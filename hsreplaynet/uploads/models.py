@@ -5,6 +5,7 @@ import time
 from base64 import b64decode
 from datetime import datetime, timedelta
 from enum import IntEnum
+from tempfile import SpooledTemporaryFile
 from uuid import uuid4
 
 from django.conf import settings
@@ -20,6 +21,7 @@ from hsredshift.etl.materialized_views import (
 )
 from hsredshift.etl.models import create_staging_table, list_staging_eligible_tables
 from hsredshift.utils.sql import is_in_flight, run_redshift_background_statement
+from hsreplaynet.uploads.utils import iter_decoded_lines
 from hsreplaynet.utils import aws, log
 from hsreplaynet.utils.aws import redshift, streams
 from hsreplaynet.utils.aws.clients import FIREHOSE
@@ -48,28 +50,28 @@ def get_handle_status(handle, min_statements=1):
 	""" % handle
 	log.info("Fetching handle status for: %s" % handle)
 
-	conn = redshift.get_new_redshift_connection(etl_user=True)
-	rp = conn.execute(query)
-	first_row = rp.first()
-	if first_row:
-		had_errors = first_row[0]
-		num_statements = first_row[1]
-		finished_at = first_row[2]
-
-		# Even if we have fewer than the min_statements
-		# We assume that no further statements will execute
-		# Due to the earlier aborted query
-		is_complete = had_errors or (num_statements >= min_statements)
-		msg = "is_complete = %s, had_errors = %s, num_statements = %s, finished_at = %s"
-		log.info(msg % (is_complete, had_errors, num_statements, finished_at))
-		return is_complete, had_errors, num_statements, finished_at
-
-	else:
-		log.info("No records in SVL_QLOG for handle yet")
-		if not is_in_flight(conn, handle):
-			log.warn("%s does not seem to be in_flight" % (handle))
-			# TODO: Return an error state so we can fail or restart
-		return False, None, None, None
+	with redshift.get_new_redshift_connection(etl_user=True) as conn:
+		rp = conn.execute(query)
+		first_row = rp.first()
+		if first_row:
+			had_errors = first_row[0]
+			num_statements = first_row[1]
+			finished_at = first_row[2]
+
+			# Even if we have fewer than the min_statements
+			# We assume that no further statements will execute
+			# Due to the earlier aborted query
+			is_complete = had_errors or (num_statements >= min_statements)
+			msg = "is_complete = %s, had_errors = %s, num_statements = %s, finished_at = %s"
+			log.info(msg % (is_complete, had_errors, num_statements, finished_at))
+			return is_complete, had_errors, num_statements, finished_at
+
+		else:
+			log.info("No records in SVL_QLOG for handle yet")
+			if not is_in_flight(conn, handle):
+				log.warn("%s does not seem to be in_flight" % (handle))
+				# TODO: Return an error state so we can fail or restart
+			return False, None, None, None
 
 
 _md_cache = {}
@@ -338,6 +340,9 @@ class UploadEvent(models.Model):
 	log_group_name = models.CharField(max_length=64, blank=True)
 	updated = models.DateTimeField(auto_now=True)
 
+	# Local copy of the log read by spool_log_file(), not persisted
+	_log_spool = None
+
 	def __str__(self):
 		return self.shortid
 
@@ -393,7 +398,7 @@ class UploadEvent(models.Model):
 			args=[self.id]
 		)
 
-	def log_bytes(self):
+	def _open_log_file(self):
 		from botocore.vendored.requests.packages.urllib3.exceptions import ReadTimeoutError
 		try:
 			self.file.open(mode="rb")
@@ -402,7 +407,59 @@ class UploadEvent(models.Model):
 			time.sleep(1)
 			self.file.open(mode="rb")
 
-		return self.file.read()
+	def spool_log_file(self, max_size=None):
+		"""
+		Read the uploaded log from storage once, into a temporary file that
+		log_bytes() and log_lines() are then served from.
+		Up to `max_size` bytes are held in memory, anything larger goes to disk.
+		"""
+		max_size = max_size or settings.UPLOAD_LOG_SPOOL_MAX_MEMORY_SIZE
+		spool = SpooledTemporaryFile(max_size=max_size)
+		try:
+			self._open_log_file()
+			try:
+				for chunk in self.file.chunks(settings.UPLOAD_LOG_READ_CHUNK_SIZE):
+					spool.write(chunk)
+			finally:
+				self.file.close()
+		except BaseException:
+			spool.close()
+			raise
+
+		self.close_log_file()
+		self._log_spool = spool
+
+	def close_log_file(self):
+		self.file.close()
+		if self._log_spool is not None:
+			self._log_spool.close()
+			self._log_spool = None
+
+	def _log_chunks(self, chunk_size):
+		if self._log_spool is None:
+			self._open_log_file()
+			return self.file.chunks(chunk_size)
+
+		spool = self._log_spool
+		spool.seek(0)
+		return iter(lambda: spool.read(chunk_size), b"")
+
+	def log_bytes(self):
+		if self._log_spool is None:
+			self._open_log_file()
+			return self.file.read()
+
+		self._log_spool.seek(0)
+		return self._log_spool.read()
+
+	def log_lines(self, chunk_size=None):
+		"""
+		Iterate over the decoded lines of the uploaded log.
+		Unlike log_bytes(), the file is read and decoded in chunks of `chunk_size`
+		bytes so that the whole log never needs to be held in memory.
+		"""
+		chunk_size = chunk_size or settings.UPLOAD_LOG_READ_CHUNK_SIZE
+		return iter_decoded_lines(self._log_chunks(chunk_size))
 
 	def process(self):
 		from hsreplaynet.games.processing import process_upload_event
@@ -1933,10 +1990,9 @@ class RedshiftStagingTrackTable(models.Model):
 			handle=self.vacuum_query_handle,
 		)
 
-		conn = redshift.get_new_redshift_connection(etl_user=True)
-		rp1 = conn.execute(sql)
+		with redshift.get_new_redshift_connection(etl_user=True) as conn:
+			rows = list(conn.execute(sql))
 
-		rows = list(rp1)
 		if len(rows) == 1:
 			latest_end_date = rows[0][0]
 			tz_aware_ending_timestamp = timezone.make_aware(latest_end_date)
@@ -1949,7 +2005,8 @@ class RedshiftStagingTrackTable(models.Model):
 		query = """
 			SELECT pct_unsorted FROM pct_unsorted_rows WHERE table_name = '%s';
 		""" % self.target_table
-		return redshift.get_new_redshift_connection(etl_user=True).execute(query).scalar()
+		with redshift.get_new_redshift_connection(etl_user=True) as conn:
+			return conn.execute(query).scalar()
 
 	def vacuum_is_needed(self):
 		VACUUM_THRESHOLD = settings.REDSHIFT_PCT_UNSORTED_ROWS_TOLERANCE
@@ -1983,9 +2040,8 @@ class RedshiftStagingTrackTable(models.Model):
 	def record_deduped_table_size(self):
 		if self.final_staging_table_size:
 			query = "select count(*) from %s;" % self.pre_insert_table_name
-			self.deduped_table_size = redshift.get_new_redshift_connection(
-				etl_user=True
-			).execute(query).scalar()
+			with redshift.get_new_redshift_connection(etl_user=True) as conn:
+				self.deduped_table_size = conn.execute(query).scalar()
 		else:
 			self.deduped_table_size = 0
 		self.save()
@@ -1993,15 +2049,15 @@ class RedshiftStagingTrackTable(models.Model):
 	def record_pre_insert_prod_table_size(self):
 		if self.target_eligible_for_prod_table_size_metric():
 			query = "select count(*) from %s;" % self.target_table
-			rp = redshift.get_new_redshift_connection(etl_user=True).execute(query)
-			self.pre_insert_table_size = rp.scalar()
+			with redshift.get_new_redshift_connection(etl_user=True) as conn:
+				self.pre_insert_table_size = conn.execute(query).scalar()
 			self.save()
 
 	def record_post_insert_prod_table_size(self):
 		if self.target_eligible_for_prod_table_size_metric():
 			query = "select count(*) from %s;" % self.target_table
-			rp = redshift.get_new_redshift_connection(etl_user=True).execute(query)
-			self.post_insert_table_size = rp.scalar()
+			with redshift.get_new_redshift_connection(etl_user=True) as conn:
+				self.post_insert_table_size = conn.execute(query).scalar()
 			self.save()
 
 	def target_eligible_for_prod_table_size_metric(self):
@@ -1,3 +1,6 @@
+import codecs
+
+
 def user_agent_product(user_agent):
 	"""Returns the "product" component of the specified user agent string
 
@@ -26,3 +29,29 @@ def user_agent_product(user_agent):
 		return None
 
 	return user_agent[:idx]
+
+
+def iter_decoded_lines(chunks, encoding="utf-8"):
+	"""Decode an iterable of byte chunks into an iterator of text lines
+
+	Lines are split on "\\n" only and keep their line ending, matching iteration over an
+	io.StringIO built from the fully decoded content. Multi-byte sequences straddling
+	chunk boundaries are handled by an incremental decoder, so at most one chunk and one
+	partial line are held in memory at any time.
+
+	:param chunks: An iterable of bytes objects, e.g. File.chunks()
+	:param encoding: The encoding to decode the chunks with
+	:return: An iterator over the decoded lines
+	"""
+
+	decoder = codecs.getincrementaldecoder(encoding)()
+	remainder = ""
+
+	for chunk in chunks:
+		*lines, remainder = (remainder + decoder.decode(chunk)).split("\n")
+		for line in lines:
+			yield line + "\n"
+
+	remainder += decoder.decode(b"", final=True)
+	if remainder:
+		yield remainder
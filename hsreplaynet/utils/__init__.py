@@ -59,3 +59,22 @@ def card_db():
 		db, _ = load_dbf()
 		_CARD_DATA_CACHE["db"] = db
 	return _CARD_DATA_CACHE["db"]
+
+
+def hero_player_classes():
+	"""
+	Return a dict of hero dbf ids and card ids to their player class.
+
+	Derived from card_db() and rebuilt whenever the card database is reloaded.
+	"""
+	db = card_db()
+	cached_db, classes = _CARD_DATA_CACHE.get("hero_player_classes", (None, None))
+	if cached_db is not db:
+		from hearthstone.enums import CardType
+		classes = {}
+		for dbf_id, card in db.items():
+			if card.type == CardType.HERO:
+				classes[dbf_id] = card.card_class
+				classes[card.card_id] = card.card_class
+		_CARD_DATA_CACHE["hero_player_classes"] = (db, classes)
+	return classes
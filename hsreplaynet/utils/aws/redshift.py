@@ -1,9 +1,12 @@
+import os
+from threading import Lock
+
 from django.conf import settings
 from django.core.cache import caches
 from sqlalchemy import create_engine
 from sqlalchemy.engine.url import URL
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.pool import NullPool
+from sqlalchemy.pool import NullPool, QueuePool
 
 from hsredshift.analytics.queries import RedshiftCatalogue
 from hsreplaynet.utils.influx import influx
@@ -13,7 +16,12 @@ def get_redshift_cache_redis_client():
 	return caches["redshift"].client.get_client()
 
 
-def get_redshift_engine(etl_user=False):
+_redshift_engines = {}
+_redshift_engines_pid = None
+_redshift_engines_lock = Lock()
+
+
+def create_redshift_engine(etl_user=False, database=None):
 	db = settings.REDSHIFT_DATABASE
 	username = db["ETL_USER"] if etl_user else db["USER"]
 	password = db["ETL_PASSWORD"] if etl_user else db["PASSWORD"]
@@ -21,14 +29,55 @@ def get_redshift_engine(etl_user=False):
 		db["ENGINE"],
 		username=username, password=password,
 		host=db["HOST"], port=db["PORT"],
-		database=db["NAME"]
+		database=database or db["NAME"]
 	)
+
+	pool_size = getattr(settings, "REDSHIFT_ENGINE_POOL_SIZE", 0)
+	if not pool_size:
+		return create_engine(url, poolclass=NullPool, connect_args=db["OPTIONS"])
+
 	return create_engine(
-		url, poolclass=NullPool,
-		connect_args=settings.REDSHIFT_DATABASE["OPTIONS"]
+		url,
+		poolclass=QueuePool,
+		pool_size=pool_size,
+		max_overflow=settings.REDSHIFT_ENGINE_POOL_MAX_OVERFLOW,
+		pool_recycle=settings.REDSHIFT_ENGINE_POOL_RECYCLE_SECONDS,
+		pool_pre_ping=True,
+		connect_args=db["OPTIONS"]
 	)
 
 
+def get_redshift_engine(etl_user=False, database=None):
+	"""
+	Return the engine for the given credential set, creating it on first use.
+
+	Engines (and their connection pools) are shared for the lifetime of the process.
+	"""
+	global _redshift_engines_pid
+
+	key = (bool(etl_user), database or settings.REDSHIFT_DATABASE["NAME"])
+	with _redshift_engines_lock:
+		if _redshift_engines_pid != os.getpid():
+			# Pooled connections must never be shared with a forked child. Don't
+			# dispose() them here either, that would close the parent's sockets.
+			_redshift_engines.clear()
+			_redshift_engines_pid = os.getpid()
+
+		if key not in _redshift_engines:
+			_redshift_engines[key] = create_redshift_engine(*key)
+		return _redshift_engines[key]
+
+
+def dispose_redshift_engines():
+	"""
+	Close all pooled connections and forget the engines.
+	"""
+	with _redshift_engines_lock:
+		for engine in _redshift_engines.values():
+			engine.dispose()
+		_redshift_engines.clear()
+
+
 def get_new_redshift_connection(autocommit=True, etl_user=False):
 	conn = get_redshift_engine(etl_user).connect()
 	if autocommit:
@@ -63,7 +112,8 @@ def get_redshift_query(query):
 
 def inflight_query_count(handle):
 	query = "SELECT count(*) FROM STV_INFLIGHT WHERE label = '%s';" % handle
-	return get_new_redshift_connection(etl_user=True).execute(query).scalar()
+	with get_new_redshift_connection(etl_user=True) as conn:
+		return conn.execute(query).scalar()
 
 
 def has_inflight_queries(handle):
@@ -80,5 +130,6 @@ def is_analyze_skipped(handle):
 		AND status = 'Skipped';
 	"""
 	query = query_template.format(handle=handle)
-	count = get_new_redshift_connection(etl_user=True).execute(query).scalar()
+	with get_new_redshift_connection(etl_user=True) as conn:
+		count = conn.execute(query).scalar()
 	return count >= 1
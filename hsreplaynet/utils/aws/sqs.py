@@ -1,33 +1,75 @@
 import json
 import time
 
+from botocore.exceptions import ClientError
+
 from hsreplaynet.utils import log
+from hsreplaynet.utils.synchronization import dispatch_bounded
 
 from .clients import SQS
 
 
-def get_or_create_queue(queue_name):
-	# If the queue already exists, the existing queue will be returned.
-	response = SQS.create_queue(QueueName=queue_name)
-	return response["QueueUrl"]
+# SQS accepts up to 10 messages per send_message_batch call
+SQS_MAX_BATCH_SIZE = 10
+SQS_MAX_IN_FLIGHT_BATCHES = 8
 
+# Queue URLs only change when a queue is deleted and created again, so we look them up
+# once per process, and again when the queue they point to turns out to be gone.
+_queue_urls = {}
 
-def write_messages_to_queue(queue_name, messages):
-	queue_url = get_or_create_queue(queue_name)
 
-	# Messages can be batched to SQS 10 at a time
-	for batch in batches(messages, 10):
+def get_or_create_queue(queue_name):
+	queue_url = _queue_urls.get(queue_name)
+	if queue_url is None:
+		# If the queue already exists, the existing queue will be returned.
+		response = SQS.create_queue(QueueName=queue_name)
+		queue_url = _queue_urls[queue_name] = response["QueueUrl"]
+	return queue_url
+
+
+def _call_queue(queue_name, method, **kwargs):
+	"""
+	Call `method` of the SQS client with the queue's URL. If the cached URL points to a
+	queue that no longer exists, it is looked up again and the call retried once.
+	"""
+	try:
+		return method(QueueUrl=get_or_create_queue(queue_name), **kwargs)
+	except ClientError as e:
+		if e.response["Error"]["Code"] != "AWS.SimpleQueueService.NonExistentQueue":
+			raise
+		_queue_urls.pop(queue_name, None)
+		return method(QueueUrl=get_or_create_queue(queue_name), **kwargs)
+
+
+def write_messages_to_queue(queue_name, messages, max_in_flight=SQS_MAX_IN_FLIGHT_BATCHES):
+	"""
+	Send the messages to the queue in batches, with up to `max_in_flight` batches
+	being sent at once. Raises RuntimeError once all batches have been attempted if
+	any messages failed to send.
+	"""
+	def send(entries):
+		response = _call_queue(queue_name, SQS.send_message_batch, Entries=entries)
+		if "Failed" in response and len(response["Failed"]):
+			raise RuntimeError(json.dumps(response["Failed"]))
+
+	items = []
+	for batch_index, batch in enumerate(batches(messages, SQS_MAX_BATCH_SIZE)):
 		entries = []
 		for id, message in enumerate(batch):
 			entries.append({
 				"Id": str(id),
 				"MessageBody": json.dumps(message, separators=(",", ":"))
 			})
+		items.append((batch_index, entries))
 
-		response = SQS.send_message_batch(QueueUrl=queue_url, Entries=entries)
-		if "Failed" in response and len(response["Failed"]):
-			log.error(json.dumps(response["Failed"]))
-			raise RuntimeError(json.dumps(response["Failed"]))
+	report = dispatch_bounded(items, send, max_workers=max_in_flight)
+	if report.failed:
+		errors = [str(report.failed[batch_index]) for batch_index in sorted(report.failed)]
+		for error in errors:
+			log.error(error)
+		raise RuntimeError("%i of %i batches failed to send to %s: %s" % (
+			len(errors), len(items), queue_name, errors[0]
+		))
 
 
 def batches(l, n):
@@ -41,8 +83,8 @@ def get_messages(queue_name, max_num=10):
 	do_receive = True
 
 	while do_receive and len(result) < max_num:
-		response = SQS.receive_message(
-			QueueUrl=get_or_create_queue(queue_name),
+		response = _call_queue(
+			queue_name, SQS.receive_message,
 			MaxNumberOfMessages=10
 		)
 		messages = response.get("Messages", [])
@@ -60,8 +102,8 @@ def get_approximate_queue_size(queue_name):
 		"ApproximateNumberOfMessagesDelayed",
 		"ApproximateNumberOfMessagesNotVisible"
 	]
-	response = SQS.get_queue_attributes(
-		QueueUrl=get_or_create_queue(queue_name),
+	response = _call_queue(
+		queue_name, SQS.get_queue_attributes,
 		AttributeNames=attributes
 	)
 	return sum(int(response["Attributes"][attrib]) for attrib in attributes)
@@ -1,9 +1,13 @@
 import logging
+import random
 import time
 from math import ceil
 
+from botocore.exceptions import ClientError
 from django.conf import settings
 
+from hsreplaynet.utils.influx import influx_metric
+
 from .clients import FIREHOSE, IAM, KINESIS
 
 
@@ -13,6 +17,13 @@ KINESIS_WRITES_PER_SEC = 1000
 KINESIS_MAX_BATCH_WRITE_SIZE = 500
 MAX_WRITES_SAFETY_LIMIT = .8
 
+FIREHOSE_MAX_BATCH_RECORDS = 500
+FIREHOSE_MAX_BATCH_BYTES = 4 * 1024 * 1024
+FIREHOSE_MAX_RECORD_BYTES = 1000 * 1024
+# Firehose bills ingestion in 5KB increments per record
+FIREHOSE_BILLING_INCREMENT = 5 * 1024
+FIREHOSE_THROTTLING_ERROR = "ServiceUnavailableException"
+
 
 def get_firehose_role_arn() -> str:
 	role = IAM.get_role(
@@ -176,15 +187,36 @@ def to_data_blobs(records, max_blob_size=1000):
 	return result
 
 
-def publish_batch_to_firehose(stream_name, batch):
+def publish_batch_to_firehose(
+	stream_name, batch, client=None, max_attempts=4, base_delay=0.1, max_delay=5,
+	on_attempt=None
+):
+	"""
+	Publish a batch of Firehose records with put_record_batch, resubmitting only the
+	records Firehose rejected. Attempts are bounded by `max_attempts` and spaced by a
+	jittered exponential backoff starting at `base_delay` seconds. `on_attempt` is
+	called with the failure reports of every attempt.
+
+	Returns the failure reports of the records still rejected after the last attempt.
+	"""
+	client = client or FIREHOSE
+	start_time = time.monotonic()
 	remainder = batch
-	failure_report_records = None
+	failure_report_records = []
 	attempt_count = 0
-	while len(remainder) and attempt_count <= 3:
+	while len(remainder) and attempt_count < max_attempts:
+		if attempt_count:
+			backoff = min(max_delay, base_delay * 2 ** (attempt_count - 1))
+			time.sleep(random.uniform(0, backoff))
+		attempt_count += 1
+
 		remainder, failure_report_records = _attempt_publish_batch_to_firehose(
 			stream_name,
-			remainder
+			remainder,
+			client
 		)
+		if on_attempt:
+			on_attempt(failure_report_records)
 		if len(remainder):
 			msg = "Firehose attempt %i had %i publish failures"
 			logger.warning(msg % (attempt_count, len(remainder)))
@@ -193,13 +225,53 @@ def publish_batch_to_firehose(stream_name, batch):
 		msg = "Firehose had %i publish failures remaining after last attempt"
 		logger.warning(msg % len(failure_report_records))
 
-
-def _attempt_publish_batch_to_firehose(stream_name, batch):
-	result = FIREHOSE.put_record_batch(
-		DeliveryStreamName=stream_name,
-		Records=batch
+	duration = time.monotonic() - start_time
+	published_count = len(batch) - len(failure_report_records)
+	influx_metric(
+		"firehose_publish_batch",
+		{
+			"records": len(batch),
+			"failed": len(failure_report_records),
+			"attempts": attempt_count,
+			"bytes": sum(len(record["Data"]) for record in batch),
+			"duration": duration,
+			"records_per_second": published_count / duration if duration else 0,
+		},
+		stream_name=stream_name
 	)
 
+	return failure_report_records
+
+
+class FirehoseWriteError(Exception):
+	def __init__(self, stream_name, failed_count):
+		super().__init__(
+			"%i records could not be written to %s" % (failed_count, stream_name)
+		)
+		self.stream_name = stream_name
+		self.failed_count = failed_count
+
+
+def _attempt_publish_batch_to_firehose(stream_name, batch, client=None):
+	client = client or FIREHOSE
+	try:
+		result = client.put_record_batch(
+			DeliveryStreamName=stream_name,
+			Records=batch
+		)
+	except ClientError as e:
+		error = e.response.get("Error", {})
+		if error.get("Code") != FIREHOSE_THROTTLING_ERROR:
+			raise
+		# The whole call was throttled, so every record needs resubmitting
+		result = {
+			"FailedPutCount": len(batch),
+			"RequestResponses": [{
+				"ErrorCode": error["Code"],
+				"ErrorMessage": error.get("Message", ""),
+			}] * len(batch),
+		}
+
 	failed_put_count = result["FailedPutCount"]
 
 	failure_report_records = []
@@ -216,3 +288,135 @@ def _attempt_publish_batch_to_firehose(stream_name, batch):
 
 	assert failed_put_count == len(failed_records)
 	return failed_records, failure_report_records
+
+
+class BufferedFirehoseWriter:
+	"""
+	Buffers newline terminated records for a Firehose delivery stream and writes them
+	with put_record_batch.
+
+	Records are coalesced into blobs of up to `blob_size` bytes, and blobs into batches
+	within the put_record_batch record and byte limits, and published with
+	publish_batch_to_firehose(). Writes are paced to a byte rate starting at
+	`max_bytes_per_second`: the rate is halved whenever Firehose throttles part of an
+	attempt, and recovers gradually while attempts go through cleanly. Records failing
+	`max_attempts` times are dropped and counted in `failed_count`, and the write that
+	dropped them raises FirehoseWriteError.
+
+	Use as a context manager, or call flush() once all records have been put. Leaving
+	the context manager with an exception discards the records still buffered.
+	"""
+
+	def __init__(
+		self,
+		stream_name,
+		client=None,
+		blob_size=FIREHOSE_BILLING_INCREMENT,
+		max_bytes_per_second=4 * 1024 * 1024,
+		min_bytes_per_second=64 * 1024,
+		max_attempts=5
+	):
+		self.stream_name = stream_name
+		self.client = client or FIREHOSE
+		self.blob_size = blob_size
+		self.max_bytes_per_second = max_bytes_per_second
+		self.min_bytes_per_second = min_bytes_per_second
+		self.bytes_per_second = max_bytes_per_second
+		self.max_attempts = max_attempts
+		self.sent_count = 0
+		self.failed_count = 0
+		self._blob = []
+		self._blob_size = 0
+		# Blobs for the next put_record_batch call
+		self._batch = []
+		self._batch_size = 0
+		self._next_write_time = 0
+		self._throttled = False
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is not None:
+			# Don't mask the error with a flush that may fail itself
+			buffered_size = self._blob_size + self._batch_size
+			if buffered_size:
+				logger.warning(
+					"Discarding %i bytes of buffered Firehose records for %s after an error",
+					buffered_size, self.stream_name
+				)
+			return
+
+		self.flush()
+
+	def put(self, record):
+		data = record.encode("utf-8") if isinstance(record, str) else record
+		if len(data) > FIREHOSE_MAX_RECORD_BYTES:
+			raise ValueError("Record of %i bytes exceeds the Firehose limit" % (len(data)))
+
+		if self._blob_size + len(data) > self.blob_size:
+			self._seal_blob()
+		self._blob.append(data)
+		self._blob_size += len(data)
+
+	def flush(self):
+		self._seal_blob()
+		if self._batch:
+			self._write_batch()
+
+	def _seal_blob(self):
+		if not self._blob:
+			return
+
+		blob = b"".join(self._blob)
+		self._blob = []
+		self._blob_size = 0
+
+		if (
+			len(self._batch) >= FIREHOSE_MAX_BATCH_RECORDS or
+			self._batch_size + len(blob) > FIREHOSE_MAX_BATCH_BYTES
+		):
+			self._write_batch()
+		self._batch.append(blob)
+		self._batch_size += len(blob)
+
+	def _write_batch(self):
+		batch, self._batch = self._batch, []
+		self._batch_size = 0
+		batch_size = sum(len(data) for data in batch)
+
+		delay = self._next_write_time - time.monotonic()
+		if delay > 0:
+			time.sleep(delay)
+
+		failure_report_records = publish_batch_to_firehose(
+			self.stream_name,
+			[{"Data": data} for data in batch],
+			client=self.client,
+			max_attempts=self.max_attempts,
+			on_attempt=self._adapt_rate
+		)
+		self.sent_count += len(batch) - len(failure_report_records)
+
+		delay = batch_size / self.bytes_per_second
+		if self._throttled:
+			# Firehose limits are enforced per second, so let the current one pass
+			delay = max(delay, 1)
+		self._next_write_time = time.monotonic() + delay
+
+		if failure_report_records:
+			self.failed_count += len(failure_report_records)
+			raise FirehoseWriteError(self.stream_name, len(failure_report_records))
+
+	def _adapt_rate(self, failure_report_records):
+		self._throttled = any(
+			failure["error_code"] == FIREHOSE_THROTTLING_ERROR
+			for failure in failure_report_records
+		)
+		if self._throttled:
+			self.bytes_per_second = max(self.min_bytes_per_second, self.bytes_per_second / 2)
+		else:
+			self.bytes_per_second = min(
+				self.max_bytes_per_second,
+				self.bytes_per_second + self.max_bytes_per_second / 10
+			)
@@ -4,3 +4,14 @@ import json
 def defaultdict_to_vanilla_dict(d):
 	dict_str = json.dumps(d)
 	return json.loads(dict_str)
+
+
+def multiset_issubset(sub, sup):
+	"""
+	Test whether every element of the `sub` multiset is in `sup` at least as often.
+
+	Both arguments map elements to their counts (eg. collections.Counter).
+	"""
+	if len(sub) > len(sup):
+		return False
+	return all(sup.get(key, 0) >= count for key, count in sub.items())
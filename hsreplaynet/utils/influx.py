@@ -1,5 +1,7 @@
 """Utils for interacting with Influx"""
+import atexit
 import resource
+import threading
 import time
 from contextlib import contextmanager
 
@@ -65,6 +67,142 @@ def influx_write_payload(payload, client=influx):
 	return result
 
 
+class BufferedInfluxWriter:
+	"""
+	Buffers points in memory and writes them to Influx in batches.
+
+	A batch is written as soon as `batch_size` points are pending, or once the
+	oldest pending point is older than `max_age` seconds. Writes happen on a
+	background daemon thread so that callers never wait on the network; call
+	flush() to synchronously drain the buffer (eg. at the end of a Lambda
+	invocation, before the container is frozen).
+	"""
+
+	def __init__(self, client, batch_size=100, max_age=5.0, max_pending=10000):
+		self.client = client
+		self.batch_size = batch_size
+		self.max_age = max_age
+		self.max_pending = max_pending
+		self._points = []
+		self._first_point_time = None
+		self._lock = threading.Lock()
+		self._flush_lock = threading.Lock()
+		self._wakeup = threading.Event()
+		self._thread = None
+
+	def write(self, points):
+		if self.client is None:
+			return
+
+		with self._lock:
+			was_empty = not self._points
+			if was_empty:
+				self._first_point_time = time.monotonic()
+			self._points.extend(points)
+			if len(self._points) > self.max_pending:
+				# Influx is unreachable or too slow; drop the oldest points rather
+				# than growing without bound.
+				dropped = len(self._points) - self.max_pending
+				del self._points[:dropped]
+				log.warn("Influx buffer full, dropped %i points", dropped)
+			batch_full = len(self._points) >= self.batch_size
+
+		self._ensure_thread()
+		if was_empty or batch_full:
+			# Let the writer thread pick up the new deadline (or write right away)
+			self._wakeup.set()
+
+	def flush(self):
+		"""
+		Write all pending points to Influx, blocking until done.
+		Returns False if any batch failed to write.
+		"""
+		with self._flush_lock:
+			with self._lock:
+				points, self._points = self._points, []
+				self._first_point_time = None
+
+			result = True
+			for i in range(0, len(points), self.batch_size):
+				batch = points[i:i + self.batch_size]
+				if not influx_write_payload(batch, client=self.client):
+					result = False
+			return result
+
+	def _ensure_thread(self):
+		if self._thread is not None and self._thread.is_alive():
+			return
+		with self._lock:
+			if self._thread is None or not self._thread.is_alive():
+				self._thread = threading.Thread(
+					target=self._run, name="influx-writer", daemon=True
+				)
+				self._thread.start()
+
+	def _seconds_until_due(self):
+		with self._lock:
+			if not self._points:
+				return None
+			if len(self._points) >= self.batch_size:
+				return 0
+			return self._first_point_time + self.max_age - time.monotonic()
+
+	def _run(self):
+		while True:
+			timeout = self._seconds_until_due()
+			if timeout is None or timeout > 0:
+				self._wakeup.wait(timeout)
+				self._wakeup.clear()
+				continue
+			self.flush()
+
+
+_influx_writers = {}
+
+
+def enable_influx_buffering():
+	"""
+	Buffer the points written by this process and write them in batches from a
+	background thread. Only for processes which call influx_flush() before they are
+	frozen or exit, such as Lambda handlers and update_mailchimp_tags. Web workers
+	keep writing synchronously, as their threads may never get to run (eg. uWSGI
+	without enable-threads).
+	"""
+	if not settings.INFLUX_ENABLED or not settings.INFLUX_BUFFERED_WRITES_ENABLED:
+		return None
+
+	if "hsreplaynet" not in _influx_writers:
+		writer = BufferedInfluxWriter(
+			influx,
+			batch_size=settings.INFLUX_BATCH_SIZE,
+			max_age=settings.INFLUX_BATCH_MAX_AGE_SECONDS,
+		)
+		atexit.register(writer.flush)
+		_influx_writers["hsreplaynet"] = writer
+
+	return _influx_writers["hsreplaynet"]
+
+
+def influx_write_buffered(payload):
+	"""
+	Queue the payload on the buffered writer if enabled, else write it right away.
+	"""
+	writer = _influx_writers.get("hsreplaynet")
+	if writer is not None:
+		writer.write(payload)
+	else:
+		influx_write_payload(payload, client=influx)
+
+
+def influx_flush():
+	"""
+	Write any buffered points to Influx. Safe to call when buffering is disabled.
+	"""
+	writer = _influx_writers.get("hsreplaynet")
+	if writer is not None:
+		writer.flush()
+
+
 def influx_metric(measure, fields, timestamp=None, **kwargs):
 	if timestamp is None:
 		timestamp = now()
@@ -75,7 +213,7 @@ def influx_metric(measure, fields, timestamp=None, **kwargs):
 		"fields": fields,
 		"time": timestamp,
 	}
-	influx_write_payload([payload])
+	influx_write_buffered([payload])
 
 
 @contextmanager
@@ -112,7 +250,7 @@ def influx_timer(measure, timestamp=None, cloudwatch_url=None, **kwargs):
 
 		if exception_raised and cloudwatch_url:
 			payload["fields"]["cloudwatch"] = cloudwatch_url
-		influx_write_payload([payload])
+		influx_write_buffered([payload])
 
 
 def get_current_lambda_average_duration_millis(lambda_name, lookback_hours=1):
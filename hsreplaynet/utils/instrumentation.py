@@ -5,7 +5,7 @@ from django.utils.timezone import now
 from raven.contrib.django.raven_compat.models import client as sentry
 
 from . import log
-from .influx import influx_timer
+from .influx import enable_influx_buffering, influx_flush, influx_timer
 
 
 def error_handler(e):
@@ -63,6 +63,7 @@ def lambda_handler(
 	The following standard lifecycle services are provided:
 		- Sentry reporting for all Exceptions that propagate
 		- Capturing a standard set of metrics for Influx
+		- Flushing all buffered Influx metrics before returning
 		- Making sure all connections to the DB are closed
 		- Capturing metadata to facilitate deployment
 
@@ -98,6 +99,8 @@ def lambda_handler(
 
 		@wraps(func)
 		def wrapper(event, context):
+			# Metrics are flushed at the end of every invocation, so they can be buffered
+			enable_influx_buffering()
 			cloudwatch_url = get_cloudwatch_url(context)
 
 			# Provide additional metadata to sentry in case the exception
@@ -137,6 +140,10 @@ def lambda_handler(
 				if not trap_exceptions:
 					raise
 			finally:
+				# The container may be frozen as soon as the handler returns, which
+				# would stall the background writer, so drain pending metrics now.
+				influx_flush()
+
 				from django import db
 				db.connections.close_all()
 
@@ -34,6 +34,95 @@ class BaseInverseLookupTable:
 
 
 class RedisInverseLookupTable(BaseInverseLookupTable):
+	# Server-side implementation of predict(), so that a prediction costs a single round
+	# trip regardless of how many cards have to be removed before a match is found. The
+	# popularity keys of the candidate decks are built from their prefix in the script.
+	#
+	# KEYS: a temporary key for the intersections, followed by the card keys of the deck
+	# ARGV: ILT cutoff, min cards, max cards removed, deck popularity key prefix, deck
+	#       popularity cutoff, followed by one "1"/"0" flag per card key indicating
+	#       whether it is required.
+	# Returns {cards_removed, deck_id}, or just {cards_removed} if no deck matched, with
+	# cards_removed being -1 if no fuzzy matching was attempted.
+	PREDICT_SCRIPT = """
+		local tmp_key = KEYS[1]
+		local ilt_cutoff = tonumber(ARGV[1])
+		local min_cards = tonumber(ARGV[2])
+		local max_removed = tonumber(ARGV[3])
+		local deck_key_prefix = ARGV[4]
+		local popularity_cutoff = tonumber(ARGV[5])
+
+		local function intersect(keys)
+			redis.call('ZINTERSTORE', tmp_key, #keys, unpack(keys))
+			local members = redis.call('ZRANGE', tmp_key, 0, -1)
+			redis.call('DEL', tmp_key)
+			return members
+		end
+
+		local function reply(removed, candidates)
+			local best = candidates[1]
+			if #candidates > 1 then
+				local best_popularity = -1
+				for _, deck_id in ipairs(candidates) do
+					local popularity = redis.call(
+						'ZCOUNT', deck_key_prefix .. deck_id, popularity_cutoff, '+inf'
+					)
+					if popularity > best_popularity then
+						best, best_popularity = deck_id, popularity
+					end
+				end
+			end
+			return {removed, best}
+		end
+
+		local keys, required, positions = {}, {}, {}
+		for i = 2, #KEYS do
+			local key = KEYS[i]
+			redis.call('ZREMRANGEBYSCORE', key, 0, ilt_cutoff)
+			keys[#keys + 1] = key
+			required[key] = ARGV[4 + i] == '1'
+			positions[key] = i
+		end
+
+		local candidates = intersect(keys)
+		if #candidates > 0 then
+			return reply(-1, candidates)
+		end
+
+		local cardinalities = {}
+		for _, key in ipairs(keys) do
+			cardinalities[key] = redis.call('ZCARD', key)
+		end
+		table.sort(keys, function(a, b)
+			if cardinalities[a] == cardinalities[b] then
+				return positions[a] < positions[b]
+			end
+			return cardinalities[a] < cardinalities[b]
+		end)
+
+		local removed = 0
+		while #keys > math.max(min_cards, 1) and removed < max_removed do
+			local found = false
+			for index, key in ipairs(keys) do
+				if not required[key] then
+					table.remove(keys, index)
+					removed = removed + 1
+					found = true
+					break
+				end
+			end
+			if not found then
+				return {removed}
+			end
+			candidates = intersect(keys)
+			if #candidates > 0 then
+				return reply(removed, candidates)
+			end
+		end
+
+		return {removed}
+	"""
+
 	def __init__(
 		self,
 		redis: StrictRedis,
@@ -45,6 +134,7 @@ class RedisInverseLookupTable(BaseInverseLookupTable):
 		deck_popularity_lookback_mins: int = settings.ILT_DECK_POPULARITY_LOOKBACK_MINS,
 		max_fuzzy_cards_removed: int = settings.ILT_FUZZY_MAXIMUM_CARDS_REMOVED,
 		full_deck_size: int = 30,
+		use_lua: Optional[bool] = None,
 	) -> None:
 		self.redis = redis
 		self.game_format = game_format
@@ -56,6 +146,13 @@ class RedisInverseLookupTable(BaseInverseLookupTable):
 		self.max_fuzzy_cards_removed = max_fuzzy_cards_removed
 		self.full_deck_size = full_deck_size
 
+		# As with RedisPopularityDistribution, only use Lua against a real Redis server
+		# unless the caller says otherwise.
+		self.use_lua = isinstance(redis, StrictRedis) if use_lua is None else use_lua
+
+		if self.use_lua:
+			self.lua_predict = self.redis.register_script(self.PREDICT_SCRIPT)
+
 	@property
 	def namespace(self):
 		return f"DECK_PREDICTION_ILT:{self.game_format.name}_{self.player_class.name}"
@@ -119,6 +216,37 @@ class RedisInverseLookupTable(BaseInverseLookupTable):
 		# get the associated redis keys
 		keys = self._get_card_keys(dbf_map)
 
+		if self.use_lua:
+			return self._predict_server_side(keys)
+		else:
+			return self._predict_client_side(keys)
+
+	def _predict_server_side(self, keys: Set[str]) -> Optional[int]:
+		key_list = list(keys)
+		required_keys = self._get_card_keys({key: 1 for key in self.required_cards})
+
+		now_msecs = int(time.time() * 1000)
+		ilt_lookback_msecs = self.ilt_lookback_mins * 60 * 1000
+		popularity_lookback_msecs = self.deck_popularity_lookback_mins * 60 * 1000
+
+		args = [
+			now_msecs - ilt_lookback_msecs,
+			self.min_cards_for_prediction,
+			self.max_fuzzy_cards_removed,
+			self._get_deck_key(""),
+			now_msecs - popularity_lookback_msecs,
+		]
+		args.extend("1" if key in required_keys else "0" for key in key_list)
+
+		tmp_key = f"{self.namespace}:INTERSECT:{uuid4()}"
+		cards_removed, *deck_id = self.lua_predict(keys=[tmp_key] + key_list, args=args)
+		self._cards_removed = cards_removed if cards_removed >= 0 else None
+
+		if not deck_id:
+			return None
+		return int(deck_id[0].decode("utf-8"))
+
+	def _predict_client_side(self, keys: Set[str]) -> Optional[int]:
 		# check for expiry first
 		now_msecs = int(time.time() * 1000)
 		lookback_msecs = self.ilt_lookback_mins * 60 * 1000
@@ -142,10 +270,10 @@ class RedisInverseLookupTable(BaseInverseLookupTable):
 		sorted_keys = sorted(keys, key=lambda key: cardinalities[key])
 		required_keys = self._get_card_keys({key: 1 for key in self.required_cards})
 
-		# fuzzy matching: as long as we can safely remove one card...
+		# fuzzy matching: as long as we can safely remove one card, keeping at least one...
 		self._cards_removed = 0
 		while (
-			len(sorted_keys) > self.min_cards_for_prediction and
+			len(sorted_keys) > max(self.min_cards_for_prediction, 1) and
 			self._cards_removed < self.max_fuzzy_cards_removed
 		):
 			# ...find a non-required card to remove
@@ -1,4 +1,5 @@
 import json
+from collections import Counter
 from datetime import datetime, timedelta
 
 import redis_lock
@@ -27,25 +28,90 @@ class RedisNamespace:
 
 
 class RedisPopularityDistribution:
-	INCREMENT_SCRIPT = """
+	INCREMENT_MANY_SCRIPT = """
 		local myset = ARGV[1]
 		local set_length = tonumber(ARGV[2])
-		local mykey = ARGV[3]
-		local exp_ts = tonumber(ARGV[4])
-
-		if redis.call('ZRANK', myset, mykey) then
-			redis.call('ZINCRBY', myset, 1.0, mykey)
-		elseif redis.call('ZCARD', myset) < set_length then
-			redis.call('ZADD', myset, 1.0, mykey)
-		else
-			local value = redis.call('ZRANGE', myset, 0, 0, 'withscores')
-			redis.call('ZREM', myset, value[1])
-			redis.call('ZADD', myset, value[2] + 1.0, mykey)
+		local exp_ts = tonumber(ARGV[3])
+		local registry = ARGV[4]
+		local bucket_start = tonumber(ARGV[5])
+		local bucket_end = tonumber(ARGV[6])
+
+		local summaries = {}
+		for _, summary in ipairs(redis.call('ZRANGEBYSCORE', registry, bucket_end, '+inf')) do
+			if tonumber(string.match(summary, ':(%d+):%d+$')) <= bucket_start then
+				if redis.call('EXISTS', summary) == 1 then
+					summaries[#summaries + 1] = summary
+				else
+					redis.call('ZREM', registry, summary)
+				end
+			end
+		end
+
+		for i = 7, #ARGV, 2 do
+			local mykey = ARGV[i]
+			local amount = tonumber(ARGV[i + 1])
+			local evicted = nil
+
+			if redis.call('ZRANK', myset, mykey) then
+				redis.call('ZINCRBY', myset, amount, mykey)
+			elseif redis.call('ZCARD', myset) < set_length then
+				redis.call('ZADD', myset, amount, mykey)
+			else
+				evicted = redis.call('ZRANGE', myset, 0, 0, 'withscores')
+				redis.call('ZREM', myset, evicted[1])
+				redis.call('ZADD', myset, evicted[2] + amount, mykey)
+			end
+
+			for _, summary in ipairs(summaries) do
+				if evicted then
+					redis.call('ZINCRBY', summary, -evicted[2], evicted[1])
+					redis.call('ZINCRBY', summary, evicted[2] + amount, mykey)
+				else
+					redis.call('ZINCRBY', summary, amount, mykey)
+				end
+			end
+		end
+
+		for _, summary in ipairs(summaries) do
+			redis.call('ZREMRANGEBYSCORE', summary, '-inf', 0)
 		end
 
 		redis.call('EXPIREAT', myset, exp_ts)
 	"""
 
+	READ_MANY_SCRIPT = """
+		local unpack = unpack or table.unpack
+		local result = {}
+
+		local i = 1
+		while i <= #ARGV do
+			local summary = ARGV[i]
+			local num_items = tonumber(ARGV[i + 1])
+			local registry = ARGV[i + 2]
+			local exp_ts = tonumber(ARGV[i + 3])
+			local end_token = tonumber(ARGV[i + 4])
+			local oldest_end_token = tonumber(ARGV[i + 5])
+			local ttl = tonumber(ARGV[i + 6])
+			local num_buckets = tonumber(ARGV[i + 7])
+
+			local data = redis.call('ZREVRANGE', summary, 0, num_items, 'WITHSCORES')
+			if #data == 0 and num_buckets > 0 then
+				local buckets = {unpack(ARGV, i + 8, i + 7 + num_buckets)}
+				redis.call('ZUNIONSTORE', summary, num_buckets, unpack(buckets))
+				data = redis.call('ZREVRANGE', summary, 0, num_items, 'WITHSCORES')
+				redis.call('EXPIREAT', summary, exp_ts)
+				redis.call('ZADD', registry, end_token, summary)
+				redis.call('ZREMRANGEBYSCORE', registry, '-inf', oldest_end_token)
+				redis.call('EXPIRE', registry, ttl)
+			end
+
+			result[#result + 1] = data
+			i = i + 8 + num_buckets
+		end
+
+		return result
+	"""
+
 	def __init__(
 		self, redis: StrictRedis, name: str, namespace: str,
 		ttl: int = DEFAULT_TTL, max_items: int = 100, bucket_size: int = 3600,
@@ -71,15 +137,29 @@ class RedisPopularityDistribution:
 		self.use_lua = isinstance(redis, StrictRedis) if use_lua is None else use_lua
 
 		if self.use_lua:
-			self.lua_increment = self.redis.register_script(self.INCREMENT_SCRIPT)
+			self.lua_increment_many = self.redis.register_script(self.INCREMENT_MANY_SCRIPT)
+			self.lua_read_many = self.redis.register_script(self.READ_MANY_SCRIPT)
 
 	def __repr__(self):
 		return f"<{self.__class__.__name__} {self.namespace}:{self.name}>"
 
 	def increment(self, key, as_of=None):
+		self.increment_many([key], as_of=as_of)
+
+	def increment_many(self, keys, as_of=None):
+		"""
+		Record one observation for every element of `keys` (which may contain
+		duplicates) in a single round trip, rather than one per call to increment().
+
+		Summaries covering the bucket that is incremented are updated along with it.
+		"""
 		if as_of and not isinstance(as_of, datetime):
 			raise ValueError("as_of must be a datetime")
 
+		counts = Counter(str(key) for key in keys)
+		if not counts:
+			return
+
 		ts = as_of if as_of else datetime.utcnow()
 		start_token = self._to_start_token(ts)
 		end_token = self._to_end_token(ts)
@@ -88,47 +168,123 @@ class RedisPopularityDistribution:
 		expire_at = self._to_expire_at(ts)
 
 		if self.use_lua:
-			args = [bucket_key, self.max_items, key, expire_at]
-			self.lua_increment(args=args)
+			args = [
+				bucket_key, self.max_items, expire_at,
+				self._summaries_key, start_token, end_token
+			]
+			for key, amount in counts.items():
+				args.extend((key, amount))
+			self.lua_increment_many(args=args)
 		else:
-			lock_name = "%s/%s" % (self.namespace, self.name)
-			with redis_lock.Lock(self.redis, lock_name, expire=300):
-				if self.redis.zrank(bucket_key, key) is not None:
-					self.redis.zincrby(bucket_key, key, 1.0)
-				elif self.redis.zcard(bucket_key) < self.max_items:
-					self.redis.zadd(bucket_key, 1.0, key)
-				else:
-					vals = self.redis.zrange(bucket_key, 0, 0, withscores=True)
-					value, score = vals[0]
-					self.redis.zrem(bucket_key, value)
-					self.redis.zadd(bucket_key, score + 1.0, key)
-
+			with redis_lock.Lock(self.redis, self._lock_name, expire=300):
+				summaries = self._summaries_covering(start_token, end_token)
+				for key, amount in counts.items():
+					evicted = self._increment_bucket(bucket_key, key, float(amount))
+					for summary in summaries:
+						if evicted:
+							value, score = evicted
+							self.redis.zincrby(summary, value, -score)
+							self.redis.zincrby(summary, key, score + amount)
+						else:
+							self.redis.zincrby(summary, key, amount)
+				for summary in summaries:
+					self.redis.zremrangebyscore(summary, "-inf", 0)
 				self.redis.expireat(bucket_key, expire_at)
 
-	def distribution(self, start_ts=None, end_ts=None, limit=None, as_percentages=False):
-		start_ts = start_ts if start_ts else self.earliest_available_datetime
-		end_ts = end_ts if end_ts else datetime.utcnow()
+	def _increment_bucket(self, bucket_key, key, amount):
+		"""
+		Add `amount` to `key` in the bucket, evicting its least popular member if the
+		bucket is full. Returns the evicted (member, score), if any.
+		"""
+		if self.redis.zrank(bucket_key, key) is not None:
+			self.redis.zincrby(bucket_key, key, amount)
+		elif self.redis.zcard(bucket_key) < self.max_items:
+			self.redis.zadd(bucket_key, amount, key)
+		else:
+			vals = self.redis.zrange(bucket_key, 0, 0, withscores=True)
+			value, score = vals[0]
+			self.redis.zrem(bucket_key, value)
+			self.redis.zadd(bucket_key, score + amount, key)
+			return value, score
+
+	def _summaries_covering(self, start_token, end_token):
+		summaries = []
+		for summary in self.redis.zrangebyscore(self._summaries_key, end_token, "+inf"):
+			summary_start_token = int(summary.rsplit(b":", 2)[1])
+			if summary_start_token <= start_token:
+				if self.redis.exists(summary):
+					summaries.append(summary)
+				else:
+					self.redis.zrem(self._summaries_key, summary)
+		return summaries
 
-		if start_ts > end_ts:
-			raise ValueError("start_ts cannot be greater than end_ts")
+	@property
+	def _lock_name(self):
+		return "%s/%s" % (self.namespace, self.name)
 
-		exists = self._ensure_exists(start_ts, end_ts)
-		if not exists:
-			# We have no distribution data for this time period
-			return {}
+	@property
+	def _summaries_key(self):
+		# Sorted set of the summaries spanning several buckets, scored by end token
+		return "%s:%s:SUMMARIES" % (self.namespace, self.name)
 
-		start_token = self._to_start_token(start_ts)
-		end_token = self._to_end_token(end_ts)
-		bucket_key = self._bucket_key(start_token, end_token)
-		num_items = -1 if not limit else limit
-		raw_data = self.redis.zrevrange(bucket_key, 0, num_items, withscores=True)
-		data = {k.decode("utf8"): int(v) for k, v in raw_data}
+	def distribution(self, start_ts=None, end_ts=None, limit=None, as_percentages=False):
+		data = self.read_many([(self, start_ts, end_ts)], limit=limit)[0]
 		if len(data) and as_percentages:
 			total = sum(data.values())
 			return {k: round((100.0 * v / total), 2) for k, v in data}
 		else:
 			return data
 
+	@staticmethod
+	def read_many(queries, limit=None):
+		"""
+		Return the distributions for a list of (distribution, start_ts, end_ts)
+		queries, reading all of those that share a Redis client in one round trip.
+
+		Summaries are kept up to date by increments, so once one exists it can be
+		read directly; missing ones are built on the way. Single buckets need no
+		summary at all.
+		"""
+		num_items = -1 if not limit else limit
+		windows = [
+			distribution._window_tokens(start_ts, end_ts)
+			for distribution, start_ts, end_ts in queries
+		]
+
+		groups = {}
+		for i, (distribution, _, _) in enumerate(queries):
+			groups.setdefault((id(distribution.redis), distribution.use_lua), []).append(i)
+
+		results = [None] * len(queries)
+		for indices in groups.values():
+			first = queries[indices[0]][0]
+			if first.use_lua:
+				args = []
+				for i in indices:
+					args.extend(queries[i][0]._read_args(*windows[i], num_items))
+				raw_results = [
+					zip(raw[::2], raw[1::2]) for raw in first.lua_read_many(args=args)
+				]
+			else:
+				pipe = first.redis.pipeline(transaction=False)
+				for i in indices:
+					bucket_key = queries[i][0]._bucket_key(*windows[i])
+					pipe.zrevrange(bucket_key, 0, num_items, withscores=True)
+				raw_results = pipe.execute()
+
+				for j, i in enumerate(indices):
+					distribution = queries[i][0]
+					start_token, end_token = windows[i]
+					if not raw_results[j] and distribution._next_token(start_token) <= end_token:
+						raw_results[j] = distribution._build_summary(
+							start_token, end_token, num_items
+						)
+
+			for i, raw_data in zip(indices, raw_results):
+				results[i] = {k.decode("utf8"): int(float(v)) for k, v in raw_data}
+
+		return results
+
 	def size(self, start_ts=None, end_ts=None):
 		return len(self.distribution(start_ts, end_ts))
 
@@ -142,31 +298,60 @@ class RedisPopularityDistribution:
 		popularity = 100.0 * (numerator / denominator)
 		return round(popularity, precision)
 
-	def _ensure_exists(self, start_ts, end_ts):
-		start_token = self._to_start_token(start_ts)
-		end_token = self._to_end_token(end_ts)
-		summary_key = self._bucket_key(start_token, end_token)
-		summary_exists = self.redis.exists(summary_key)
+	def _window_tokens(self, start_ts=None, end_ts=None):
+		start_ts = start_ts if start_ts else self.earliest_available_datetime
+		end_ts = end_ts if end_ts else datetime.utcnow()
 
+		if start_ts > end_ts:
+			raise ValueError("start_ts cannot be greater than end_ts")
+
+		return self._to_start_token(start_ts), self._to_end_token(end_ts)
+
+	def _summary_buckets(self, start_token, end_token):
 		if self._next_token(start_token) > end_token:
-			# We are dealing with the a single time bucket
-			return summary_exists
-
-		includes_current_bucket = end_token > self._current_start_token
-		if not summary_exists or includes_current_bucket:
-			tokens_between = self._generate_bucket_tokens_between(start_token, end_token)
-			buckets = [self._bucket_key(s, e) for s, e in tokens_between]
-
-			if buckets:
-				self.redis.zunionstore(summary_key, buckets)
-				self.redis.expire(summary_key, self.ttl)
-				return True
-			else:
-				# This is an error state
-				return False
-		else:
-			# The summary already exists and does not include the current bucket
-			return True
+			# A single bucket is its own summary
+			return []
+		tokens_between = self._generate_bucket_tokens_between(start_token, end_token)
+		return [self._bucket_key(s, e) for s, e in tokens_between]
+
+	def _summary_expire_at(self, start_token):
+		# The summary is only valid for as long as its oldest bucket exists
+		return self._convert_to_end_token(start_token) + self.ttl
+
+	def _read_args(self, start_token, end_token, num_items):
+		buckets = self._summary_buckets(start_token, end_token)
+		return [
+			self._bucket_key(start_token, end_token),
+			num_items,
+			self._summaries_key,
+			self._summary_expire_at(start_token),
+			end_token,
+			self._current_start_token - self.ttl,
+			self.ttl,
+			len(buckets),
+		] + buckets
+
+	def _build_summary(self, start_token, end_token, num_items):
+		buckets = self._summary_buckets(start_token, end_token)
+		if not buckets:
+			# This is an error state
+			return []
+
+		summary_key = self._bucket_key(start_token, end_token)
+
+		# Building, reading and registering the summary in one transaction means no
+		# increment is missed or counted twice. It is read before setting its expiry,
+		# which removes it right away if its oldest bucket is already gone.
+		pipe = self.redis.pipeline(transaction=True)
+		pipe.zunionstore(summary_key, buckets)
+		pipe.zrevrange(summary_key, 0, num_items, withscores=True)
+		pipe.expireat(summary_key, self._summary_expire_at(start_token))
+		pipe.zadd(self._summaries_key, end_token, summary_key)
+		pipe.zremrangebyscore(self._summaries_key, "-inf", self._current_start_token - self.ttl)
+		pipe.expire(self._summaries_key, self.ttl)
+
+		with redis_lock.Lock(self.redis, self._lock_name, expire=300):
+			return pipe.execute()[1]
 
 	def _generate_bucket_tokens_between(self, start_token, end_token):
 		result = []
@@ -214,26 +399,129 @@ class RedisPopularityDistribution:
 
 
 class CappedDataFeed(RedisNamespace):
-	def __init__(self, redis, name, max_items, period, comparator, fast_backfill=False):
+	PUSH_SCRIPT = """
+		local list_key = KEYS[1]
+		local last_added_key = KEYS[2]
+		local data_key = KEYS[3]
+		local max_items = tonumber(ARGV[1])
+		local period = tonumber(ARGV[2])
+		local fast_backfill = ARGV[3] == '1'
+		local now = ARGV[4]
+		local ttl = tonumber(ARGV[5])
+		local num_fields = tonumber(ARGV[6])
+		local fields_start = 7
+		local dedupe_start = fields_start + 2 * num_fields
+
+		local cancel = false
+
+		if period > 0 then
+			local last_added = redis.call('GET', last_added_key)
+			if last_added and tonumber(last_added) + period >= tonumber(now) then
+				cancel = true
+			end
+		end
+
+		if not cancel and dedupe_start <= #ARGV then
+			local last_key = redis.call('LINDEX', list_key, 0)
+			if last_key then
+				local values = {}
+				for i = fields_start, dedupe_start - 1, 2 do
+					values[ARGV[i]] = ARGV[i + 1]
+				end
+
+				cancel = true
+				for i = dedupe_start, #ARGV do
+					local last_value = redis.call('HGET', last_key, ARGV[i])
+					if not last_value or last_value ~= values[ARGV[i]] then
+						cancel = false
+						break
+					end
+				end
+			end
+		end
+
+		if cancel and (not fast_backfill or redis.call('LLEN', list_key) >= max_items) then
+			return 0
+		end
+
+		for i = fields_start, dedupe_start - 1, 2 do
+			redis.call('HSET', data_key, ARGV[i], ARGV[i + 1])
+		end
+		redis.call('EXPIRE', data_key, ttl)
+		redis.call('LPUSH', list_key, data_key)
+
+		local to_delete = redis.call('LRANGE', list_key, max_items, -1)
+		redis.call('LTRIM', list_key, 0, max_items - 1)
+		for i = 1, #to_delete do
+			redis.call('DEL', to_delete[i])
+		end
+
+		redis.call('SET', last_added_key, now)
+		return 1
+	"""
+
+	GET_SCRIPT = """
+		local keys = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]))
+		local result = {}
+		for i = #keys, 1, -1 do
+			result[#result + 1] = redis.call('HGETALL', keys[i])
+		end
+		return result
+	"""
+
+	def __init__(
+		self, redis, name, max_items, period, dedupe_fields=None, fast_backfill=False,
+		use_lua=None
+	):
+		"""
+		A feed of the latest `max_items` items pushed at most once every `period`
+		seconds. If `dedupe_fields` is given, an item is not pushed when all of those
+		fields are equal to the ones of the last item that was pushed, unless
+		`fast_backfill` is set and the feed isn't full yet.
+		"""
 		super().__init__(redis, name, "CAPPED_DATA_FEED")
 		self.max_items = max_items
 		self.period = period
 		self.last_added_key = "%s:LAST_ADDED" % self.key
-		self.comparator = comparator
+		self.dedupe_fields = list(dedupe_fields or [])
 		self.fast_backfill = fast_backfill
 
+		# See RedisPopularityDistribution
+		self.use_lua = isinstance(redis, StrictRedis) if use_lua is None else use_lua
+
+		if self.use_lua:
+			self.lua_push = self.redis.register_script(self.PUSH_SCRIPT)
+			self.lua_get = self.redis.register_script(self.GET_SCRIPT)
+
 	def push(self, data):
 		if "id" not in data:
 			raise RuntimeError("Data must contain 'id' key")
 
+		data_key = "%s:OBJ:%s" % (self.key, data["id"])
+
+		if self.use_lua:
+			args = [
+				self.max_items,
+				self.period or 0,
+				1 if self.fast_backfill else 0,
+				datetime.utcnow().timestamp(),
+				self.ttl,
+				len(data),
+			]
+			for field, value in data.items():
+				args.extend((field, value))
+			args.extend(self.dedupe_fields)
+
+			keys = [self.key, self.last_added_key, data_key]
+			return bool(self.lua_push(keys=keys, args=args))
+
 		def internal_push(pipe):
 			last_id = pipe.lrange(self.key, 0, 0)
 			last_data = pipe.hgetall(last_id[0]) if last_id else None
 
 			cancel = (
 				last_data and
-				self.comparator and
-				self.comparator(data, self._decode_item(last_data)) or
+				self._is_duplicate(data, self._decode_item(last_data)) or
 				not self._period_elapsed(pipe)
 			)
 
@@ -245,7 +533,6 @@ class CappedDataFeed(RedisNamespace):
 				return False
 
 			# add new item
-			data_key = "%s:OBJ:%s" % (self.key, data["id"])
 			pipe.hmset(data_key, data)
 			pipe.expire(data_key, self.ttl)
 			pipe.lpush(self.key, data_key)
@@ -268,7 +555,13 @@ class CappedDataFeed(RedisNamespace):
 		)
 
 	def get(self, count=100):
-		keys = self.redis.lrange(self.key, 0, min(count, self.max_items))
+		end = min(count, self.max_items)
+
+		if self.use_lua:
+			items = self.lua_get(keys=[self.key], args=[end])
+			return [self._decode_item(dict(zip(item[::2], item[1::2]))) for item in items]
+
+		keys = self.redis.lrange(self.key, 0, end)
 		keys.reverse()
 		pipeline = self.redis.pipeline(transaction=True)
 		for key in keys:
@@ -279,6 +572,14 @@ class CappedDataFeed(RedisNamespace):
 	def _decode_item(self, data):
 		return {k.decode("utf8"): v.decode("utf8") for k, v in data.items()}
 
+	def _is_duplicate(self, data, last_data):
+		if not self.dedupe_fields:
+			return False
+		return all(
+			field in data and field in last_data and str(data[field]) == last_data[field]
+			for field in self.dedupe_fields
+		)
+
 	def _period_elapsed(self, pipe):
 		if not self.period:
 			return True
@@ -331,20 +632,27 @@ class RedisBucket(RedisNamespace):
 		end_token = start_token + self.bucket_size * count
 		return "%s:%s:%s" % (self.key, start_token, end_token)
 
+	def _increment(self, amount=1):
+		"""
+		Atomically add `amount` to the current bucket and refresh its TTL in a single
+		round trip.
+
+		The increment happens server-side, so concurrent writers never need to
+		watch the key and retry.
+		"""
+		key = self._bucket_key(0)
+		pipe = self.redis.pipeline(transaction=True)
+		pipe.incrby(key, amount)
+		pipe.expire(key, self.ttl)
+		return pipe.execute()[0]
+
 
 class RedisCounter(RedisBucket):
 	def __init__(self, redis, name, bucket_size, ttl):
 		super().__init__(redis, name, "COUNTER", bucket_size, ttl)
 
-	def increment(self):
-		key = self._bucket_key(0)
-
-		def internal_increment(pipe):
-			value = pipe.get(key) or 0
-			pipe.multi()
-			pipe.set(key, int(value) + 1)
-			pipe.expire(key, self.ttl)
-		self.redis.transaction(internal_increment, key)
+	def increment(self, amount=1):
+		return self._increment(amount)
 
 	def get_count(self, start_bucket, end_bucket):
 		pipe = self.redis.pipeline()
@@ -392,6 +700,41 @@ class RedisSet(RedisBucket):
 			return pipe.execute()[0]
 
 
+class RedisExpiringSet(RedisNamespace):
+	"""
+	A set whose members drop out `ttl` seconds after they were last added.
+
+	Members are kept in a single sorted set scored by their expiry time, so listing
+	the current members never needs to scan the keyspace.
+	"""
+
+	def __init__(self, redis, name, ttl):
+		super().__init__(redis, name, "EXPIRING_SET", ttl)
+
+	def add(self, *members):
+		now = datetime.utcnow().timestamp()
+		pipe = self.redis.pipeline()
+		pipe.multi()
+		pipe.zadd(self.key, **{str(member): now + self.ttl for member in members})
+		pipe.zremrangebyscore(self.key, "-inf", now)
+		pipe.expire(self.key, self.ttl)
+		pipe.execute()
+
+	def discard(self, *members):
+		if members:
+			self.redis.zrem(self.key, *members)
+
+	def members(self, min_age=0):
+		"""Return the current members last added at least `min_age` seconds ago."""
+		now = datetime.utcnow().timestamp()
+		return [
+			member.decode("utf8")
+			for member in self.redis.zrangebyscore(
+				self.key, "(%f" % now, "%f" % (now + self.ttl - min_age)
+			)
+		]
+
+
 class RedisProxy(RedisNamespace):
 	def __init__(self, redis, name, ttl, fetch):
 		super().__init__(redis, name, "PROXY", ttl)
@@ -1,4 +1,7 @@
 import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from contextlib import contextmanager
 
 
@@ -19,6 +22,81 @@ class CountDownLatch:
 				self.lock.wait()
 
 
+DispatchReport = namedtuple("DispatchReport", ["succeeded", "failed", "timed_out"])
+
+
+def dispatch_bounded(items, invoke, max_workers, timeout=None, deadline=None):
+	"""
+	Call invoke(payload) for every (key, payload) pair in `items`, on at most
+	`max_workers` threads at once, and wait for the calls to finish.
+
+	Every call may run for `timeout` seconds from when it starts. Calls still running
+	after that, and calls not finished by `deadline` (a time.monotonic() value), are
+	reported as timed out and no longer waited for; their threads are left to finish
+	in the background.
+
+	Returns a DispatchReport of the keys that succeeded, a dict of the keys that
+	failed to the exception they raised, and the keys that timed out.
+	"""
+	items = list(items)
+	if not items:
+		return DispatchReport([], {}, [])
+
+	started = {}
+
+	def run(key, payload):
+		started[key] = time.monotonic()
+		return invoke(payload)
+
+	executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+	futures = {executor.submit(run, key, payload): key for key, payload in items}
+	pending = set(futures)
+	succeeded, failed, timed_out = [], {}, []
+
+	try:
+		while pending:
+			now = time.monotonic()
+			wake_at = deadline
+
+			for future in list(pending):
+				key = futures[future]
+				if future.done():
+					continue
+				expires_at = started[key] + timeout if (
+					key in started and timeout is not None
+				) else None
+				if (
+					(expires_at is not None and now >= expires_at) or
+					(deadline is not None and now >= deadline)
+				):
+					# Does nothing for calls that are already running
+					future.cancel()
+					pending.discard(future)
+					timed_out.append(key)
+				elif timeout is not None:
+					# Calls that haven't started yet expire no earlier than a full timeout
+					expires_at = expires_at or now + timeout
+					wake_at = expires_at if wake_at is None else min(wake_at, expires_at)
+
+			if not pending:
+				break
+
+			wait_for = max(0, wake_at - now) if wake_at is not None else None
+			done, _ = wait(pending, timeout=wait_for, return_when=FIRST_COMPLETED)
+			for future in done:
+				pending.discard(future)
+				key = futures[future]
+				exception = future.exception()
+				if exception is not None:
+					failed[key] = exception
+				else:
+					succeeded.append(key)
+	finally:
+		executor.shutdown(wait=False)
+
+	return DispatchReport(succeeded, failed, timed_out)
+
+
 def acquire_redshift_lock(lock_ids, wait=False):
 	"""
 	Make a non-blocking (by default) attempt to claim an exclusive session level advisory lock
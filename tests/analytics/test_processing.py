@@ -0,0 +1,353 @@
+import json
+from datetime import date, datetime, timedelta
+from unittest.mock import patch
+
+import fakeredis
+from django.core.cache.backends.locmem import LocMemCache
+from hearthstone.enums import FormatType
+
+from hsredshift.analytics.scheduling import QueryRefreshPriority
+from hsreplaynet.analytics import utils
+from hsreplaynet.analytics.processing import (
+	META_PREVIEW_REBUILT_KEY, META_PREVIEW_STALE_KEY, RANK_MAP, CacheWarmingScheduler,
+	PendingQuery, complete_pending_query, get_cluster_set_data_async,
+	get_meta_preview, mark_meta_preview_stale, update_meta_preview
+)
+from hsreplaynet.analytics.utils import record_query_runtime
+from hsreplaynet.utils.aws import sqs
+
+
+class FakeParameterizedQuery:
+	def __init__(self, query_name, supplied_parameters, as_of=None, stale=True):
+		self.query_name = query_name
+		self.supplied_parameters = supplied_parameters
+		self.cache_key = "%s:%s" % (query_name, json.dumps(supplied_parameters, sort_keys=True))
+		self.result_available = as_of is not None
+		self.result_as_of = as_of
+		self.result_is_stale = stale
+		self.final_bind_params = {}
+		self.scheduled_refreshes = []
+
+	def schedule_refresh(self, priority=None):
+		self.scheduled_refreshes.append((priority, dict(self.final_bind_params)))
+
+
+class FakeQuery:
+	def __init__(self, name, results):
+		self.name = name
+		self.results = results
+
+	def build_full_params(self, supplied_parameters):
+		as_of, stale = self.results.get(supplied_parameters["GameType"], (None, True))
+		return FakeParameterizedQuery(self.name, supplied_parameters, as_of, stale)
+
+
+class FakeCatalogue:
+	"""A synthetic catalogue mapping query names to FakeQuery instances."""
+
+	def __init__(self, *queries):
+		self.queries = {query.name: query for query in queries}
+
+	def get_query(self, name):
+		return self.queries[name]
+
+
+class FakeSQS:
+	def __init__(self):
+		self.messages = []
+
+	def create_queue(self, QueueName):
+		return {"QueueUrl": "https://queue.local/%s" % (QueueName)}
+
+	def send_message_batch(self, QueueUrl, Entries):
+		self.messages.extend(json.loads(entry["MessageBody"]) for entry in Entries)
+		return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+
+
+def _message(query_name, game_type):
+	return {"query_name": query_name, "supplied_parameters": {"GameType": game_type}}
+
+
+@patch("redis_lock.Lock")
+def test_cache_warming_scheduler(_mock_lock, settings):
+	settings.CACHE_WARMING_DEFAULT_RUNTIME_SECONDS = 10
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+
+	now = datetime.utcnow()
+	catalogue = FakeCatalogue(
+		FakeQuery("popular", {
+			"RANKED_STANDARD": (now - timedelta(hours=2), True),
+			"RANKED_WILD": (now - timedelta(hours=2), True),
+			"ARENA": (now - timedelta(minutes=5), False),
+		}),
+		FakeQuery("slow", {"RANKED_STANDARD": (now - timedelta(hours=2), True)}),
+		FakeQuery("missing", {}),
+	)
+	messages = [
+		_message("missing", "RANKED_STANDARD"),
+		_message("slow", "RANKED_STANDARD"),
+		_message("popular", "RANKED_WILD"),
+		_message("popular", "ARENA"),
+		_message("popular", "RANKED_STANDARD"),
+		_message("popular", "RANKED_STANDARD"),
+	]
+
+	scheduler = CacheWarmingScheduler(redis=redis, catalogue=catalogue)
+	for msg in messages[1:]:
+		parameterized_query = catalogue.get_query(msg["query_name"]).build_full_params(
+			msg["supplied_parameters"]
+		)
+		scheduler.reads.increment(parameterized_query.cache_key)
+	scheduler.reads.increment_many([FakeParameterizedQuery(
+		"popular", {"GameType": "RANKED_STANDARD"}
+	).cache_key] * 100)
+	record_query_runtime(
+		catalogue.get_query("slow").build_full_params({"GameType": "RANKED_STANDARD"}),
+		600, redis=redis
+	)
+
+	fake_sqs = FakeSQS()
+	with patch.object(sqs, "SQS", fake_sqs), patch.object(sqs, "_queue_urls", {}):
+		scheduled = scheduler.schedule("QUEUE", messages)
+
+		# Fresh and duplicate permutations are skipped, the rest is in priority order
+		assert scheduled == [
+			_message("popular", "RANKED_STANDARD"),
+			_message("missing", "RANKED_STANDARD"),
+			_message("popular", "RANKED_WILD"),
+			_message("slow", "RANKED_STANDARD"),
+		]
+		assert sorted(fake_sqs.messages, key=json.dumps) == sorted(scheduled, key=json.dumps)
+
+		# Until they ran, queued permutations aren't queued again
+		assert scheduler.schedule("QUEUE", messages) == []
+		scheduler.queued.discard(FakeParameterizedQuery(
+			"slow", {"GameType": "RANKED_STANDARD"}
+		).cache_key)
+		assert scheduler.schedule("QUEUE", messages) == [_message("slow", "RANKED_STANDARD")]
+
+
+@patch("redis_lock.Lock")
+def test_count_query_read(_mock_lock):
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+	parameterized_query = FakeParameterizedQuery("popular", {"GameType": "RANKED_STANDARD"})
+
+	with patch.object(utils, "_query_reads", None), \
+		patch.object(utils, "get_redshift_cache_redis_client", return_value=redis):
+		utils.count_query_read(parameterized_query)
+		utils.count_query_read(parameterized_query)
+		assert utils._query_reads.distribution() == {parameterized_query.cache_key: 2}
+
+	# Counting reads never fails the request
+	with patch.object(utils, "_query_reads", None), \
+		patch.object(utils, "get_query_reads", side_effect=ConnectionError):
+		utils.count_query_read(parameterized_query)
+
+
+class FakeMetaPreviewQuery:
+	"""Popularity results with a single, rank specific, archetype."""
+
+	def __init__(self):
+		self.build_count = 0
+
+	def build_full_params(self, supplied_parameters):
+		self.build_count += 1
+		parameterized_query = FakeParameterizedQuery(
+			"archetype_popularity_distribution_stats", supplied_parameters,
+			as_of=datetime.utcnow(), stale=False
+		)
+		parameterized_query.response_payload = {
+			"series": {"data": {"DRUID": [{
+				"archetype_id": RANK_MAP.index(supplied_parameters["RankRange"]) + 1,
+				"pct_of_total": 5,
+				"total_games": 1000,
+				"win_rate": 55,
+			}]}},
+			"as_of": "2018-01-01T00:00:00",
+		}
+		return parameterized_query
+
+
+def test_meta_preview_is_built_once_and_read(mocker, settings):
+	settings.META_PREVIEW_REFRESH_INTERVAL = 300
+	settings.META_PREVIEW_REBUILD_INTERVAL = 60
+	cache = LocMemCache("meta", {})
+	mocker.patch("hsreplaynet.analytics.processing.caches", {"redshift": cache})
+	lambda_client = mocker.patch("hsreplaynet.utils.aws.clients.LAMBDA")
+	query = FakeMetaPreviewQuery()
+	mocker.patch("hsreplaynet.utils.aws.redshift.get_redshift_query", return_value=query)
+
+	# Without a stored preview, the first reader builds one
+	preview = get_meta_preview()
+	assert len(preview) == 10
+	assert len({datum["data"]["archetype_id"] for datum in preview}) == 10
+	build_count = query.build_count
+
+	# Readers only fetch the stored preview, and ask for a refresh once per interval
+	for _ in range(5):
+		assert get_meta_preview() == preview
+	assert query.build_count == build_count
+	assert lambda_client.invoke.call_count == 1
+
+	# It's only rebuilt once one of its queries finished
+	assert update_meta_preview() is None
+	assert query.build_count == build_count
+	for _ in range(84):
+		mark_meta_preview_stale()
+		update_meta_preview()
+	assert query.build_count == 2 * build_count
+
+	# Queries finishing right after a rebuild are left for the next one
+	assert cache.get(META_PREVIEW_STALE_KEY)
+	cache.delete(META_PREVIEW_REBUILT_KEY)
+	assert update_meta_preview() == preview
+	assert query.build_count == 3 * build_count
+	assert update_meta_preview() is None
+
+
+completed_callbacks = []
+
+
+def record_pending_query_result(response_payload, **kwargs):
+	completed_callbacks.append((response_payload, kwargs))
+
+
+class RecordingQueryExecutor:
+	"""Records the queries executed, which the test then finishes itself."""
+
+	def __init__(self):
+		self.executed = []
+
+	def __call__(self, parameterized_query):
+		self.executed.append(parameterized_query.cache_key)
+
+
+def _finish_query(parameterized_query, redis):
+	# Like finish_async_redshift_query would
+	parameterized_query.result_available = True
+	parameterized_query.result_is_stale = False
+	parameterized_query.response_payload = {"series": {"data": {"DRUID": []}}}
+	complete_pending_query(parameterized_query, redis=redis)
+
+
+def test_pending_query(settings):
+	settings.ENV_AWS = False
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+	del completed_callbacks[:]
+	callback = "tests.analytics.test_processing.record_pending_query_result"
+
+	parameterized_query = FakeParameterizedQuery(
+		"list_cluster_set_data", {"GameType": "RANKED_STANDARD"}
+	)
+	executor = RecordingQueryExecutor()
+	pending_query = PendingQuery(parameterized_query, executor=executor, redis=redis)
+
+	# Handing over the callback doesn't wait for the query
+	pending_query.then(callback, game_format=2)
+	assert not pending_query.ready
+	assert completed_callbacks == []
+	assert executor.executed == [parameterized_query.cache_key]
+
+	_finish_query(parameterized_query, redis)
+	payload = {"series": {"data": {"DRUID": []}}}
+	assert completed_callbacks == [(payload, {"game_format": 2})]
+
+	# Callbacks run only once, and right away when the results are available
+	complete_pending_query(parameterized_query, redis=redis)
+	pending_query.then(callback, game_format=1)
+	assert completed_callbacks[1:] == [(payload, {"game_format": 1})]
+	assert len(executor.executed) == 1
+
+
+def test_pending_query_failed_callback_is_queued_again(mocker, settings):
+	settings.ENV_AWS = False
+	error_handler = mocker.patch("hsreplaynet.analytics.processing.error_handler")
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+	del completed_callbacks[:]
+	callback = "tests.analytics.test_processing.record_pending_query_result"
+
+	parameterized_query = FakeParameterizedQuery(
+		"list_cluster_set_data", {"GameType": "RANKED_STANDARD"}
+	)
+	pending_query = PendingQuery(
+		parameterized_query, executor=RecordingQueryExecutor(), redis=redis
+	)
+	pending_query.then(callback, game_format=2)
+
+	with patch(
+		"tests.analytics.test_processing.record_pending_query_result",
+		side_effect=RuntimeError("Boom")
+	):
+		_finish_query(parameterized_query, redis)
+	assert error_handler.call_count == 1
+	assert completed_callbacks == []
+
+	_finish_query(parameterized_query, redis)
+	payload = {"series": {"data": {"DRUID": []}}}
+	assert completed_callbacks == [(payload, {"game_format": 2})]
+
+
+def test_pending_query_callbacks_run_in_lambda(mocker, settings):
+	settings.ENV_AWS = True
+	settings.PROCESS_REDSHIFT_QUERIES_VIA_LAMBDA = True
+	lambda_client = mocker.patch("hsreplaynet.utils.aws.clients.LAMBDA")
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+	del completed_callbacks[:]
+	callback = "tests.analytics.test_processing.record_pending_query_result"
+
+	parameterized_query = FakeParameterizedQuery(
+		"list_cluster_set_data", {"GameType": "RANKED_STANDARD"}
+	)
+	pending_query = PendingQuery(
+		parameterized_query, executor=RecordingQueryExecutor(), redis=redis
+	)
+	pending_query.then(callback, game_format=2)
+	_finish_query(parameterized_query, redis)
+
+	# The callback runs in its own Lambda instead of finish_async_redshift_query
+	assert completed_callbacks == []
+	assert lambda_client.invoke.call_count == 1
+	kwargs = lambda_client.invoke.call_args[1]
+	assert kwargs["FunctionName"] == "do_run_pending_query_callback"
+	assert kwargs["InvocationType"] == "Event"
+	assert json.loads(kwargs["Payload"]) == {
+		"query_name": "list_cluster_set_data",
+		"supplied_parameters": {"GameType": "RANKED_STANDARD"},
+		"callback": callback,
+		"kwargs": {"game_format": 2},
+	}
+
+	# Also when the results are already available
+	pending_query.then(callback, game_format=1)
+	assert completed_callbacks == []
+	assert lambda_client.invoke.call_count == 2
+
+
+def test_cluster_set_data_query_is_executed_with_its_lookback(mocker, settings):
+	settings.ENV_AWS = False
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+	mocker.patch(
+		"hsreplaynet.analytics.processing.redshift.get_redshift_cache_redis_client",
+		return_value=redis
+	)
+	mocker.patch(
+		"hsreplaynet.utils.aws.redshift.get_redshift_query",
+		return_value=FakeQuery("list_cluster_set_data", {})
+	)
+	callback = "tests.analytics.test_processing.record_pending_query_result"
+
+	pending_query = get_cluster_set_data_async(FormatType.FT_STANDARD, lookback=14)
+	pending_query.then(callback, game_format=2)
+
+	# Queued refreshes rebuild the query without the lookback, so it runs right away
+	today = date.today()
+	assert pending_query.parameterized_query.scheduled_refreshes == [(
+		QueryRefreshPriority.IMMEDIATE,
+		{"min_date": today - timedelta(days=14), "max_date": today},
+	)]
@@ -1,11 +1,16 @@
+import gzip
 import json
+from datetime import datetime, timedelta
 
 import pytest
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache.backends.locmem import LocMemCache
 from django_hearthstone.cards.models import Card
 from hearthstone.deckstrings import parse_deckstring
 from hearthstone.enums import CardClass
 
-from hsreplaynet.analytics.views import SingleClusterUpdateView
+from hsreplaynet.analytics.processing import COMPRESSED_QUERY_RESULT_VALIDATORS_KEY
+from hsreplaynet.analytics.views import SingleClusterUpdateView, fetch_query_results
 from hsreplaynet.decks.models import (
 	Archetype, ClassClusterSnapshot, ClusterSetSnapshot, ClusterSnapshot
 )
@@ -97,3 +102,94 @@ class TestSingleClusterUpdateView:
 		assert self.cluster.external_id == archetype.id
 		assert self.cluster.name == "Mecha'thun Druid"
 		assert self.cluster.required_cards == [48625]
+
+
+class FakeResultQuery:
+	"""A parameterized query with available results, counting how often they're read."""
+
+	def __init__(self, data):
+		self.data = data
+		self.reads = 0
+		self.query_name = "list_decks_by_win_rate"
+		self.cache_key = "list_decks_by_win_rate:RANKED_STANDARD"
+		self.supplied_filters_dict = {"GameType": "RANKED_STANDARD"}
+		self.supplied_non_filters_dict = {}
+		self.result_available = True
+		self.result_as_of = datetime(2018, 1, 1)
+		self.response_payload_type = "application/json"
+		self.is_personalized = False
+		self.has_premium_values = False
+
+	@property
+	def response_payload_data(self):
+		self.reads += 1
+		return self.data
+
+
+def test_fetch_query_results_serves_compressed_results(mocker, rf):
+	cache = LocMemCache("results", {})
+	mocker.patch("hsreplaynet.analytics.processing.caches", {"redshift": cache})
+	mocker.patch("hsreplaynet.analytics.views.trigger_if_stale", return_value=False)
+	mocker.patch("hsreplaynet.analytics.views.count_query_read")
+	mocker.patch("hsreplaynet.analytics.views.influx")
+	query = FakeResultQuery(json.dumps({"series": {"data": {"ALL": list(range(1000))}}}))
+	mocker.patch("hsreplaynet.analytics.views._get_query_and_params", return_value=query)
+
+	def fetch(**headers):
+		request = rf.get("/analytics/query/list_decks_by_win_rate/", **headers)
+		request.user = AnonymousUser()
+		return fetch_query_results(request, "list_decks_by_win_rate")
+
+	response = fetch(HTTP_ACCEPT_ENCODING="gzip, deflate")
+	assert response.status_code == 200
+	assert response["Content-Encoding"] == "gzip"
+	assert gzip.decompress(response.content).decode("utf-8") == query.data
+	etag = response["ETag"]
+	assert etag.endswith('-gzip"')
+
+	# Repeated requests are served from the stored body, or not at all
+	assert fetch(HTTP_ACCEPT_ENCODING="gzip").content == response.content
+	cache_get = mocker.spy(cache, "get")
+	not_modified = fetch(HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag)
+	assert not_modified.status_code == 304
+	assert not_modified["ETag"] == etag
+	assert query.reads == 1
+
+	# Not modified responses don't load the compressed body
+	assert [call[0][0] for call in cache_get.call_args_list] == [
+		COMPRESSED_QUERY_RESULT_VALIDATORS_KEY % (query.cache_key)
+	]
+
+	plain = fetch()
+	assert plain.content.decode("utf-8") == query.data
+	assert not plain.has_header("Content-Encoding")
+	assert plain["ETag"] == etag.replace("-gzip", "")
+
+	# New results are compressed again, under a new ETag
+	query.result_as_of += timedelta(hours=1)
+	query.data = json.dumps({"series": {"data": {"ALL": []}}})
+	response = fetch(HTTP_ACCEPT_ENCODING="gzip", HTTP_IF_NONE_MATCH=etag)
+	assert response.status_code == 200
+	assert gzip.decompress(response.content).decode("utf-8") == query.data
+	assert response["ETag"] != etag
+	assert query.reads == 2
+
+
+def test_fetch_query_results_does_not_compress_personalized_results(mocker, rf):
+	cache = LocMemCache("personalized_results", {})
+	mocker.patch("hsreplaynet.analytics.processing.caches", {"redshift": cache})
+	mocker.patch("hsreplaynet.analytics.views.trigger_if_stale", return_value=False)
+	mocker.patch("hsreplaynet.analytics.views.count_query_read")
+	mocker.patch("hsreplaynet.analytics.views.influx")
+	query = FakeResultQuery(json.dumps({"series": {"data": {"ALL": []}}}))
+	query.is_personalized = True
+	mocker.patch("hsreplaynet.analytics.views._get_query_and_params", return_value=query)
+
+	request = rf.get("/analytics/query/list_decks_by_win_rate/", HTTP_ACCEPT_ENCODING="gzip")
+	request.user = AnonymousUser()
+	response = fetch_query_results(request, "list_decks_by_win_rate")
+
+	assert response.status_code == 200
+	assert response.content.decode("utf-8") == query.data
+	assert not response.has_header("ETag")
+	assert not cache.get(COMPRESSED_QUERY_RESULT_VALIDATORS_KEY % (query.cache_key))
@@ -0,0 +1,61 @@
+from datetime import datetime
+from unittest.mock import patch
+
+import fakeredis
+import pytest
+from allauth.socialaccount.models import SocialAccount
+from django.core.cache.backends.locmem import LocMemCache
+
+from hsreplaynet.api.live.distributions import set_twitch_stream_details
+from hsreplaynet.api.live.views import StreamingNowView
+from hsreplaynet.utils.redis import RedisExpiringSet
+
+
+def _stream_details(twitch_user_id):
+	return {"twitch_user_id": twitch_user_id, "deck": [1, 2, 3], "hero": 7}
+
+
+@pytest.mark.django_db
+def test_streaming_now_view(user, django_assert_num_queries):
+	SocialAccount.objects.create(
+		user=user, provider="twitch", uid="1001", extra_data={"display_name": "Streamer"}
+	)
+
+	cache = LocMemCache("live_stats", {})
+	cache.set("twitch_1001", _stream_details(1001))
+	cache.set("twitch_1002", _stream_details(1002))
+	registry = RedisExpiringSet(fakeredis.FakeStrictRedis(), "LIVE_TWITCH_STREAMERS", 7200)
+	registry.redis.flushall()
+	registry.add("1001", "1002", "1003", "1004")
+	# 1003 was last registered longer than the details TTL ago
+	registry.redis.zadd(registry.key, **{"1003": datetime.utcnow().timestamp() + 3600})
+
+	with patch("hsreplaynet.api.live.views.caches", {"live_stats": cache}), patch(
+		"hsreplaynet.api.live.views.get_live_streamer_registry", return_value=registry
+	):
+		# The accounts and their users are fetched in a single query
+		with django_assert_num_queries(1):
+			data = StreamingNowView()._get_data()
+
+	assert len(data) == 1
+	assert data[0]["twitch"]["display_name"] == "Streamer"
+	assert "twitch_user_id" not in data[0]
+
+	# 1002 has no account and is skipped; 1003's stream details have expired while
+	# 1004 was registered too recently for its stream details to be cached yet
+	assert sorted(registry.members()) == ["1001", "1002", "1004"]
+
+
+def test_set_twitch_stream_details():
+	cache = LocMemCache("live_stats", {})
+	registry = RedisExpiringSet(fakeredis.FakeStrictRedis(), "LIVE_TWITCH_STREAMERS", 60)
+	registry.redis.flushall()
+
+	with patch("hsreplaynet.api.live.distributions.caches", {"live_stats": cache}), patch(
+		"hsreplaynet.api.live.distributions.get_live_streamer_registry",
+		return_value=registry
+	):
+		set_twitch_stream_details(1001, {"deck": [1, 2, 3], "hero": 7})
+
+	assert cache.get("twitch_1001") == _stream_details(1001)
+	assert registry.members() == ["1001"]
@@ -2,6 +2,7 @@ import os
 import subprocess
 
 import pytest
+from redis import ConnectionError, StrictRedis
 
 from hearthsim.identity.accounts.models import AuthToken
 from hearthsim.identity.api.models import APIKey
@@ -12,6 +13,8 @@ LOG_DATA_DIR = os.path.join(BASE_DIR, "logdata")
 LOG_DATA_GIT = "https://github.com/HearthSim/hsreplay-test-data"
 UPLOAD_SUITE = os.path.join(LOG_DATA_DIR, "hsreplaynet-tests", "uploads")
 
+REDIS_TEST_URL = os.environ.get("REDIS_TEST_URL", "redis://localhost:6379/15")
+
 pytest_plugins = ["tests.api.partner.fixtures"]
 
 
@@ -50,3 +53,19 @@ def multi_db():
 	TestCase.multi_db = True
 	yield
 	TestCase.multi_db = False
+
+
+@pytest.fixture(scope="function")
+def redis_server():
+	"""
+	A client for a real Redis server, for code paths fakeredis can't run such as Lua
+	scripts. The test is skipped if no server is reachable at REDIS_TEST_URL.
+	"""
+	redis = StrictRedis.from_url(REDIS_TEST_URL)
+	try:
+		redis.ping()
+	except ConnectionError:
+		pytest.skip("No Redis server at %s" % (REDIS_TEST_URL))
+	redis.flushdb()
+	yield redis
+	redis.flushdb()
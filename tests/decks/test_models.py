@@ -1,13 +1,16 @@
+from types import SimpleNamespace
 from unittest.mock import call, patch
 
 import pytest
+from django.core.cache.backends.locmem import LocMemCache
 from django_hearthstone.cards.models import Card
-from hearthstone.enums import CardClass, FormatType
+from hearthstone.enums import CardClass, CardType, FormatType
 from tests.utils import create_deck_from_deckstring
 
 from hsreplaynet.decks.models import (
-	Archetype, ClassClusterSnapshot, ClusterManager, ClusterSetSnapshot, ClusterSnapshot
+	Archetype, ClassClusterSnapshot, ClusterManager, ClusterSetSnapshot, ClusterSnapshot, Deck
 )
+from hsreplaynet.utils import _CARD_DATA_CACHE
 
 
 MECHATHUN_DRUID = {
@@ -25,6 +28,14 @@ MECHATHUN_DRUID = {
 }
 
 
+@pytest.fixture
+def signature_weights_version_cache():
+	cache = LocMemCache("signature_weights_version", {})
+	with patch("hsreplaynet.decks.models.caches", {"default": cache}):
+		yield cache
+
+
+@pytest.mark.usefixtures("signature_weights_version_cache")
 class TestClusterManager:
 
 	@pytest.mark.django_db()
@@ -50,6 +61,7 @@ class TestClusterManager:
 		)
 		self.cluster.save()
 
+		ClusterManager().invalidate_signature_weights()
 		signature_weights = ClusterManager().get_signature_weights(
 			FormatType.FT_STANDARD,
 			CardClass.DRUID
@@ -63,6 +75,75 @@ class TestClusterManager:
 			}
 		}
 
+	@pytest.mark.django_db()
+	def test_get_signature_weights_cached(self, django_assert_num_queries):
+		cluster_set = ClusterSetSnapshot(
+			game_format=FormatType.FT_STANDARD,
+			live_in_production=True
+		)
+		cluster_set.save()
+		class_cluster = ClassClusterSnapshot(
+			cluster_set=cluster_set,
+			player_class=CardClass.DRUID
+		)
+		class_cluster.save()
+
+		manager = ClusterManager()
+		manager.invalidate_signature_weights()
+		with django_assert_num_queries(1):
+			assert manager.get_signature_weights(FormatType.FT_STANDARD, CardClass.DRUID) == {}
+			assert manager.get_signature_weights(FormatType.FT_STANDARD, CardClass.DRUID) == {}
+
+		ClusterSnapshot(
+			class_cluster=class_cluster,
+			cluster_id=1,
+			external_id=247,
+			ccp_signature=MECHATHUN_DRUID
+		).save()
+
+		# Served from the cache until the signatures are invalidated
+		assert manager.get_signature_weights(FormatType.FT_STANDARD, CardClass.DRUID) == {}
+		assert 247 in manager.get_signature_weights(
+			FormatType.FT_STANDARD, CardClass.DRUID, use_cache=False
+		)
+
+		manager.invalidate_signature_weights()
+		assert 247 in manager.get_signature_weights(FormatType.FT_STANDARD, CardClass.DRUID)
+
+	@pytest.mark.django_db()
+	def test_saving_live_cluster_invalidates_signature_weights(self):
+		cluster_set = ClusterSetSnapshot(
+			game_format=FormatType.FT_STANDARD,
+			live_in_production=True
+		)
+		cluster_set.save()
+		class_cluster = ClassClusterSnapshot(
+			cluster_set=cluster_set,
+			player_class=CardClass.DRUID
+		)
+		class_cluster.save()
+
+		manager = ClusterManager()
+		manager.invalidate_signature_weights()
+		assert manager.get_signature_weights(FormatType.FT_STANDARD, CardClass.DRUID) == {}
+
+		with patch("hsreplaynet.decks.models.transaction.on_commit", lambda func: func()):
+			cluster = ClusterSnapshot(
+				class_cluster=class_cluster,
+				cluster_id=1,
+				external_id=247,
+				ccp_signature=MECHATHUN_DRUID
+			)
+			cluster.save()
+			assert 247 in manager.get_signature_weights(FormatType.FT_STANDARD, CardClass.DRUID)
+
+			cluster.required_cards = [48625]
+			cluster.save()
+			signature_weights = manager.get_signature_weights(
+				FormatType.FT_STANDARD, CardClass.DRUID
+			)
+			assert signature_weights[247]["required_cards"] == [48625]
+
 
 class TestClusterSetSnapshot:
 
@@ -103,6 +184,36 @@ class TestClusterSetSnapshot:
 		assert archetype.required_cards.first() == Card.objects.get(dbf_id=48625)
 
 
+class TestDeckManager:
+
+	@pytest.mark.django_db
+	def test_convert_hero_id_to_player_class(self, django_assert_num_queries):
+		with django_assert_num_queries(0):
+			assert Deck.objects._convert_hero_id_to_player_class(274) == CardClass.DRUID
+			assert Deck.objects._convert_hero_id_to_player_class("HERO_06") == CardClass.DRUID
+			assert Deck.objects._convert_hero_id_to_player_class(None) == CardClass.INVALID
+
+		with django_assert_num_queries(1):
+			# Fireball is not a hero
+			assert Deck.objects._convert_hero_id_to_player_class(315) == CardClass.MAGE
+
+	def test_hero_player_classes_refreshed_on_reload(self):
+		assert Deck.objects._convert_hero_id_to_player_class(274) == CardClass.DRUID
+
+		db = _CARD_DATA_CACHE["db"]
+		try:
+			_CARD_DATA_CACHE["db"] = {
+				274: SimpleNamespace(
+					card_id="HERO_06", card_class=CardClass.MAGE, type=CardType.HERO
+				)
+			}
+			assert Deck.objects._convert_hero_id_to_player_class(274) == CardClass.MAGE
+		finally:
+			_CARD_DATA_CACHE["db"] = db
+
+		assert Deck.objects._convert_hero_id_to_player_class(274) == CardClass.DRUID
+
+
 class TestDeck:
 
 	@pytest.mark.django_db
@@ -209,6 +320,43 @@ class TestDeck:
 			205,
 		]
 
+	@pytest.mark.django_db
+	def test_card_view(self, django_assert_num_queries):
+		deck = create_deck_from_deckstring(
+			"AAECAZICAA9AzQHVAYECnALwA4sEiAXmBYUGtwbQB5oI2Qr5CgA="
+		)
+		deck = Deck.objects.get(id=deck.id)
+
+		with django_assert_num_queries(1):
+			assert deck.deck_class == CardClass.DRUID
+			assert deck.format == FormatType.FT_STANDARD
+			assert deck.card_dbf_id_list()[:4] == [1050, 1050, 648, 648]
+			assert deck.card_id_list()[:4] == ["CS2_005", "CS2_005", "CS2_171", "CS2_171"]
+			assert deck.dbf_map()[64] == 2
+			assert len(deck.as_dbf_json(serialized=False)) == 15
+
+	@pytest.mark.django_db
+	def test_prefetch_cards(self, django_assert_num_queries):
+		basic = create_deck_from_deckstring(
+			"AAECAZICAA9AzQHVAYECnALwA4sEiAXmBYUGtwbQB5oI2Qr5CgA="
+		)
+		druid = create_deck_from_deckstring(
+			"AAECAZICApnTAvH7Ag5AX+kB/gHTA8QGpAf2B+QIktICmNICntICv/ICj/YCAA=="
+		)
+
+		with django_assert_num_queries(2):
+			decks = {
+				deck.id: deck
+				for deck in Deck.objects.filter(id__in=(basic.id, druid.id)).prefetch_cards()
+			}
+			for deck in decks.values():
+				assert len(deck.card_dbf_id_list()) == 30
+				assert deck.dbf_map()
+				assert deck.card_dbf_id_packed_list
+
+		assert decks[basic.id].card_id_list() == basic.card_id_list()
+		assert decks[druid.id].as_dbf_json() == druid.as_dbf_json()
+
 	@pytest.mark.django_db
 	def test_len(self):
 		deck = create_deck_from_deckstring(
@@ -248,3 +396,21 @@ class TestDeck:
 		assert claw_swipe.issuperset(claw)
 		assert claw.issuperset(claw)
 		assert not claw.issuperset(claw_swipe)
+
+	@pytest.mark.django_db
+	def test_difference(self):
+		claw_swipe = create_deck_from_deckstring("AAECAZICAkCaCAAA")
+		claw = create_deck_from_deckstring("AAECAZICAZoIAAA=")
+		assert claw_swipe.difference(claw) == {64: 1}
+		assert not claw.difference(claw_swipe)
+		assert not claw.difference(claw)
+
+	@pytest.mark.django_db
+	def test_card_dbf_id_packed_list(self):
+		deck = create_deck_from_deckstring(
+			"AAECAZICApnTAvH7Ag5AX+kB/gHTA8QGpAf2B+QIktICmNICntICv/ICj/YCAA=="
+		)
+		packed = deck.card_dbf_id_packed_list
+		assert packed == sorted(packed)
+		assert sum(count for _, count in packed) == 30
+		assert dict(packed) == deck.dbf_map()
@@ -1,7 +1,22 @@
+from hslog.export import EntityTreeExporter
 from hsreplay.document import HSReplayDocument
 from tests.conftest import LOG_DATA_DIR
 
-from hsreplaynet.games.exporters import GameDigestExporter
+from hsreplaynet.games.exporters import GameDigestExporter, GameDigestMixin
+
+
+class CountingEntityTreeExporter(EntityTreeExporter):
+	def __init__(self, packet_tree):
+		super().__init__(packet_tree)
+		self.tag_changes = 0
+
+	def handle_tag_change(self, packet):
+		self.tag_changes += 1
+		return super().handle_tag_change(packet)
+
+
+class DigestingExporter(GameDigestMixin, CountingEntityTreeExporter):
+	pass
 
 
 class TestGameDigestExporter:
@@ -165,6 +180,16 @@ class TestGameDigestExporter:
 
 			assert exporter.digest == "2eb551cb0c7b21d95fd96cdf79755b23346a2514"
 
+	def test_digest_mixin(self):
+		with open(self._replay_path("annotated.druid_vs_warlock.xml"), "r") as f:
+			replay = HSReplayDocument.from_xml_file(f)
+			exporter = DigestingExporter(replay.to_packet_tree()[0])
+			exporter.export()
+
+			assert exporter.digest == "ebb641612dd204e185bccd7764a8c5e4245d3c58"
+			assert exporter.tag_changes > 0
+			assert len(exporter.game.players) == 2
+
 	def test_digest_symmetric(self):
 		with open(self._replay_path("annotated.symmetric_a.25770.hsreplay.xml"), "r") as f1:
 			replay = HSReplayDocument.from_xml_file(f1)
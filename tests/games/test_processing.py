@@ -69,7 +69,7 @@ def test_update_replay_feed_deleted_user(mocker, user):
 	mock_replay_feed = Mock()
 	mocker.patch(
 		"hsreplaynet.games.processing.get_replay_feed",
-		new=lambda comparator: mock_replay_feed
+		new=lambda dedupe_fields: mock_replay_feed
 	)
 
 	update_replay_feed(replay)
@@ -177,6 +177,51 @@ def test_inverse_lookup_table_does_not_remove_required_card(redis):
 	assert remote_ilt.predict({1: 1, 2: 1, 4: 1}) is None
 
 
+@pytest.mark.parametrize("min_cards,max_removed,required_cards", [
+	(0, 3, set()),
+	(1, 3, set()),
+	(2, 1, set()),
+	(1, 3, {4, 5}),
+])
+def test_inverse_lookup_table_server_side_prediction_matches_client_side(
+	redis_server, min_cards, max_removed, required_cards
+):
+	ilt = RedisInverseLookupTable(
+		redis_server,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		full_deck_size=6,
+		use_lua=False
+	)
+	ilt.observe({1: 2, 2: 1, 3: 1, 4: 2}, 1)
+	ilt.observe({1: 2, 2: 1, 5: 1, 6: 2}, 2)
+	ilt.observe({1: 2, 2: 1, 5: 1, 6: 2}, 2)
+	ilt.observe({3: 2, 4: 2, 7: 2}, 3)
+
+	server_ilt, client_ilt = (RedisInverseLookupTable(
+		redis_server,
+		FormatType.FT_STANDARD,
+		CardClass.DRUID,
+		required_cards=required_cards,
+		min_cards_for_prediction=min_cards,
+		max_fuzzy_cards_removed=max_removed,
+		use_lua=use_lua
+	) for use_lua in (True, False))
+
+	assert server_ilt.predict({1: 2, 2: 1}) == 2
+	for dbf_map in (
+		{1: 1, 8: 1},
+		{8: 1, 9: 1},
+		{2: 1},
+		{3: 1, 4: 2, 8: 1},
+		{1: 2, 5: 1, 7: 1, 8: 1},
+		{1: 1, 2: 1, 3: 1, 4: 1, 8: 1, 9: 1},
+	):
+		server_prediction = (server_ilt.predict(dbf_map), server_ilt._cards_removed)
+		client_prediction = (client_ilt.predict(dbf_map), client_ilt._cards_removed)
+		assert server_prediction == client_prediction, dbf_map
+
+
 def test_inverse_lookup_table_deck_popularities_expire(redis, mock_time):
 	# 8am: observe a bunch of decks with 1h expiry
 	mock_time(datetime(2019, 1, 1, 8, 0))
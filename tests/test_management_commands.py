@@ -1,3 +1,5 @@
+import json
+import os
 from datetime import timedelta
 from io import StringIO
 
@@ -10,6 +12,9 @@ from oauth2_provider.models import get_application_model
 
 from hsreplaynet.api.partner.permissions import FEATURE
 from hsreplaynet.features.utils import feature_enabled_for_user
+from hsreplaynet.uploads.models import UploadEvent
+
+from .conftest import UPLOAD_SUITE
 
 
 def test_grant_partner_access(user):
@@ -88,3 +93,36 @@ def test_grant_partner_access_wrong_user(user):
 			noinput=True, stdout=out
 		)
 		pytest.fail("The command should raise when the application's user does not match")
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("multi_db")
+def test_benchmark_upload_processing(tmpdir):
+	upload = os.path.join(UPLOAD_SUITE, "2hwp7nDJMyWvrHQGBYTvVM")
+	budget = tmpdir.join("budget.json")
+	report = tmpdir.join("report.json")
+
+	call_command(
+		"benchmark_upload_processing", upload,
+		iterations=2, write_budget=str(budget), headroom=100, output=str(report),
+		stdout=StringIO()
+	)
+
+	results = json.loads(report.read())
+	assert results["uploads"] == 2
+	assert results["stages"]["parse"]["mean"] > 0
+	assert results["queries"]["mean"] > 0
+	assert not UploadEvent.objects.exists(), "The benchmark should not leave data behind"
+
+	out = StringIO()
+	call_command(
+		"benchmark_upload_processing", upload, iterations=1, budget=str(budget), stdout=out
+	)
+	assert "Within regression budget" in out.getvalue()
+
+	budget.write(json.dumps({"stages": {"parse": 0}}))
+	with pytest.raises(CommandError, match="parse"):
+		call_command(
+			"benchmark_upload_processing", upload,
+			iterations=1, budget=str(budget), stdout=StringIO()
+		)
@@ -1,4 +1,4 @@
-from collections import defaultdict
+from collections import Counter, defaultdict
 from datetime import datetime, timedelta
 from random import randrange
 from unittest.mock import patch
@@ -6,7 +6,9 @@ from unittest.mock import patch
 import fakeredis
 from hearthstone.enums import CardClass
 
-from hsreplaynet.api.live.distributions import get_player_class_distribution
+from hsreplaynet.api.live.distributions import (
+	get_played_cards_distribution, get_player_class_distribution, read_distributions
+)
 
 
 @patch("redis_lock.Lock")
@@ -45,3 +47,54 @@ def test_player_class_distribution(_mock_lock):
 		player_class_data = data[player_class.name]
 		assert player_class_data["games"] == actual_games[player_class.name]
 		assert player_class_data["wins"] == actual_wins[player_class.name]
+
+
+@patch("redis_lock.Lock")
+def test_read_distributions(_mock_lock):
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+	player_classes = get_player_class_distribution("FT_STANDARD", redis)
+	played_cards = get_played_cards_distribution("FT_STANDARD", redis)
+
+	# Tally the observations per 5 second bucket, as the distributions store them
+	def bucket(ts):
+		return 5 * int(ts.timestamp() / 5)
+
+	games, wins, cards = [], [], []
+	current_ts = datetime.utcnow()
+	for i in range(60):
+		t_i = current_ts - timedelta(seconds=i)
+		player_class, win = CardClass(2 + i % 9).name, bool(i % 2)
+		player_classes.increment(player_class, win=win, as_of=t_i)
+		played_cards.increment_many([i % 7, i % 11], as_of=t_i)
+		games.append((bucket(t_i), player_class))
+		if win:
+			wins.append((bucket(t_i), player_class))
+		cards.extend((bucket(t_i), str(card)) for card in (i % 7, i % 11))
+
+	def count(observations, start_ts, end_ts):
+		return Counter(
+			key for ts, key in observations if bucket(start_ts) <= ts <= bucket(end_ts)
+		)
+
+	queries = []
+	expected = []
+	for i in range(0, 31, 5):
+		end_ts = current_ts - timedelta(seconds=i)
+		start_ts = end_ts - timedelta(seconds=30)
+		queries.append((player_classes, start_ts, end_ts))
+		queries.append((played_cards, start_ts, end_ts))
+
+		class_wins = count(wins, start_ts, end_ts)
+		expected.append({
+			player_class: {"games": class_games, "wins": class_wins[player_class]}
+			for player_class, class_games in count(games, start_ts, end_ts).items()
+		})
+		expected.append(dict(count(cards, start_ts, end_ts)))
+
+	assert read_distributions(queries) == expected
+
+	# Once the summaries exist, everything is read in a single round trip
+	with patch.object(redis, "pipeline", wraps=redis.pipeline) as pipeline:
+		assert read_distributions(queries) == expected
+		assert pipeline.call_count == 1
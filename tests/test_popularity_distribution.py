@@ -173,3 +173,49 @@ def test_bucket_sizes():
 		# Assert the total number of buckets matches the expected number
 		expected_num_buckets = ceil((end_token - yesterday_start_token) / bucket_size)
 		assert len(buckets) == expected_num_buckets
+
+
+@patch("redis_lock.Lock")
+def test_increment_many(_mock_lock):
+	r = fakeredis.FakeStrictRedis()
+	r.flushall()
+	individual = RedisPopularityDistribution(r, "INDIVIDUAL", namespace="test", max_items=10)
+	batched = RedisPopularityDistribution(r, "BATCHED", namespace="test", max_items=10)
+
+	as_of = datetime.utcnow()
+	for deck in DECKS:
+		individual.increment(deck, as_of=as_of)
+	batched.increment_many(DECKS, as_of=as_of)
+
+	assert batched.distribution() == individual.distribution()
+	assert batched.size() == 10
+
+	batched.increment_many([])
+	assert batched.observations() == individual.observations()
+
+
+@patch("redis_lock.Lock")
+def test_summaries_are_maintained_incrementally(_mock_lock):
+	r = fakeredis.FakeStrictRedis()
+	r.flushall()
+	distribution = RedisPopularityDistribution(
+		r, "DECKS", namespace="test", ttl=600, max_items=2, bucket_size=5
+	)
+
+	current_ts = datetime.utcnow()
+	start_ts = current_ts - timedelta(seconds=60)
+	distribution.increment("A", as_of=start_ts)
+	distribution.increment("B", as_of=current_ts)
+	assert distribution.distribution(start_ts, current_ts) == {"A": 1, "B": 1}
+
+	with patch.object(r, "zunionstore", side_effect=AssertionError("rebuilt")):
+		distribution.increment_many(["A", "A"], as_of=current_ts)
+		assert distribution.distribution(start_ts, current_ts) == {"A": 3, "B": 1}
+
+		# Evicts "B" from the current bucket, carrying its count over to "C"
+		distribution.increment("C", as_of=current_ts)
+		assert distribution.distribution(start_ts, current_ts) == {"A": 3, "C": 2}
+
+		# Increments outside of the summarized window leave it alone
+		distribution.increment("A", as_of=start_ts - timedelta(seconds=60))
+		assert distribution.distribution(start_ts, current_ts) == {"A": 3, "C": 2}
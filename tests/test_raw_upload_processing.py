@@ -4,7 +4,7 @@ from io import BytesIO
 
 import pytest
 from django.core.exceptions import ValidationError
-from django.core.files.storage import default_storage
+from django.core.files.storage import FileSystemStorage, default_storage
 from hsreplay.document import HSReplayDocument
 from moto import mock_s3
 from storages.backends.s3boto3 import S3Boto3Storage
@@ -222,6 +222,47 @@ def test_process_raw_upload_timeout(mocker):
 	assert S3Boto3Storage.open.call_count == 2
 
 
+@pytest.mark.django_db
+@pytest.mark.usefixtures("multi_db")
+@pytest.mark.parametrize("streaming", [True, False])
+def test_process_raw_upload_reads_log_once(mocker, settings, streaming):
+	settings.UPLOAD_LOG_STREAMING_PARSE_ENABLED = streaming
+	storage_open = mocker.spy(FileSystemStorage, "open")
+
+	raw_upload = MockRawUpload(
+		os.path.join(UPLOAD_SUITE, "2hwp7nDJMyWvrHQGBYTvVM"), default_storage
+	)
+	process_raw_upload(raw_upload, False)
+
+	upload_event = UploadEvent.objects.get(shortid=raw_upload.shortid)
+	assert upload_event.status == UploadEventStatus.SUCCESS
+
+	# Validation and processing share a single read of the log from storage
+	log_reads = [
+		call for call in storage_open.call_args_list
+		if call[0][1] == upload_event.file.name
+	]
+	assert len(log_reads) == 1
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("multi_db")
+def test_process_raw_upload_closes_log_on_error(mocker):
+	mocker.patch.object(UploadEvent, "process", side_effect=RuntimeError("Boom"))
+	spool_log_file = mocker.spy(UploadEvent, "spool_log_file")
+	close_log_file = mocker.spy(UploadEvent, "close_log_file")
+
+	raw_upload = MockRawUpload(
+		os.path.join(UPLOAD_SUITE, "2hwp7nDJMyWvrHQGBYTvVM"), default_storage
+	)
+	with pytest.raises(RuntimeError):
+		process_raw_upload(raw_upload, False)
+
+	# Once before spooling the log, and again after processing failed
+	assert spool_log_file.call_count == 1
+	assert close_log_file.call_count == 2
+
+
 def validate_fuzzy_date_match(upload_date, replay_date):
 	assert upload_date.year == replay_date.year
 	assert upload_date.month == replay_date.month
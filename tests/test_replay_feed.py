@@ -1,15 +1,22 @@
 from datetime import datetime, timedelta
 
 import fakeredis
+import pytest
 
 from hsreplaynet.utils.redis import CappedDataFeed
 
 
-def comparator(d1, d2):
-	return (
-		d1["field"] == d2["field"] and
-		d1["field2"] == d2["field2"]
-	)
+DEDUPE_FIELDS = ["field", "field2"]
+
+
+@pytest.fixture(params=["fakeredis", "redis_server"])
+def redis(request):
+	"""The Python path runs against fakeredis, the Lua scripts against a Redis server."""
+	if request.param == "redis_server":
+		return request.getfixturevalue("redis_server")
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+	return redis
 
 
 def get_data(id):
@@ -20,10 +27,7 @@ def get_data(id):
 	}
 
 
-def test_comparator():
-	redis = fakeredis.FakeStrictRedis()
-	redis.flushall()
-
+def test_dedupe_fields(redis):
 	data_1 = get_data("1")
 
 	feed = CappedDataFeed(
@@ -31,7 +35,7 @@ def test_comparator():
 		name="TEST_FEED",
 		max_items=10,
 		period=0,
-		comparator=comparator
+		dedupe_fields=DEDUPE_FIELDS
 	)
 
 	pushed = feed.push(data_1)
@@ -45,10 +49,7 @@ def test_comparator():
 	assert len(items) == 1
 
 
-def test_period():
-	redis = fakeredis.FakeStrictRedis()
-	redis.flushall()
-
+def test_period(redis):
 	data_1 = get_data("1")
 	data_2 = get_data("2")
 
@@ -57,7 +58,7 @@ def test_period():
 		name="TEST_FEED",
 		max_items=10,
 		period=1,
-		comparator=comparator
+		dedupe_fields=DEDUPE_FIELDS
 	)
 
 	pushed = feed.push(data_1)
@@ -83,10 +84,7 @@ def test_period():
 	assert items[1]["id"] == data_2["id"]
 
 
-def test_fast_backfill():
-	redis = fakeredis.FakeStrictRedis()
-	redis.flushall()
-
+def test_fast_backfill(redis):
 	data_1 = get_data("1")
 	data_2 = get_data("2")
 	feed = CappedDataFeed(
@@ -94,7 +92,7 @@ def test_fast_backfill():
 		name="TEST_FEED",
 		max_items=2,
 		period=1,
-		comparator=comparator,
+		dedupe_fields=DEDUPE_FIELDS,
 		fast_backfill=True
 	)
 
@@ -117,10 +115,7 @@ def test_fast_backfill():
 	assert items[1]["id"] == data_2["id"]
 
 
-def test_max_items():
-	redis = fakeredis.FakeStrictRedis()
-	redis.flushall()
-
+def test_max_items(redis):
 	data_1 = get_data("1")
 	data_2 = get_data("2")
 	data_3 = get_data("3")
@@ -130,7 +125,7 @@ def test_max_items():
 		name="TEST_FEED",
 		max_items=2,
 		period=0,
-		comparator=comparator
+		dedupe_fields=DEDUPE_FIELDS
 	)
 
 	pushed = feed.push(data_1)
@@ -158,3 +153,18 @@ def test_max_items():
 
 	assert len(redis.lrange(feed.key, 0, -1)) == 2
 	assert not redis.hgetall(key_1)
+
+
+def test_dedupe_fields_non_string_values(redis):
+	feed = CappedDataFeed(
+		redis=redis,
+		name="TEST_FEED",
+		max_items=10,
+		period=0,
+		dedupe_fields=["rank", "won"]
+	)
+
+	assert feed.push({"id": "1", "rank": 5, "won": True})
+	assert not feed.push({"id": "2", "rank": 5, "won": True})
+	assert feed.push({"id": "3", "rank": 5, "won": False})
+	assert [item["id"] for item in feed.get()] == ["1", "3"]
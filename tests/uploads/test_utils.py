@@ -1,4 +1,8 @@
-from hsreplaynet.uploads.utils import user_agent_product
+from io import StringIO
+
+import pytest
+
+from hsreplaynet.uploads.utils import iter_decoded_lines, user_agent_product
 
 
 def test_user_agent_product():
@@ -21,3 +25,26 @@ def test_user_agent_product_invalid():
 	assert user_agent_product("") is None
 	assert user_agent_product("/") is None
 	assert user_agent_product(";") is None
+
+
+def _chunked(data, size):
+	return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+def test_iter_decoded_lines():
+	text = "D 00:00:01 GameState.DebugPrintPower()\nD 00:00:02 Ænder ☃\r\n\nlast line"
+	data = text.encode("utf-8")
+	expected = list(StringIO(text))
+
+	for chunk_size in (1, 2, 3, 7, len(data)):
+		assert list(iter_decoded_lines(_chunked(data, chunk_size))) == expected
+
+
+def test_iter_decoded_lines_trailing_newline():
+	assert list(iter_decoded_lines([b"a\n", b"b\n"])) == ["a\n", "b\n"]
+	assert list(iter_decoded_lines([])) == []
+
+
+def test_iter_decoded_lines_invalid():
+	with pytest.raises(UnicodeDecodeError):
+		list(iter_decoded_lines([b"abc\xff\n"]))
@@ -0,0 +1,135 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from influxdb import InfluxDBClient
+
+from hsreplaynet.utils import influx
+from hsreplaynet.utils.influx import BufferedInfluxWriter
+
+
+class InfluxStandIn(HTTPServer):
+	"""A local HTTP server accepting Influx line protocol writes."""
+
+	def __init__(self):
+		super().__init__(("127.0.0.1", 0), InfluxStandInHandler)
+		self.writes = []
+
+	@property
+	def lines(self):
+		return [line for write in self.writes for line in write]
+
+
+class InfluxStandInHandler(BaseHTTPRequestHandler):
+
+	def do_POST(self):
+		body = self.rfile.read(int(self.headers["Content-Length"]))
+		self.server.writes.append(body.decode("utf-8").strip().split("\n"))
+		self.send_response(204)
+		self.end_headers()
+
+	def log_message(self, *args):
+		pass
+
+
+@pytest.fixture
+def influx_server():
+	server = InfluxStandIn()
+	thread = threading.Thread(target=server.serve_forever, daemon=True)
+	thread.start()
+	yield server
+	server.shutdown()
+	server.server_close()
+
+
+@pytest.fixture
+def influx_client(influx_server):
+	return InfluxDBClient(
+		host=influx_server.server_address[0],
+		port=influx_server.server_address[1],
+		database="hsreplaynet",
+	)
+
+
+def _point(value):
+	return {
+		"measurement": "test_metric",
+		"tags": {},
+		"fields": {"value": value},
+		"time": 1000000000 + value,
+	}
+
+
+def _wait_for(predicate, timeout=5):
+	deadline = time.monotonic() + timeout
+	while not predicate():
+		assert time.monotonic() < deadline
+		time.sleep(0.01)
+
+
+class TestBufferedInfluxWriter:
+
+	def test_flush(self, influx_server, influx_client):
+		writer = BufferedInfluxWriter(influx_client, batch_size=100, max_age=60)
+		for i in range(3):
+			writer.write([_point(i)])
+
+		assert influx_server.writes == []
+		assert writer.flush()
+
+		assert influx_server.writes == [[
+			"test_metric value=0i 1000000000",
+			"test_metric value=1i 1000000001",
+			"test_metric value=2i 1000000002",
+		]]
+		assert writer.flush()
+		assert len(influx_server.writes) == 1
+
+	def test_flush_by_size(self, influx_server, influx_client):
+		writer = BufferedInfluxWriter(influx_client, batch_size=2, max_age=60)
+		writer.write([_point(0)])
+		writer.write([_point(1)])
+
+		_wait_for(lambda: len(influx_server.lines) == 2)
+		assert len(influx_server.writes) == 1
+
+	def test_flush_by_age(self, influx_server, influx_client):
+		writer = BufferedInfluxWriter(influx_client, batch_size=100, max_age=0.1)
+		writer.write([_point(0)])
+
+		_wait_for(lambda: len(influx_server.lines) == 1)
+
+	def test_max_pending(self, influx_server, influx_client):
+		writer = BufferedInfluxWriter(influx_client, batch_size=100, max_age=60, max_pending=2)
+		for i in range(3):
+			writer.write([_point(i)])
+		writer.flush()
+
+		assert influx_server.lines == [
+			"test_metric value=1i 1000000001",
+			"test_metric value=2i 1000000002",
+		]
+
+	def test_disabled(self):
+		writer = BufferedInfluxWriter(None)
+		writer.write([_point(0)])
+		assert writer.flush()
+
+
+def test_influx_metric_buffering(mocker, settings, influx_server, influx_client):
+	settings.INFLUX_ENABLED = True
+	settings.INFLUX_BUFFERED_WRITES_ENABLED = True
+	mocker.patch.object(influx, "influx", influx_client)
+	mocker.patch.dict(influx._influx_writers, clear=True)
+	mocker.patch("hsreplaynet.utils.influx.atexit")
+
+	# Written right away unless buffering was enabled for the process
+	influx.influx_metric("test_metric", {"value": 0}, timestamp=1000000000)
+	assert influx_server.lines == ["test_metric value=0i 1000000000"]
+
+	influx.enable_influx_buffering()
+	influx.influx_metric("test_metric", {"value": 1}, timestamp=1000000001)
+	assert len(influx_server.lines) == 1
+	influx.influx_flush()
+	assert influx_server.lines[1:] == ["test_metric value=1i 1000000001"]
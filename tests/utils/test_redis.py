@@ -0,0 +1,94 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import fakeredis
+
+from hsreplaynet.utils.redis import RedisCounter, RedisExpiringSet
+
+
+class RoundTripCountingRedis(fakeredis.FakeStrictRedis):
+	"""Counts pipeline executions and WATCHes, i.e. round trips an increment makes."""
+
+	def __init__(self, *args, **kwargs):
+		super().__init__(*args, **kwargs)
+		self.executes = 0
+		self.watches = 0
+
+	def pipeline(self, transaction=True, shard_hint=None):
+		pipe = super().pipeline(transaction, shard_hint)
+		execute, watch = pipe.execute, pipe.watch
+
+		def counted_execute(*args, **kwargs):
+			self.executes += 1
+			return execute(*args, **kwargs)
+
+		def counted_watch(*args, **kwargs):
+			self.watches += 1
+			return watch(*args, **kwargs)
+
+		pipe.execute, pipe.watch = counted_execute, counted_watch
+		return pipe
+
+
+def get_counter(redis):
+	redis.flushall()
+	return RedisCounter(redis, "TEST_COUNTER", bucket_size=60, ttl=600)
+
+
+def test_counter_increment():
+	redis = fakeredis.FakeStrictRedis()
+	counter = get_counter(redis)
+
+	assert counter.increment() == 1
+	assert counter.increment(amount=5) == 6
+	assert counter.get_count(0, 0) == 6
+
+	key = counter._bucket_key(0)
+	assert 0 < redis.ttl(key) <= 600
+
+
+def test_counter_increment_single_round_trip():
+	redis = RoundTripCountingRedis()
+	counter = get_counter(redis)
+
+	counter.increment()
+
+	assert redis.executes == 1
+	assert redis.watches == 0
+
+
+def test_counter_concurrent_increments():
+	redis = fakeredis.FakeStrictRedis()
+	counter = get_counter(redis)
+	workers, increments = 8, 250
+
+	def work(_):
+		for i in range(increments):
+			counter.increment()
+
+	with ThreadPoolExecutor(max_workers=workers) as executor:
+		list(executor.map(work, range(workers)))
+
+	assert counter.get_count(0, 0) == workers * increments
+
+
+def test_expiring_set():
+	redis = fakeredis.FakeStrictRedis()
+	redis.flushall()
+	expiring_set = RedisExpiringSet(redis, "TEST_SET", ttl=60)
+
+	expiring_set.add("1", "2")
+	expiring_set.add(3)
+	assert sorted(expiring_set.members()) == ["1", "2", "3"]
+
+	expiring_set.discard("2")
+	assert sorted(expiring_set.members()) == ["1", "3"]
+
+	redis.zadd(expiring_set.key, **{"3": datetime.utcnow().timestamp() + 30})
+	assert expiring_set.members(min_age=20) == ["3"]
+
+	# Members drop out once they haven't been added for longer than the ttl
+	redis.zadd(expiring_set.key, **{"1": datetime.utcnow().timestamp() - 1})
+	assert expiring_set.members() == ["3"]
+	expiring_set.add("4")
+	assert redis.zcard(expiring_set.key) == 2
@@ -0,0 +1,58 @@
+import pytest
+
+from hsreplaynet.utils.aws import redshift
+
+
+# The test Postgres server stands in for Redshift; the "postgres" database always exists
+DATABASE = "postgres"
+
+
+@pytest.fixture
+def redshift_engines(settings):
+	settings.REDSHIFT_DATABASE = dict(
+		settings.REDSHIFT_DATABASE,
+		ETL_USER=settings.REDSHIFT_DATABASE["USER"],
+		ETL_PASSWORD=settings.REDSHIFT_DATABASE["PASSWORD"],
+	)
+	settings.REDSHIFT_ENGINE_POOL_SIZE = 1
+	redshift.dispose_redshift_engines()
+	yield
+	redshift.dispose_redshift_engines()
+
+
+def _backend_pid(engine):
+	with engine.connect() as conn:
+		return conn.execute("SELECT pg_backend_pid()").scalar()
+
+
+@pytest.mark.usefixtures("redshift_engines")
+class TestRedshiftEngines:
+
+	def test_engine_per_credential_set(self):
+		engine = redshift.get_redshift_engine(database=DATABASE)
+
+		assert redshift.get_redshift_engine(database=DATABASE) is engine
+		assert redshift.get_redshift_engine(etl_user=True, database=DATABASE) is not engine
+		assert redshift.get_redshift_engine() is not engine
+
+	def test_connections_are_reused(self):
+		engine = redshift.get_redshift_engine(database=DATABASE)
+
+		assert _backend_pid(engine) == _backend_pid(engine)
+
+	def test_stale_connections_are_replaced(self):
+		engine = redshift.get_redshift_engine(database=DATABASE)
+		pid = _backend_pid(engine)
+
+		other = redshift.create_redshift_engine(database=DATABASE)
+		with other.connect() as conn:
+			conn.execute("SELECT pg_terminate_backend(%s)", pid)
+		other.dispose()
+
+		assert _backend_pid(engine) != pid
+
+	def test_pooling_disabled(self, settings):
+		settings.REDSHIFT_ENGINE_POOL_SIZE = 0
+		engine = redshift.get_redshift_engine(database=DATABASE)
+
+		assert _backend_pid(engine) != _backend_pid(engine)
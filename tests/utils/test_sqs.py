@@ -0,0 +1,104 @@
+import json
+import threading
+import time
+
+import pytest
+from botocore.exceptions import ClientError
+
+from hsreplaynet.utils.aws import sqs
+
+
+class SQSStandIn:
+	"""A local stand-in for the SQS client, taking `latency` seconds per batch."""
+
+	def __init__(self, latency=0.01, failing_batches=()):
+		self.latency = latency
+		self.failing_batches = failing_batches
+		self.create_queue_calls = 0
+		self.queue_exists = False
+		self.messages = []
+		self.lock = threading.Lock()
+		self.in_flight = 0
+		self.max_in_flight = 0
+
+	def create_queue(self, QueueName):
+		self.create_queue_calls += 1
+		self.queue_exists = True
+		return {"QueueUrl": "https://queue.local/%s" % (QueueName)}
+
+	def send_message_batch(self, QueueUrl, Entries):
+		if not self.queue_exists:
+			raise ClientError({"Error": {
+				"Code": "AWS.SimpleQueueService.NonExistentQueue"
+			}}, "SendMessageBatch")
+		with self.lock:
+			self.in_flight += 1
+			self.max_in_flight = max(self.max_in_flight, self.in_flight)
+		try:
+			time.sleep(self.latency)
+			bodies = [json.loads(entry["MessageBody"]) for entry in Entries]
+			if bodies[0]["i"] // sqs.SQS_MAX_BATCH_SIZE in self.failing_batches:
+				return {"Failed": [{"Id": entry["Id"]} for entry in Entries]}
+			with self.lock:
+				self.messages.extend(bodies)
+			return {"Successful": [{"Id": entry["Id"]} for entry in Entries]}
+		finally:
+			with self.lock:
+				self.in_flight -= 1
+
+	def receive_message(self, QueueUrl, MaxNumberOfMessages):
+		with self.lock:
+			messages = self.messages[:MaxNumberOfMessages]
+			del self.messages[:MaxNumberOfMessages]
+		return {"Messages": [{"Body": json.dumps(message)} for message in messages]}
+
+
+@pytest.fixture
+def sqs_stand_in(mocker):
+	stand_in = SQSStandIn()
+	mocker.patch.object(sqs, "SQS", stand_in)
+	mocker.patch.object(sqs, "_queue_urls", {})
+	return stand_in
+
+
+def test_write_messages_to_queue(sqs_stand_in):
+	messages = [{"i": i} for i in range(95)]
+
+	sqs.write_messages_to_queue("TEST_QUEUE", messages, max_in_flight=4)
+	sqs.write_messages_to_queue("TEST_QUEUE", messages[:5], max_in_flight=4)
+
+	assert sorted(sqs_stand_in.messages, key=lambda m: m["i"]) == \
+		sorted(messages + messages[:5], key=lambda m: m["i"])
+	assert sqs_stand_in.max_in_flight == 4
+	assert sqs_stand_in.create_queue_calls == 1
+
+
+def test_write_messages_to_queue_recreated_queue(sqs_stand_in):
+	sqs.write_messages_to_queue("TEST_QUEUE", [{"i": 0}])
+
+	# The queue was deleted, the cached URL is dropped and the queue created again
+	sqs_stand_in.queue_exists = False
+	sqs.write_messages_to_queue("TEST_QUEUE", [{"i": 1}])
+
+	assert sqs_stand_in.messages == [{"i": 0}, {"i": 1}]
+	assert sqs_stand_in.create_queue_calls == 2
+
+
+def test_write_messages_to_queue_failure(sqs_stand_in):
+	sqs_stand_in.failing_batches = (1, )
+	messages = [{"i": i} for i in range(30)]
+
+	with pytest.raises(RuntimeError):
+		sqs.write_messages_to_queue("TEST_QUEUE", messages)
+
+	# The other batches are still sent
+	sent = sorted(message["i"] for message in sqs_stand_in.messages)
+	assert sent == list(range(10)) + list(range(20, 30))
+
+
+def test_get_messages(sqs_stand_in):
+	sqs.write_messages_to_queue("TEST_QUEUE", [{"i": i} for i in range(25)])
+
+	assert len(sqs.get_messages("TEST_QUEUE", max_num=15)) == 20
+	assert len(sqs.get_messages("TEST_QUEUE", max_num=15)) == 5
+	assert sqs_stand_in.create_queue_calls == 1
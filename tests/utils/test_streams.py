@@ -0,0 +1,179 @@
+import pytest
+from botocore.exceptions import ClientError
+
+from hsreplaynet.utils.aws.streams import (
+	FIREHOSE_MAX_BATCH_RECORDS, FIREHOSE_THROTTLING_ERROR,
+	BufferedFirehoseWriter, FirehoseWriteError, publish_batch_to_firehose
+)
+
+
+class FirehoseStub:
+	"""
+	A local stand-in for the Firehose client's put_record_batch.
+	The first `throttled_calls` calls reject the records at `throttled_indexes` with
+	`error_code`, or throttle the whole call if those aren't given.
+	"""
+
+	def __init__(
+		self, throttled_calls=0, throttled_indexes=None, error_code=FIREHOSE_THROTTLING_ERROR
+	):
+		self.throttled_calls = throttled_calls
+		self.throttled_indexes = throttled_indexes
+		self.error_code = error_code
+		self.calls = []
+		self.delivered = []
+
+	def put_record_batch(self, DeliveryStreamName, Records):
+		self.calls.append(Records)
+		throttle = len(self.calls) <= self.throttled_calls
+
+		if throttle and self.throttled_indexes is None:
+			raise ClientError(
+				{"Error": {"Code": FIREHOSE_THROTTLING_ERROR, "Message": "Slow down."}},
+				"PutRecordBatch"
+			)
+
+		responses = []
+		for i, record in enumerate(Records):
+			if throttle and i in self.throttled_indexes:
+				responses.append({
+					"ErrorCode": self.error_code,
+					"ErrorMessage": "Slow down.",
+				})
+			else:
+				self.delivered.append(record["Data"])
+				responses.append({"RecordId": str(len(self.delivered))})
+
+		return {
+			"FailedPutCount": sum("ErrorCode" in r for r in responses),
+			"RequestResponses": responses,
+		}
+
+
+def _records(count):
+	return ["%i|1|2018-01-01 00:00:00\n" % (i) for i in range(count)]
+
+
+def _delivered_records(stub):
+	return b"".join(stub.delivered).decode("utf-8").splitlines(keepends=True)
+
+
+def test_buffered_firehose_writer_coalesces_records():
+	stub = FirehoseStub()
+	records = _records(10000)
+
+	with BufferedFirehoseWriter("STREAM", client=stub, blob_size=1000) as writer:
+		for record in records:
+			writer.put(record)
+
+	assert _delivered_records(stub) == records
+	assert all(len(blob) <= 1000 for blob in stub.delivered)
+	assert all(len(call) <= FIREHOSE_MAX_BATCH_RECORDS for call in stub.calls)
+	assert len(stub.calls) == 1 + len(stub.delivered) // FIREHOSE_MAX_BATCH_RECORDS
+	assert writer.sent_count == len(stub.delivered)
+	assert writer.failed_count == 0
+
+
+def test_buffered_firehose_writer_retries_throttled_records(mocker):
+	sleep = mocker.patch("hsreplaynet.utils.aws.streams.time.sleep")
+	stub = FirehoseStub(throttled_calls=1, throttled_indexes={0, 2})
+	records = _records(50)
+
+	writer = BufferedFirehoseWriter("STREAM", client=stub, blob_size=100)
+	for record in records:
+		writer.put(record)
+	writer.flush()
+
+	# Only the throttled records are sent again, after a jittered backoff
+	assert len(stub.calls[1]) == 2
+	assert sorted(_delivered_records(stub)) == sorted(records)
+	assert sleep.call_count == 1
+	assert 0 <= sleep.call_args[0][0] <= 0.1
+	assert writer.bytes_per_second < writer.max_bytes_per_second
+
+
+def test_buffered_firehose_writer_adapts_rate(mocker):
+	mocker.patch("hsreplaynet.utils.aws.streams.time.sleep")
+	metric = mocker.patch("hsreplaynet.utils.aws.streams.influx_metric")
+	stub = FirehoseStub(throttled_calls=3)
+
+	writer = BufferedFirehoseWriter(
+		"STREAM", client=stub, max_bytes_per_second=1000, min_bytes_per_second=200
+	)
+	writer.put(_records(1)[0])
+	writer.flush()
+
+	# Halved on every throttled call down to the minimum, then recovering
+	assert len(stub.calls) == 4
+	assert writer.bytes_per_second == 300
+	assert writer.sent_count == 1
+
+	# The retries are made by publish_batch_to_firehose
+	measure, fields = metric.call_args[0]
+	assert measure == "firehose_publish_batch"
+	assert fields["attempts"] == 4
+
+
+def test_buffered_firehose_writer_drops_after_max_attempts(mocker):
+	mocker.patch("hsreplaynet.utils.aws.streams.time.sleep")
+	stub = FirehoseStub(throttled_calls=10)
+
+	writer = BufferedFirehoseWriter("STREAM", client=stub, max_attempts=3)
+	writer.put(_records(1)[0])
+	with pytest.raises(FirehoseWriteError):
+		writer.flush()
+
+	assert len(stub.calls) == 3
+	assert writer.sent_count == 0
+	assert writer.failed_count == 1
+
+
+def test_buffered_firehose_writer_does_not_flush_on_error():
+	stub = FirehoseStub()
+
+	with pytest.raises(RuntimeError):
+		with BufferedFirehoseWriter("STREAM", client=stub) as writer:
+			writer.put(_records(1)[0])
+			raise RuntimeError("Boom")
+
+	assert stub.calls == []
+
+
+def test_publish_batch_to_firehose_resubmits_failed_records(mocker):
+	sleep = mocker.patch("hsreplaynet.utils.aws.streams.time.sleep")
+	metric = mocker.patch("hsreplaynet.utils.aws.streams.influx_metric")
+	stub = FirehoseStub(
+		throttled_calls=2, throttled_indexes={0, 3}, error_code="InternalFailure"
+	)
+	batch = [{"Data": record.encode("utf-8")} for record in _records(5)]
+
+	failures = publish_batch_to_firehose("STREAM", batch, client=stub, base_delay=1)
+
+	assert failures == []
+	assert [len(call) for call in stub.calls] == [5, 2, 1]
+	assert stub.calls[1] == [batch[0], batch[3]]
+	assert sorted(stub.delivered) == sorted(record["Data"] for record in batch)
+
+	# Jittered, exponentially growing backoff between attempts
+	assert sleep.call_count == 2
+	assert 0 <= sleep.call_args_list[0][0][0] <= 1
+	assert 0 <= sleep.call_args_list[1][0][0] <= 2
+
+	measure, fields = metric.call_args[0]
+	assert measure == "firehose_publish_batch"
+	assert fields["records"] == 5
+	assert fields["failed"] == 0
+	assert fields["attempts"] == 3
+
+
+def test_publish_batch_to_firehose_attempt_budget(mocker):
+	mocker.patch("hsreplaynet.utils.aws.streams.time.sleep")
+	mocker.patch("hsreplaynet.utils.aws.streams.influx_metric")
+	stub = FirehoseStub(throttled_calls=10)
+	batch = [{"Data": record.encode("utf-8")} for record in _records(3)]
+
+	failures = publish_batch_to_firehose("STREAM", batch, client=stub, max_attempts=4)
+
+	assert len(stub.calls) == 4
+	assert [failure["record"] for failure in failures] == batch
+	assert all(failure["error_code"] == FIREHOSE_THROTTLING_ERROR for failure in failures)
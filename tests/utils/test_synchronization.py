@@ -0,0 +1,71 @@
+import threading
+import time
+
+from hsreplaynet.utils.synchronization import dispatch_bounded
+
+
+class StubInvoker:
+	"""Simulates invocations that take `delays[payload]` seconds, or fail for `failures`."""
+
+	def __init__(self, delays=None, failures=()):
+		self.delays = delays or {}
+		self.failures = failures
+		self.lock = threading.Lock()
+		self.running = 0
+		self.max_running = 0
+
+	def __call__(self, payload):
+		with self.lock:
+			self.running += 1
+			self.max_running = max(self.max_running, self.running)
+		try:
+			time.sleep(self.delays.get(payload, 0.01))
+			if payload in self.failures:
+				raise ValueError(payload)
+		finally:
+			with self.lock:
+				self.running -= 1
+
+
+def test_dispatch_bounded():
+	invoker = StubInvoker(failures=("b", "d"))
+	items = [(key.upper(), key) for key in "abcdef"]
+
+	report = dispatch_bounded(items, invoker, max_workers=2)
+
+	assert sorted(report.succeeded) == ["A", "C", "E", "F"]
+	assert sorted(report.failed) == ["B", "D"]
+	assert isinstance(report.failed["B"], ValueError)
+	assert report.timed_out == []
+	assert invoker.max_running == 2
+
+
+def test_dispatch_bounded_timeout():
+	invoker = StubInvoker(delays={"slow": 2})
+	items = [("SLOW", "slow")] + [(str(i), str(i)) for i in range(6)]
+
+	start = time.monotonic()
+	report = dispatch_bounded(items, invoker, max_workers=3, timeout=0.2)
+
+	# The slow record doesn't hold up the rest of the batch
+	assert time.monotonic() - start < 1
+	assert report.timed_out == ["SLOW"]
+	assert sorted(report.succeeded) == [str(i) for i in range(6)]
+
+
+def test_dispatch_bounded_deadline():
+	invoker = StubInvoker(delays={"slow": 2})
+	items = [("SLOW", "slow"), ("QUEUED", "queued")]
+
+	start = time.monotonic()
+	report = dispatch_bounded(items, invoker, max_workers=1, deadline=start + 0.2)
+
+	# The queued record never gets to start before the deadline
+	assert time.monotonic() - start < 1
+	assert sorted(report.timed_out) == ["QUEUED", "SLOW"]
+	assert report.succeeded == []
+
+
+def test_dispatch_bounded_empty():
+	report = dispatch_bounded([], StubInvoker(), max_workers=4)
+	assert report == ([], {}, [])